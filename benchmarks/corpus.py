@@ -0,0 +1,69 @@
+"""Synthetic note stores for benchmarking.
+
+Notes are generated from a fixed seed, so a given size always produces the
+same store: content lengths are log-normal (mostly a line or two, with a
+tail of long multi-line notes), words and tags follow a Zipf-like
+distribution, and about a fifth of the notes are archived.  The store is
+written with journal.replace, i.e. exactly as the JSON backend leaves it,
+archived notes in the cold segment.
+"""
+import random
+from datetime import datetime, timedelta
+from note import journal
+
+ARCHIVED_RATIO = 0.2
+TAG_POOL = 60
+VOCABULARY = 5000
+SPAN = timedelta(days=3 * 365)
+
+# Real words mixed into the vocabulary so benchmarks have something to search for.
+COMMON_WORDS = [
+    "nginx", "deploy", "backup", "meeting", "invoice", "python", "release", "review",
+    "database", "migration", "todo", "call", "groceries", "flight", "budget", "ssl",
+]
+
+def _words(rnd, count):
+    syllables = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "de", "ga", "vi", "ro", "an", "el", "or"]
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < count:
+        word = "".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def _zipf_weights(count):
+    return [1 / (rank + 1) for rank in range(count)]
+
+def generate(count, seed=0):
+    """Return a ``{id: note}`` dict of ``count`` notes in insertion order."""
+    rnd = random.Random(seed)
+    words = _words(rnd, VOCABULARY)
+    word_weights = _zipf_weights(len(words))
+    tags = [f"tag{i}" for i in range(TAG_POOL)]
+    tag_weights = _zipf_weights(len(tags))
+    start = datetime(2022, 1, 1)
+    step = SPAN / max(count, 1)
+    db = {}
+    for i in range(count):
+        length = min(int(rnd.lognormvariate(3, 1)) + 1, 2000)  # in words; median ~20
+        text = rnd.choices(words, word_weights, k=length)
+        for j in range(12, len(text), 12):
+            if rnd.random() < 0.3:
+                text[j] += "\n"
+        archived = rnd.random() < ARCHIVED_RATIO
+        ts = start + step * i
+        db[f"{i:08x}"] = {
+            "timestamp": ts.isoformat(),
+            "content": " ".join(text).replace("\n ", "\n"),
+            "tags": list(dict.fromkeys(rnd.choices(tags, tag_weights, k=rnd.choice((0, 1, 1, 2, 3))))),
+            "archived": archived,
+            "archived_at": (ts + timedelta(days=30)).isoformat() if archived else None,
+        }
+    return db
+
+def write(db_path, count, seed=0):
+    db = generate(count, seed)
+    journal.replace(db_path, db)
+    return db
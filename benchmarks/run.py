@@ -0,0 +1,256 @@
+"""Time every note command against synthetic stores.
+
+    python -m benchmarks.run --sizes 1k 10k 100k --out results.json
+    python -m benchmarks.run --sizes 10k --baseline results.json
+
+Each command runs as its own process with HOME pointing at a generated
+store, so the timings include interpreter startup and everything a real
+invocation pays for.  Commands that change the store run against a fresh
+copy each time.  Results are written as JSON with percentiles and the peak
+resident memory per size and command; with ``--baseline`` the median of
+each is compared against a saved run and the exit status is non-zero if
+anything got slower than ``--threshold`` allows or a command went over its
+budget.
+
+Budgets are only set for commands that touch a single note, whose time
+should not grow with the store; everything that reads or rewrites the whole
+store (list, search, tags, archive, backup, restore, export, import...) is
+held to its baseline instead.  The SQLite backend has no budgets yet, only
+baselines.  Commands not timed: ``add``, ``edit`` and the picker itself
+need an editor or a terminal (``picker_lines`` times the part that reads the
+store); ``preview`` is ``view`` by ID; ``sync`` and ``migrate`` need a
+second store; and the ``--where``/``--search`` forms of ``del``, ``tagadd``
+and ``tagrm``, ``--delete-all`` and restoring a snapshot take the same
+paths as ``search``, ``import``, ``save_db`` and ``restore``.
+"""
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, time
+from datetime import datetime
+from benchmarks import corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, arguments or python code, needs a fresh store for every run)
+OPERATIONS = [
+    ("quick_add", ["benchmark note", "--tags", "bench"], False),
+    ("list", ["list"], False),
+    ("list_all", ["list", "-a"], False),
+    ("list_page", ["list", "--reverse", "--limit", "20"], False),
+    ("view", ["view", "{middle}"], False),
+    ("search", ["search", "nginx"], False),
+    ("search_top", ["search", "nginx", "ssl", "--top", "10"], False),
+    ("search_regex", ["search", "--regex", "ngin.*deploy"], False),
+    ("stats", ["stats", "--by-day"], False),
+    ("tags", ["tags"], False),
+    ("tag_counts", ["tags", "--counts"], False),
+    ("tagged", ["tags", "tag1"], False),
+    ("tagadd", ["tagadd", "{middle}", "bench"], False),
+    ("tagrm", ["tagrm", "{middle}", "primed"], True),
+    ("append", ["append", "{middle}", "benchmark text"], False),
+    ("del", ["del", "{middle}"], True),
+    ("archive", ["--archive", "365"], True),
+    ("backup", ["backup", "{work}/backup.json"], False),
+    ("backup_incr", ["backup", "--incremental", "{work}/snapshots"], False),
+    ("restore", ["restore", "{work}/saved.json"], True),
+    ("export", ["export", "--all", "{work}/export.jsonl"], False),
+    ("import", ["import", "{work}/import.jsonl"], True),
+    ("dedupe", ["dedupe"], False),
+    ("picker_lines", "from note import cli; list(cli.picker_lines(cli.get_store().listing()))", False),
+    ("load_db", "from note import cli; cli.load_db()", False),
+    ("save_db", "from note import cli; cli.save_db(cli.load_db())", True),
+]
+
+# Median seconds a command may take at any size, startup included, per backend.
+BUDGETS = {
+    "json": {"quick_add": 0.1, "view": 0.2, "append": 0.2, "tagadd": 0.25, "tagrm": 0.25, "del": 0.25},
+}
+
+# What commands that prompt are told.
+ANSWERS = {"del": "y\n", "restore": "y\n"}
+
+# Builds every index so the timed runs see a store that has been used before,
+# and leaves a tag for tagrm to take off and a backup for restore to read.
+PRIME = [["list"], ["view", "1"], ["search", "nginx"], ["tags"],
+         ["tagadd", "{middle}", "primed"], ["backup", "{work}/saved.json"]]
+IMPORT_NOTES = 1000  # in the file import reads
+
+def parse_size(text):
+    scale = {"k": 1000, "m": 1000000}.get(text[-1].lower(), 1)
+    return int(text[:-1] if scale > 1 else text) * scale
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summarize(times, peaks):
+    return {
+        "runs": len(times),
+        "peak_rss_mb": max(peaks) / (1 << 20) if all(p is not None for p in peaks) else None,
+        "min": min(times),
+        "mean": sum(times) / len(times),
+        "p50": percentile(times, 50),
+        "p90": percentile(times, 90),
+        "p99": percentile(times, 99),
+        "max": max(times),
+    }
+
+def command(op, values):
+    if isinstance(op, str):
+        return [sys.executable, "-c", op]
+    return [sys.executable, "-m", "note.client"] + [arg.format(**values) for arg in op]
+
+def run(cmd, env, answer=None):
+    """Run a command; return its wall time and peak RSS in bytes (None where unknown)."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=ROOT, stdin=subprocess.PIPE if answer else subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if answer:
+        proc.stdin.write(answer.encode())
+        proc.stdin.close()
+    if not hasattr(os, "wait4"):  # Windows
+        proc.wait()
+        return time.perf_counter() - start, None
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return elapsed, usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def copy_store(src_dir, dest_dir):
+    # The snapshot is only ever replaced, never written in place, so a hard
+    # link keeps its inode -- and with it every index built for it -- valid.
+    os.mkdir(dest_dir)
+    for name in os.listdir(src_dir):
+        src, dest = os.path.join(src_dir, name), os.path.join(dest_dir, name)
+        if name == ".notes_db.json":
+            os.link(src, dest)
+        else:
+            shutil.copy2(src, dest)
+
+def restore(pristine, home):
+    shutil.rmtree(home)
+    copy_store(pristine, home)
+
+def bench_size(count, args, work):
+    home = os.path.join(work, "home")
+    pristine = os.path.join(work, "pristine")
+    os.makedirs(home)
+    env = dict(os.environ, HOME=home, NOTE_BACKEND=args.backend,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+
+    print(f"generating {count} notes...", file=sys.stderr)
+    # in a process of its own: each command timed is forked from this one,
+    # and peak RSS would count whatever this process holds
+    if args.backend == "sqlite":
+        generate = ("from note.sqlite_store import SqliteStore; "
+                    f"SqliteStore({os.path.join(home, '.notes_db.sqlite')!r})"
+                    f".import_notes(corpus.generate({count}, {args.seed}))")
+    else:
+        generate = f"corpus.write({os.path.join(home, '.notes_db.json')!r}, {count}, {args.seed})"
+    subprocess.run([sys.executable, "-c", "from benchmarks import corpus; " + generate], env=env, cwd=ROOT, check=True)
+    values = {"middle": max(1, count // 2), "work": work}
+    for prime in PRIME:
+        run(command(prime, values), env)
+    from note import bulk
+    extra = corpus.generate(IMPORT_NOTES, args.seed + 1)
+    bulk.export_notes(((f"i{nid}", note) for nid, note in extra.items()), os.path.join(work, "import.jsonl"))
+    copy_store(home, pristine)
+
+    results = {}
+    for name, op, fresh in OPERATIONS:
+        if args.only and name not in args.only:
+            continue
+        cmd = command(op, values)
+        restore(pristine, home)
+        times, peaks = [], []
+        for i in range(args.warmup + args.repeat):
+            if fresh:
+                restore(pristine, home)
+            elapsed, peak = run(cmd, env, ANSWERS.get(name))
+            if i >= args.warmup:
+                times.append(elapsed)
+                peaks.append(peak)
+        results[name] = summarize(times, peaks)
+        rss = results[name]["peak_rss_mb"]
+        print(f"  {count:>8} {name:<14} p50 {results[name]['p50'] * 1000:9.1f} ms"
+              + (f"  peak {rss:7.1f} MB" if rss is not None else ""), file=sys.stderr)
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each median against the baseline; return the regressions."""
+    regressions = []
+    print(f"{'size':>8} {'command':<14} {'baseline':>10} {'current':>10} {'ratio':>7} {'peak RSS':>10}")
+    for size, ops in results["results"].items():
+        for name, stats in ops.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if not base:
+                continue
+            ratio = stats["p50"] / base["p50"]
+            flag = ""
+            if ratio > 1 + threshold:
+                regressions.append((size, name, ratio))
+                flag = "  SLOWER"
+            rss = f"{stats['peak_rss_mb']:8.1f}MB" if stats.get('peak_rss_mb') is not None else f"{'-':>10}"
+            print(f"{size:>8} {name:<14} {base['p50'] * 1000:8.1f}ms {stats['p50'] * 1000:8.1f}ms {ratio:6.2f}x {rss}{flag}")
+    return regressions
+
+def over_budget(results):
+    budgets = BUDGETS.get(results["meta"]["backend"], {})
+    return [(size, name, ops[name]["p50"], budget)
+            for size, ops in results["results"].items()
+            for name, budget in budgets.items()
+            if name in ops and ops[name]["p50"] > budget]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", default=["1k", "10k", "100k"], help="store sizes, e.g. 1k 10k 100k 1M")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per command")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per command")
+    parser.add_argument("--only", nargs="+", help="run only these commands")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --out")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    for size in args.sizes:
+        count = parse_size(size)
+        with tempfile.TemporaryDirectory(prefix="note-bench-") as work:
+            results["results"][str(count)] = bench_size(count, args, work)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for size, name, ratio in regressions:
+            print(f"regression: {name} at {size} notes is {ratio:.2f}x the baseline", file=sys.stderr)
+        failed = bool(regressions)
+    for size, name, p50, budget in over_budget(results):
+        print(f"over budget: {name} at {size} notes took {p50 * 1000:.1f}ms (budget {budget * 1000:.0f}ms)",
+              file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
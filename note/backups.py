@@ -0,0 +1,283 @@
+"""Incremental, deduplicated backups.
+
+``note backup --incremental <dir>`` keeps a repository of snapshots in
+``<dir>``:
+
+    packs/<n>.pack         compressed members of chunks, written once
+    packs/<n>.idx          digest and member offset of every chunk in the pack
+    snapshots/<id>.json    one manifest per snapshot
+    lock
+
+Each note is a chunk addressed by the digest of its JSON, so a note already
+saved by any earlier snapshot is never written again.  The snapshot's list
+of ``[nid, digest]`` entries is cut into pieces that are chunks too, at
+boundaries picked by the notes' digests, so adding, editing or deleting a
+note only changes the piece around it and the manifest is just the list of
+piece digests.  Restoring a snapshot or a single note decompresses only the
+members holding the chunks it reads.  Pruning drops old manifests, deletes
+packs none of the rest refer to and rewrites packs that are mostly dead.
+
+Members have the cold segment's format (see journal.write_member()), with a
+chunk's digest as the key of its line.
+"""
+import collections, contextlib, hashlib, json, os, struct
+from datetime import datetime
+from note import journal
+from note.model import with_defaults
+
+DIGEST_BYTES = 16            # of sha256; plenty to tell a repository's chunks apart
+PIECE_NOTES = 1024           # average entries per manifest piece
+PIECE_MAX = 4 * PIECE_NOTES  # cut a piece here even without a boundary
+CACHE_MEMBERS = 16           # decoded members a reader keeps
+SNAPSHOT_ID = "%Y%m%dT%H%M%S"
+
+_ENTRY = struct.Struct(f"<{DIGEST_BYTES}sQ")  # an .idx entry: digest, offset of its member
+
+def digest(payload):
+    return hashlib.sha256(payload).digest()[:DIGEST_BYTES]
+
+def _lock(directory, exclusive=True):
+    return journal.lock(os.path.join(directory, "lock"), exclusive, suffix="")
+
+def _pack_path(directory, number, ext="pack"):
+    return os.path.join(directory, "packs", f"{number}.{ext}")
+
+def _pack_files(directory):
+    # {number: extensions} of everything in packs/
+    found = collections.defaultdict(set)
+    with contextlib.suppress(FileNotFoundError):
+        for name in os.listdir(os.path.join(directory, "packs")):
+            number, _, ext = name.partition(".")
+            if number.isdigit():
+                found[int(number)].add(ext)
+    return found
+
+def _packs(directory):
+    """Finished packs (those with an index), oldest first."""
+    return sorted(number for number, exts in _pack_files(directory).items() if "idx" in exts)
+
+def _index(directory, number):
+    with open(_pack_path(directory, number, "idx"), 'rb') as f:
+        return list(_ENTRY.iter_unpack(f.read()))
+
+def _locations(directory):
+    # {digest: (pack, member offset)} of every chunk in the repository
+    return {key: (number, offset) for number in _packs(directory)
+            for key, offset in _index(directory, number)}
+
+def _line(key, payload):
+    return b'["' + key.hex().encode() + b'", ' + payload + b"]\n"
+
+class _PackWriter:
+    """Appends chunks to a new pack; close() writes its index."""
+    def __init__(self, directory):
+        os.makedirs(os.path.join(directory, "packs"), exist_ok=True)
+        self.directory = directory
+        self.number = max(_pack_files(directory), default=0) + 1
+        self.f = open(_pack_path(directory, self.number), 'xb')
+        self.entries = []  # (digest, member offset)
+        self.batch, self.size, self.pos = [], 0, 0
+
+    def add(self, key, line):
+        self.batch.append(line)
+        self.size += len(line)
+        self.entries.append((key, self.pos))
+        if self.size >= journal.COLD_MEMBER_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            self.pos += journal.write_member(self.f, self.batch)
+            self.batch, self.size = [], 0
+
+    def close(self):
+        """Make the pack durable and return its size; an empty one is removed."""
+        self._flush()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        if not self.entries:
+            os.remove(self.f.name)
+            return 0
+        # the index goes last: a pack without one is ignored, then pruned
+        path = _pack_path(self.directory, self.number, "idx")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(b"".join(_ENTRY.pack(key, offset) for key, offset in self.entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        journal.sync_dir(path)
+        return self.pos
+
+class _Reader:
+    """Reads chunks by digest, keeping recent members decoded."""
+    def __init__(self, directory, locations):
+        self.directory = directory
+        self.locations = locations
+        self.files = {}
+        self._cache = collections.OrderedDict()  # (pack, offset) -> member
+
+    def line(self, key):
+        location = self.locations[bytes.fromhex(key)]
+        member = self._cache.get(location)
+        if member is None:
+            number, offset = location
+            if number not in self.files:
+                self.files[number] = open(_pack_path(self.directory, number), 'rb')
+            member = self._cache[location] = journal.read_member(self.files[number], offset)
+            if len(self._cache) > CACHE_MEMBERS:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(location)
+        return member[key]
+
+    def get(self, key):
+        return json.loads(self.line(key))[1]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def _snapshot_path(directory, snapshot_id):
+    return os.path.join(directory, "snapshots", snapshot_id + ".json")
+
+def snapshot_ids(directory):
+    """Snapshot ids in ``directory``, oldest first."""
+    try:
+        names = os.listdir(os.path.join(directory, "snapshots"))
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith(".json")), key=_id_order)
+
+def _id_order(snapshot_id):
+    # ids taken within the same second get -1, -2, ... appended
+    base, _, n = snapshot_id.partition("-")
+    return base, int(n) if n.isdigit() else 0, n
+
+def manifest(directory, snapshot_id=None):
+    """Return a snapshot's manifest; the latest one's without ``snapshot_id``."""
+    if snapshot_id in (None, "latest"):
+        ids = snapshot_ids(directory)
+        if not ids:
+            raise ValueError(f"no snapshots in {directory}")
+        snapshot_id = ids[-1]
+    try:
+        with open(_snapshot_path(directory, snapshot_id), 'rb') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"no snapshot {snapshot_id} in {directory}") from None
+
+def _new_id(directory):
+    base = snapshot_id = datetime.now().strftime(SNAPSHOT_ID)
+    n = 1
+    while os.path.exists(_snapshot_path(directory, snapshot_id)):
+        snapshot_id = f"{base}-{n}"
+        n += 1
+    return snapshot_id
+
+def backup(notes, directory):
+    """Save ``(nid, note)`` pairs as a new snapshot in ``directory``; return its manifest.
+
+    Only chunks the repository doesn't hold yet are written, all into one
+    new pack; the manifest goes in place once the pack is durable.
+    """
+    os.makedirs(os.path.join(directory, "snapshots"), exist_ok=True)
+    with _lock(directory):
+        known = {key for number in _packs(directory) for key, _ in _index(directory, number)}
+        writer = _PackWriter(directory)
+        try:
+            def put(payload):
+                key = digest(payload)
+                if key not in known:
+                    known.add(key)
+                    writer.add(key, _line(key, payload))
+                return key.hex()
+
+            pieces, entries, count = [], [], 0
+            for nid, note in notes:
+                key = put(json.dumps(note).encode())
+                entries.append([nid, key])
+                count += 1
+                if len(entries) >= PIECE_MAX or int(key[:8], 16) % PIECE_NOTES == 0:
+                    pieces.append(put(json.dumps(entries).encode()))
+                    entries = []
+            if entries:
+                pieces.append(put(json.dumps(entries).encode()))
+        finally:
+            written = writer.close()
+        snapshot = {"id": _new_id(directory), "time": datetime.now().isoformat(), "notes": count,
+                    "chunks": len(writer.entries), "written": written, "pieces": pieces}
+        path = _snapshot_path(directory, snapshot["id"])
+        with open(path + ".tmp", 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        journal.sync_dir(path)
+    return snapshot
+
+def restore(directory, snapshot_id=None):
+    """Return the ``{nid: note}`` store saved by a snapshot (the latest by default)."""
+    with _lock(directory, exclusive=False):
+        pieces = manifest(directory, snapshot_id)["pieces"]
+        with contextlib.closing(_Reader(directory, _locations(directory))) as reader:
+            return {nid: with_defaults(reader.get(key))
+                    for piece in pieces for nid, key in reader.get(piece)}
+
+def find_note(directory, nid, snapshot_id=None):
+    """Return note ``nid`` as a snapshot (the latest by default) saved it, or None."""
+    with _lock(directory, exclusive=False):
+        pieces = manifest(directory, snapshot_id)["pieces"]
+        with contextlib.closing(_Reader(directory, _locations(directory))) as reader:
+            for piece in pieces:
+                for entry_nid, key in reader.get(piece):
+                    if entry_nid == nid:
+                        return with_defaults(reader.get(key))
+    return None
+
+def prune(directory, keep):
+    """Keep only the newest ``keep`` snapshots; return ``(snapshots dropped, bytes freed)``.
+
+    Packs none of the kept snapshots refer to are deleted.  Packs in which
+    fewer than half the chunks are still referred to have those copied into
+    a new pack first, which is made durable before any old pack goes.
+    """
+    with _lock(directory):
+        ids = snapshot_ids(directory)
+        dropped = ids[:max(len(ids) - keep, 0)]
+        for snapshot_id in dropped:
+            os.remove(_snapshot_path(directory, snapshot_id))
+        pieces = {piece for snapshot_id in ids[len(dropped):]
+                  for piece in manifest(directory, snapshot_id)["pieces"]}
+        locations = _locations(directory)
+        live = {bytes.fromhex(piece) for piece in pieces}
+        with contextlib.closing(_Reader(directory, locations)) as reader:
+            for piece in sorted(pieces, key=lambda piece: locations[bytes.fromhex(piece)]):
+                live.update(bytes.fromhex(key) for _, key in reader.get(piece))
+
+            doomed, kept = [], []
+            for number, exts in sorted(_pack_files(directory).items()):
+                if "idx" not in exts:
+                    doomed.append(number)  # a backup died before finishing it
+                    continue
+                entries = _index(directory, number)
+                alive = [key for key, _ in entries if key in live]
+                if len(alive) * 2 < len(entries):
+                    doomed.append(number)
+                    kept.extend(alive)
+            written = 0
+            if kept:
+                writer = _PackWriter(directory)
+                try:
+                    for key in sorted(kept, key=locations.get):
+                        writer.add(key, reader.line(key.hex()) + b"\n")
+                finally:
+                    written = writer.close()
+        freed = -written
+        for number in doomed:
+            for ext in ("idx", "pack"):
+                path = _pack_path(directory, number, ext)
+                with contextlib.suppress(FileNotFoundError):
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+    return len(dropped), freed
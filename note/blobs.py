@@ -0,0 +1,133 @@
+"""Large note contents, stored once each next to the JSON store.
+
+A note whose content is BLOB_MIN_BYTES or more keeps only a preview in the
+journal and snapshot.  The content itself goes, gzipped, to
+``<db>.blobs/<xx>/<sha256>``, named by the sha256 of its UTF-8 bytes, so a
+paste repeated across notes is stored once and a note that is saved again
+unchanged doesn't rewrite it.  The note records ``blob`` (the digest) and
+``size`` (the content's length in bytes).
+
+Blobs are written holding the store lock, before the op that refers to them
+is appended; a compaction (which holds the lock too) deletes the ones no
+note refers to any more.  Reads go through inline(), which puts the content
+back, or open_content(), which streams it without decoding it into a string.
+
+A note whose blob is missing or damaged can't be read back: both raise
+BlobError rather than hand out the preview as if it were the whole
+content, which a command that edits the note would then save over it.
+Only the indexes, which just need words to find the note by, settle for
+the preview.
+"""
+import contextlib, gzip, io, os, zlib
+from note import journal
+from note.model import NoteStore
+
+BLOB_MIN_BYTES = 64 << 10  # contents this large (in UTF-8) go to a blob
+BLOB_PREVIEW = 1024        # characters of the content kept in the note
+BLOB_SUFFIX = ".blobs"
+
+class BlobError(OSError):
+    """A note's blob is missing or can't be decompressed."""
+
+class _BlobFile(gzip.GzipFile):
+    # damage only shows once the bad part is read
+    def read(self, size=-1):
+        try:
+            return super().read(size)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise BlobError(f"blob {os.path.basename(self.name)} is damaged: {e}") from e
+
+def is_blob(note):
+    return 'blob' in note
+
+def blob_path(db_path, digest):
+    return os.path.join(db_path + BLOB_SUFFIX, digest[:2], digest)
+
+def externalize(db_path, note):
+    """Return ``note`` with a large content moved to its blob; other notes come back as they are."""
+    content = note.get('content')
+    if is_blob(note) or not isinstance(content, str) or len(content) * 4 < BLOB_MIN_BYTES:
+        return note
+    data = content.encode()
+    if len(data) < BLOB_MIN_BYTES:
+        return note
+    import hashlib  # here rather than at the top, to keep it off the quick-add path
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(db_path, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as z:
+                z.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        journal.sync_dir(path)
+    return dict(note, content=content[:BLOB_PREVIEW], blob=digest, size=len(data))
+
+def externalize_all(db_path, db):
+    """Move large contents of the ``{nid: note}`` mapping ``db`` to blobs, in place."""
+    nids = db.large(BLOB_MIN_BYTES) if isinstance(db, NoteStore) else list(db)
+    for nid in nids:
+        note = db[nid]
+        stored = externalize(db_path, note)
+        if stored is not note:
+            db[nid] = stored
+
+def open_content(db_path, note):
+    """Return a binary file object reading ``note``'s whole content.
+
+    Raises BlobError, on opening or while reading, if its blob is missing or damaged.
+    """
+    if not is_blob(note):
+        return io.BytesIO(note.get('content', '').encode())
+    try:
+        return _BlobFile(blob_path(db_path, note['blob']), 'rb')
+    except FileNotFoundError as e:
+        raise BlobError(f"blob {note['blob']} is missing") from e
+
+def content(db_path, note, partial=False):
+    """Return ``note``'s whole content.
+
+    Raises BlobError if its blob is missing or damaged; with ``partial`` the
+    preview kept in the note is returned instead.
+    """
+    if not is_blob(note):
+        return note.get('content', '')
+    try:
+        with open_content(db_path, note) as f:
+            return f.read().decode()
+    except BlobError:
+        if not partial:
+            raise
+        return note.get('content', '')
+
+def inline(db_path, note):
+    """Return ``note`` with its content read back from its blob, if it has one."""
+    if not is_blob(note):
+        return note
+    note = dict(note, content=content(db_path, note))
+    del note['blob']
+    note.pop('size', None)
+    return note
+
+def inline_all(db_path, db):
+    """Read every blob of the ``{nid: note}`` mapping ``db`` back into its note, in place."""
+    nids = list(db.blobs()) if isinstance(db, NoteStore) else [nid for nid, note in db.items() if is_blob(note)]
+    for nid in nids:
+        db[nid] = inline(db_path, db[nid])
+
+def sweep(db_path, live):
+    """Delete the blobs whose digest isn't in ``live``.  Hold the store lock."""
+    root = db_path + BLOB_SUFFIX
+    with contextlib.suppress(FileNotFoundError):
+        for shard in os.listdir(root):
+            for name in os.listdir(os.path.join(root, shard)):
+                if name not in live:  # leftover .tmp files too
+                    os.remove(os.path.join(root, shard, name))
+
+def _sweep_after(db_path, carry):
+    # the new snapshot (and the stubs of cold notes in it) is everything that is left
+    return lambda db, locations: sweep(db_path, set(db.blobs().values()))
+
+journal.snapshot_hooks.append(_sweep_after)
@@ -0,0 +1,202 @@
+"""Bulk import and export.
+
+``note import`` takes any mix of files, directories (walked recursively),
+glob patterns and ``-`` for stdin.  Plain files become one note each; files
+ending in .jsonl/.ndjson (or anything, with ``--jsonl``) hold one record per
+line, either a JSON string or an object with ``content`` and optionally
+``id``, ``tags``, ``timestamp`` and ``archived``.  Files are read on a thread pool,
+notes whose content is already in the store (or earlier in the same import)
+are skipped, and everything else is written in one go.
+
+``note export`` with a filter streams the matching notes out as they are
+read: as JSONL (to a file or stdout), as one ``<id>.txt`` per note in a
+directory, or as a tar archive of the same files.  Nothing is collected
+first, so memory stays flat however many notes match.
+"""
+import glob, hashlib, io, json, os, sys, tarfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from note.search_index import matches, parse_query
+
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+EXPORT_FORMATS = ("jsonl", "dir", "tar", "tgz")
+
+def content_hash(content):
+    return hashlib.sha256(content.encode()).digest()
+
+def expand_sources(sources):
+    """Yield the files to read for import arguments; ``-`` stands for stdin."""
+    for source in sources:
+        if source == "-" or os.path.isfile(source):
+            yield source
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(files):
+                    if not name.startswith('.'):
+                        yield os.path.join(root, name)
+        elif any(c in source for c in "*?["):
+            yield from expand_sources(sorted(glob.glob(source, recursive=True)))
+        else:
+            yield source  # reported as unreadable
+
+def _read(path):
+    try:
+        if path == "-":
+            return sys.stdin.read(), None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), None
+    except (OSError, UnicodeDecodeError) as e:
+        return None, e
+
+def _records(path, text, jsonl):
+    """Yield ``(where, record)``, where a JSONL record is still its unparsed line."""
+    if not jsonl:
+        yield path, {"content": text}
+        return
+    for number, line in enumerate(text.splitlines(), start=1):
+        if line.strip():
+            yield f"{path}:{number}", line
+
+def make_note(record, tags, now):
+    if isinstance(record, str):
+        record = json.loads(record)
+    if isinstance(record, str):
+        record = {"content": record}
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object or string")
+    content = record.get('content')
+    if not isinstance(content, str):
+        raise ValueError("record has no content")
+    extra = record.get('tags', [])
+    if isinstance(extra, str):
+        extra = extra.split()
+    timestamp = record.get('timestamp') or now
+    datetime.fromisoformat(timestamp)  # reject what the rest of note can't parse
+    note = {
+        "timestamp": timestamp,
+        "content": content,
+        "tags": list(dict.fromkeys(t.lower() for t in list(extra) + list(tags)))
+    }
+    if record.get('archived'):
+        note['archived'] = True
+        note['archived_at'] = record.get('archived_at') or now
+    nid = record.get('id')
+    return (nid if isinstance(nid, str) and nid else None), note
+
+def import_sources(store, sources, tags=(), jsonl=False):
+    """Add every note found in ``sources`` with a single write.
+
+    Returns ``(added, duplicates, failed)`` where ``failed`` lists
+    ``(source, error)`` for files or records that couldn't be imported.
+    """
+    paths = list(expand_sources(sources))
+    with ThreadPoolExecutor() as pool:
+        texts = list(pool.map(_read, paths))
+
+    now = datetime.now().isoformat()
+    added, duplicates, failed = [], 0, []
+    with store.locked():
+        seen, ids = set(), set()
+        for nid, note in store.iter_notes(include_archived=True, inline=False):
+            # a blob is named by this same digest, so it needn't be read
+            seen.add(bytes.fromhex(note['blob']) if 'blob' in note else content_hash(note.get('content', '')))
+            ids.add(nid)
+        for path, (text, error) in zip(paths, texts):
+            if error is not None:
+                failed.append((path, error))
+                continue
+            for where, record in _records(path, text, jsonl or path.endswith(JSONL_EXTENSIONS)):
+                try:
+                    nid, note = make_note(record, tags, now)
+                except (ValueError, TypeError) as e:
+                    failed.append((where, e))
+                    continue
+                digest = content_hash(note['content'])
+                if digest in seen:
+                    duplicates += 1
+                    continue
+                seen.add(digest)
+                while nid is None or nid in ids:  # keep exported ids unless taken
+                    nid = os.urandom(4).hex()
+                ids.add(nid)
+                added.append((nid, note))
+        store.add_many(added)
+    return len(added), duplicates, failed
+
+def export_format(dest):
+    """Guess the export format from the destination's name."""
+    if dest.endswith((".tar.gz", ".tgz")):
+        return "tgz"
+    if dest.endswith(".tar"):
+        return "tar"
+    if dest.endswith(os.sep) or os.path.isdir(dest):
+        return "dir"
+    return "jsonl"
+
+def select(notes, tag=None, since=None, until=None, query=None):
+    """Filter ``(nid, note)`` pairs lazily; ``since``/``until`` are ISO strings."""
+    clauses = parse_query(query) if query else None
+    for nid, note in notes:
+        if tag is not None and tag not in note.get('tags', []):
+            continue
+        if since is not None and note['timestamp'] < since:
+            continue
+        if until is not None and note['timestamp'] >= until:
+            continue
+        if clauses is not None and not matches(clauses, note.get('content', '')):
+            continue
+        yield nid, note
+
+def _timestamp(note):
+    try:
+        return datetime.fromisoformat(note['timestamp']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _write_jsonl(notes, f):
+    count = 0
+    for nid, note in notes:
+        f.write(json.dumps({"id": nid, **note}) + "\n")
+        count += 1
+    return count
+
+def _write_dir(notes, path):
+    os.makedirs(path, exist_ok=True)
+    count = 0
+    for nid, note in notes:
+        name = os.path.join(path, f"{nid}.txt")
+        with open(name, 'w', encoding='utf-8') as f:
+            f.write(note.get('content', ''))
+        mtime = _timestamp(note)
+        if mtime is not None:
+            os.utime(name, (mtime, mtime))
+        count += 1
+    return count
+
+def _write_tar(notes, archive):
+    count = 0
+    for nid, note in notes:
+        data = note.get('content', '').encode()
+        info = tarfile.TarInfo(f"{nid}.txt")
+        info.size = len(data)
+        info.mtime = _timestamp(note) or 0
+        archive.addfile(info, io.BytesIO(data))
+        count += 1
+    return count
+
+def export_notes(notes, dest="-", fmt=None):
+    """Write ``(nid, note)`` pairs to ``dest`` (``-`` is stdout) as they come; return the count."""
+    fmt = fmt or ("jsonl" if dest == "-" else export_format(dest))
+    if fmt == "dir":
+        return _write_dir(notes, dest)
+    if fmt in ("tar", "tgz"):
+        # stream mode ("w|") never seeks, so stdout works too
+        mode = ("w|" if dest == "-" else "w:") + ("gz" if fmt == "tgz" else "")
+        target = {"fileobj": sys.stdout.buffer} if dest == "-" else {"name": dest}
+        with tarfile.open(mode=mode, **target) as archive:
+            return _write_tar(notes, archive)
+    if dest == "-":
+        return _write_jsonl(notes, sys.stdout)
+    with open(dest, 'w', encoding='utf-8') as f:
+        return _write_jsonl(notes, f)
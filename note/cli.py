@@ -1,46 +1,42 @@
 #!/usr/bin/env python3
-import sys, json, os, subprocess, tempfile, shutil
+import sys, json, os, contextlib, itertools, re, shlex, shutil, subprocess, tempfile, time
 from datetime import datetime, timedelta
 from uuid import uuid4
 from colorama import Fore, Style, init
+from note import blobs, dedupe, journal, trace
+from note.config import BACKEND, DB_PATH, SOCKET_PATH, SQLITE_PATH
+from note.meta_index import PREVIEW_LENGTH, format_time, short_date
+from note.quick import extract_tags
+from note.storage import open_store
 
 init(autoreset=True)
 
-DB_PATH = os.path.expanduser("~/.notes_db.json")
-PREVIEW_LENGTH = 40 #length of note content in list views
+_stores = {}
+
+def get_store():
+    key = (BACKEND, SQLITE_PATH if BACKEND == "sqlite" else DB_PATH)
+    if key not in _stores:
+        _stores[key] = open_store(*key)
+    return _stores[key]
 
 def pretty_time(timestring, year=False):
-    dt = datetime.fromisoformat(timestring)
-    return dt.strftime("%-I:%M%p %a, %b %d") if not year else dt.strftime("%-I:%M%p %a, %b %d %Y")
+    return format_time(timestring, year=year)
+
+def parse_date(text):
+    """Turn a --since/--until argument into an ISO timestamp to compare against."""
+    return datetime.fromisoformat(text).isoformat()
 
-def _should_show(note, include_archived=False, only_archived=False):
-    if only_archived:
-        return note.get('archived', False)
-    if include_archived:
-        return True
-    return not note.get('archived', False)
+def discard_stdout():
+    # The reader went away (e.g. the pager was closed); send whatever is
+    # still buffered nowhere so Python doesn't complain on exit.
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
 def get_filtered_items(include_archived=False, only_archived=False):
-    db = load_db()
     # Filter and keep insertion order (same as list_notes)
-    items = [(nid, n) for nid, n in db.items()
-             if _should_show(n, include_archived, only_archived)]
-    return items
+    return get_store().items(include_archived=include_archived, only_archived=only_archived)
 
 def resolve_note_id_by_index(line_number, include_archived=False, only_archived=False):
-    items = get_filtered_items(include_archived=include_archived, only_archived=only_archived)
-    if 1 <= line_number <= len(items):
-        return items[line_number - 1][0]   # nid
-    return None
-
-def extract_tags(args):
-    if '--tags' in args:
-        idx = args.index('--tags')
-        tags = args[idx + 1:]
-        args = args[:idx]
-    else:
-        tags = []
-    return args, [t.lower() for t in tags]
+    return get_store().nth(line_number, include_archived=include_archived, only_archived=only_archived)
 
 def print_help():
     help_text = """
@@ -52,21 +48,54 @@ Usage:
   note list                                  List notes (number, timestamp, snippet)
   note list -a                               List notes with full ID and tags
   note list --archive                        List *only* archived notes
+  note list --limit N [--offset N] [--reverse]
+                                             Page through notes; --reverse lists newest first
+  note list --since <date> [--until <date>]  List notes written in a date range
+  note stats --by-day [--since d] [--until d]
+                                             Count notes (and archived notes) written each day
   note view <number>                         View a full note by line number
+  note preview <id>                          Show one note by ID (used by the picker's preview pane)
   note del <number>                          Delete a note by line number
+  note del --where tag=t|--search q          Delete every matching note (with confirmation)
   note --archive <days>                      Archive notes older than N days
   note append <number> "text"                Append text to an existing note
   note edit <number>                         Edit a note in your editor
-  note search <keyword>                      Search notes for keyword
+  note search <terms>                        Search notes (terms match inside words; AND by default, OR between groups)
+  note search <terms> --words                Match whole words only (term* for prefixes)
+  note search <terms> --top N                The N best matches by whole word, ranked by BM25, tags and recency
+  note search ... --json                     Print matches as JSON, one object per line
+  note search --substring <text>             Search by plain substring (slower, scans every note)
+  note search --regex <pattern> [-C N]       Regex search with highlighted matches and N lines of context
+  note search --fuzzy <text> [-C N]          Fuzzy (fzf-style) search, tightest matches first in each batch printed
+  note search --include-archive ...          Also search archived notes (listed separately, numbered as in --archive)
   note tags                                  List all tags
   note tags <tag>                            List all notes with a specific tag
-  note tagadd <number> tag1 tag2   Add tags to an existing note
-  note tagrm <number> tag1 tag2    Remove tags from an existing note
+  note tags --counts                         List tags with the number of notes carrying each
+  note tags --all-of t1 t2 [--any-of t3 t4]  List notes carrying every/any of the given tags
+  note tagadd <number> tag1 tag2             Add tags to an existing note
+  note tagrm <number> tag1 tag2              Remove tags from an existing note
+  note tagadd|tagrm --where tag=t|--search q tag1 tag2
+                                             Add or remove tags on every matching note at once
   note --delete-all                          Delete ALL notes (with confirmation)
   note backup <path>                         Backup all notes to a file
   note restore <path>                        Restore notes from backup
+  note backup --incremental <dir> [--keep N] Save a snapshot, writing only notes not already in <dir>
+  note backup --list <dir>                   List the snapshots in <dir>
+  note backup --prune <dir> --keep N         Drop all but the newest N snapshots
+  note restore <dir> --snapshot <id>         Restore the whole store from a snapshot
+  note restore <dir> --id <note id> [--snapshot <id>]
+                                             Restore one note from a snapshot (the latest by default)
   note export <number> [file]                Export a note to a text file
-  note import <file>                         Import a note from a text file
+  note export --all|--tag t|--since d|--search q [dest]
+                                             Stream matching notes to JSONL, a directory or a .tar(.gz)
+  note import <path>... [--jsonl]            Import notes from files, directories, globs or - (stdin)
+  note migrate                               Copy the JSON store into the SQLite backend
+  note sync <path|dir>                       Merge notes both ways with another JSON store (or <dir>/.notes_db.json)
+  note dedupe [--threshold 0.8]              List clusters of near-duplicate notes (0.8: ~80% of their text shared)
+  note dedupe --merge|--archive              ...and fold each cluster into its first note, or archive the others
+  note --serve                               Keep the store open; other note commands go through it
+  note --profile <command>                   Print how long each phase of the command took (to stderr)
+  note --profile=<file> <command>            ...and write a cProfile of the whole run to <file>
   note                                       Launch interactive picker (with fzf)
 
 Options:
@@ -74,6 +103,8 @@ Options:
   -a                     Show all info (IDs and tags) in list mode
   --delete-all           Delete all notes after confirmation
   $EDITOR                Editor used for multiline note creation/editing (default: nano)
+  $NOTE_BACKEND          Storage backend: json (default) or sqlite; also 'backend = ...' in ~/.noterc
+  $NOTE_TRACE            Append each command's phase timings to this file as a JSON line
 
 Examples:
   note "Buy groceries" --tags personal errand
@@ -88,60 +119,196 @@ Examples:
   note edit 3
   note tags
   note tags work
+  note tags --counts
+  note tags --all-of infra urgent
+  note stats --by-day --since 2026-01-01
   note tagadd 2 dev tools
   note tagrm 2 urgent
+  note tagadd --where tag=infra urgent
+  note del --search "old draft" --where until=2024-01-01
   note search ssl
+  note search nginx OR apache
+  note search deploy*
+  note search nginx ssl --top 5 --json
   note --delete-all
   note backup notes_backup.json
   note restore notes_backup.json
+  note backup --incremental ~/backups/notes --keep 48
+  note restore ~/backups/notes --id 5a6ca1fe
   note export 3 exported_note.txt
   note import note_to_add.txt
+  note sync /mnt/laptop/home/me
+  note dedupe --threshold 0.9 --archive
 """
     print(help_text)
 
 def load_db():
-    if os.path.exists(DB_PATH):
-        with open(DB_PATH, 'r') as f:
-            db = json.load(f)
-        for n in db.values():
-            if 'tags' not in n: n['tags'] = []
-            if 'archived' not in n: n['archived'] = False
-            if 'archived_at' not in n: n['archived_at'] = None
-        return db
-    return {}
+    # archived notes included, not left as cold stubs; with the JSON store
+    # this is a NoteStore, which reads each note only when it is looked up
+    return get_store().load(thaw=True)
 
 def save_db(db):
-    with open(DB_PATH, 'w') as f:
-        json.dump(db, f, indent=2)
+    # Full rewrite; only used when the whole store is replaced.
+    get_store().replace(db)
+
+def migrate_to_sqlite():
+    from note.sqlite_store import SqliteStore
+    db = journal.load(DB_PATH)
+    if not db:
+        print("No JSON notes to migrate.")
+        return
+    blobs.inline_all(DB_PATH, db)
+    added = SqliteStore(SQLITE_PATH).import_notes(db)
+    print(f"Migrated {added} note(s) to {SQLITE_PATH} ({len(db) - added} already present).")
+    print("Set NOTE_BACKEND=sqlite or add 'backend = sqlite' to ~/.noterc to use it.")
 
+@trace.phase("backup")
 def backup_notes(dest_path):
-    db_path = os.path.expanduser("~/.notes_db.json")
     try:
-        shutil.copy(db_path, dest_path)
+        # The snapshot alone may be behind the journal, so write the merged view;
+        # a backup has to stand on its own, so large contents go in it inline.
+        db = load_db()
+        blobs.inline_all(DB_PATH, db)
+        journal.write_snapshot(dest_path, db)
         print(f"Backup saved to {dest_path}")
     except Exception as e:
         print(f"Backup failed: {e}")
 
+@trace.phase("restore")
 def restore_notes(src_path):
-    db_path = os.path.expanduser("~/.notes_db.json")
     confirm = input(f"Are you sure you want to restore notes from {src_path}? This will overwrite current notes. (y/n) > ")
     if confirm.lower() == 'y':
         try:
-            shutil.copy(src_path, db_path)
+            # read like a snapshot: each note stays a byte range of the file until written
+            save_db(journal.read_snapshot(src_path))
             print("Notes restored.")
         except Exception as e:
             print(f"Restore failed: {e}")
     else:
         print("Restore cancelled.")
 
+@trace.phase("sync")
+def sync_stores(path):
+    from note import sync
+    if BACKEND != "json":
+        print("note sync works with the JSON backend only.")
+        return
+    other = sync.store_path(os.path.expanduser(path))
+    try:
+        sent, received, conflicts = sync.sync(DB_PATH, other)
+    except (OSError, ValueError) as e:
+        print(f"Sync failed: {e}")
+        return
+    print(f"Synced with {other}: sent {sent} note(s), received {received}", end="")
+    print(f", {conflicts} conflict(s); edits that lost are kept in notes tagged '{sync.CONFLICT_TAG}'"
+          if conflicts else "")
+
+SNAPSHOT_USAGE = ("Usage: note backup (--incremental <dir> [--keep N] | --list <dir> | --prune <dir> --keep N)\n"
+                  "       note restore <dir> (--snapshot <id> | --id <note id> [--snapshot <id>])")
+
+def snapshot_args(args, options, flags=()):
+    """Split ``args`` into the backup directory, ``options`` values and ``flags`` given.
+
+    Returns None unless there is exactly one directory and every option has a value.
+    """
+    given, rest = set(), []
+    it = iter(args)
+    for a in it:
+        if a in options:
+            options[a] = next(it, None)
+            if options[a] is None:
+                return None
+        elif a in flags:
+            given.add(a)
+        else:
+            rest.append(a)
+    return (rest[0], given) if len(rest) == 1 else None
+
+@trace.phase("backup")
+def backup_snapshots(args):
+    from note import backups
+    options = {"--keep": None}
+    parsed = snapshot_args(args, options, ("--incremental", "--list", "--prune"))
+    try:
+        directory, flags = parsed
+        keep = int(options["--keep"]) if options["--keep"] is not None else None
+        if len(flags) != 1 or (keep is not None and keep < 1):
+            raise ValueError
+        if ("--prune" in flags and keep is None) or ("--list" in flags and keep is not None):
+            raise ValueError
+    except (TypeError, ValueError):
+        print(SNAPSHOT_USAGE)
+        return
+    try:
+        if "--list" in flags:
+            ids = backups.snapshot_ids(directory)
+            if not ids:
+                print(f"No snapshots in {directory}.")
+            for snapshot_id in ids:
+                snapshot = backups.manifest(directory, snapshot_id)
+                print(f"{Fore.GREEN}{snapshot_id}{Style.RESET_ALL}\t"
+                      f"{Fore.LIGHTBLACK_EX}{pretty_time(snapshot['time'], year=True)}{Style.RESET_ALL}\t"
+                      f"{snapshot['notes']} note(s), {snapshot['chunks']} new chunk(s), {snapshot['written']} bytes")
+            return
+        if "--incremental" in flags:
+            snapshot = backups.backup(get_store().iter_notes(include_archived=True), directory)
+            print(f"Snapshot {snapshot['id']} saved to {directory}: {snapshot['notes']} note(s), "
+                  f"{snapshot['chunks']} new chunk(s), {snapshot['written']} bytes written")
+            if keep is None:
+                return
+        dropped, freed = backups.prune(directory, keep)
+        print(f"Pruned {dropped} snapshot(s), freed {max(freed, 0)} bytes.")
+    except (OSError, ValueError) as e:
+        print(f"Backup failed: {e}")
+
+@trace.phase("restore")
+def restore_snapshot(args):
+    from note import backups
+    options = {"--snapshot": None, "--id": None}
+    parsed = snapshot_args(args, options)
+    if parsed is None or (options["--snapshot"] is None and options["--id"] is None):
+        print(SNAPSHOT_USAGE)
+        return
+    directory, _ = parsed
+    nid, snapshot_id = options["--id"], options["--snapshot"]
+    try:
+        if nid is None:
+            snapshot_id = backups.manifest(directory, snapshot_id)["id"]  # fails before asking
+            confirm = input(f"Are you sure you want to restore snapshot {snapshot_id} from {directory}? "
+                            "This will overwrite current notes. (y/n) > ")
+            if confirm.lower() != 'y':
+                print("Restore cancelled.")
+                return
+            save_db(backups.restore(directory, snapshot_id))
+            print("Notes restored.")
+            return
+        note = backups.find_note(directory, nid, snapshot_id)
+        if note is None:
+            print(f"Note {nid} is not in that snapshot.")
+            return
+        store = get_store()
+        if store.get(nid) is not None:
+            confirm = input(f"Overwrite note {nid} with the copy from the snapshot? (y/n) > ")
+            if confirm.lower() != 'y':
+                print("Restore cancelled.")
+                return
+        with store.locked():
+            if store.get(nid) is None:
+                store.add(nid, note)
+            else:
+                store.update(nid, note)
+        print(f"Note {nid} restored.")
+    except (OSError, ValueError) as e:
+        print(f"Restore failed: {e}")
+
 def export_note(line_number, filename=None, *, only_archived=False, include_archived=False):
     nid = resolve_note_id_by_index(line_number, include_archived=include_archived, only_archived=only_archived)
     if not nid:
         print("Invalid note number for this view.")
         return
 
-    db = load_db()
-    content = db[nid].get('content', '')
+    store = get_store()
+    note = store.get(nid, inline=False)
 
     if not filename:
         filename = input("Filename to export to: ").strip()
@@ -158,34 +325,79 @@ def export_note(line_number, filename=None, *, only_archived=False, include_arch
             return
 
     try:
-        with open(filename, 'w') as f:
-            f.write(content)
+        # copied across as bytes, so a large note is never decoded whole
+        with store.open_content(note) as src, open(filename, 'wb') as f:
+            shutil.copyfileobj(src, f)
         print(f"Note {line_number} exported to {filename}")
     except Exception as e:
         print(f"Export failed: {e}")
 
-def import_note(filename):
+EXPORT_FILTERS = ("--all", "--tag", "--since", "--until", "--search")
+EXPORT_USAGE = ("Usage: note export (--all | --tag <tag> | --since <date> | --until <date> | --search <query>)... "
+                "[--archive] [--format jsonl|dir|tar|tgz] [destination]")
+
+@trace.phase("export")
+def export_matching(args):
+    from note import bulk
+    options = {"--tag": None, "--since": None, "--until": None, "--search": None, "--format": None}
+    dest, include_archived, only_archived = "-", False, False
+    it = iter(args)
+    for a in it:
+        if a in options:
+            options[a] = next(it, None)
+            if options[a] is None:
+                print(EXPORT_USAGE)
+                return
+        elif a == "--all":
+            include_archived = True
+        elif a == "--archive":
+            only_archived = True
+        else:
+            dest = a
     try:
-        with open(filename, 'r') as f:
-            content = f.read()
-    except Exception as e:
-        print(f"Import failed: {e}")
+        since, until = (parse_date(options[k]) if options[k] else None for k in ("--since", "--until"))
+    except ValueError:
+        print("Dates must look like 2024-01-31 or 2024-01-31T09:00.")
+        return
+    if options["--format"] and options["--format"] not in bulk.EXPORT_FORMATS:
+        print(EXPORT_USAGE)
         return
 
-    tag_input = input("Enter tags for this note (space-separated, or leave blank): ").strip()
-    tags = tag_input.split() if tag_input else []
-
-    add_note(content, tags=tags)
+    store = get_store()
+    notes = bulk.select(store.iter_notes(include_archived=include_archived, only_archived=only_archived),
+                        tag=options["--tag"] and options["--tag"].lower(), since=since, until=until,
+                        query=options["--search"])
+    try:
+        count = bulk.export_notes(notes, dest, options["--format"])
+    except BrokenPipeError:
+        discard_stdout()
+        return
+    except OSError as e:
+        print(f"Export failed: {e}")
+        return
+    print(f"Exported {count} note(s) to {'stdout' if dest == '-' else dest}",
+          file=sys.stderr if dest == "-" else sys.stdout)
+
+@trace.phase("import")
+def import_notes(sources, tags=None, jsonl=False):
+    from note import bulk
+    start = time.perf_counter()
+    added, duplicates, failed = bulk.import_sources(get_store(), sources, tags=tags or [], jsonl=jsonl)
+    elapsed = time.perf_counter() - start
+    for source, error in failed:
+        print(f"Import failed for {source}: {error}")
+    rate = added / elapsed if elapsed > 0 else 0
+    print(f"Imported {added} note(s) in {elapsed:.2f}s ({rate:.0f} notes/s)", end="")
+    print(f", skipped {duplicates} duplicate(s)" if duplicates else "")
 
 def add_note(text, tags=None):
-    db = load_db()
     note_id = str(uuid4())[:8]
-    db[note_id] = {
+    note = {
         "timestamp": datetime.now().isoformat(),
         "content": text,
-    "tags": tags or []
+        "tags": tags or []
     }
-    save_db(db)
+    get_store().add(note_id, note)
     print(f"Note saved with ID {note_id}")
 
 def add_note_with_editor(tags=None):
@@ -212,54 +424,91 @@ def view_note(line_number, *, only_archived=False, include_archived=False):
         print("Invalid note number for this view.")
         return
 
-    db = load_db()
-    note = db[nid]
+    show_note(nid, get_store().get(nid, inline=False), f"Note {line_number}")
+
+def show_note(nid, note, title="Note"):
     dt_full = pretty_time(note['timestamp'], year=True)
     tags = note.get('tags', [])
     tag_str = f"[{', '.join(tags)}]" if tags else ""
 
-    print(f"\n{Fore.GREEN}Note {line_number} ({nid}){Style.RESET_ALL}")
+    print(f"\n{Fore.GREEN}{title} ({nid}){Style.RESET_ALL}")
     print(f"{Fore.LIGHTBLACK_EX}{dt_full}{Style.RESET_ALL} {Fore.MAGENTA}{tag_str}{Style.RESET_ALL}\n")
-    print(note.get('content', ''))
+    print_content(note)
 
-def list_notes(all_info=False, include_archived=False, only_archived=False):
-    db = load_db()
-    if not db:
-        print("No notes yet.")
+MISSING_CONTENT = "The content of note {} can't be read (its blob file is missing or damaged); it can't be shown or changed."
+
+def print_content(note):
+    """Print a note's content, copying a large one to stdout as bytes rather than decoding it."""
+    out = getattr(sys.stdout, "buffer", None)  # not there when the server captures output
+    unreadable = f"{Fore.RED}[the rest of this note can't be read]{Style.RESET_ALL}"
+    try:
+        src = get_store().open_content(note)
+    except blobs.BlobError:
+        print(f"{note.get('content', '')}\n{unreadable}")
         return
+    with src:
+        try:
+            if out is None:
+                print(src.read().decode())
+                return
+            sys.stdout.flush()
+            shutil.copyfileobj(src, out)
+            out.write(b"\n")
+            out.flush()
+        except blobs.BlobError:
+            print(f"\n{unreadable}")
+
+def preview_note(nid):
+    # What the picker's preview pane runs for the highlighted row
+    note = get_store().get(nid, inline=False)
+    if note is None:
+        print("Note not found.")
+        return
+    show_note(nid, note)
 
-    def _show(n):
-        if only_archived:
-            return n.get('archived', False)
-        if include_archived:
-            return True
-        return not n.get('archived', False)
+LIST_BATCH = 100  # rows per write when listing
 
-    items = [(nid, n) for nid, n in db.items() if _show(n)]
-    if not items:
-        print("No notes match.")
+@trace.phase("list")
+def list_notes(all_info=False, include_archived=False, only_archived=False, *,
+               since=None, until=None, reverse=False, offset=0, limit=None):
+    store = get_store()
+    if not store.count():
+        print("No notes yet.")
         return
 
-    for idx, (nid, note) in enumerate(items, start=1):
-        dt = pretty_time(note['timestamp'], year=True)
-        preview = note['content'][:PREVIEW_LENGTH].replace('\n', ' ')+"..." if len(note['content']) > 40 else note['content'].replace('\n', ' ')
-        tags = note.get('tags', [])
-        tag_str = f" {Fore.MAGENTA}[{' '.join(tags)}]{Style.RESET_ALL}" if tags and all_info else ""
-
-        if all_info:
-            print(
-                f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
-                f"{Fore.BLUE}{nid}{Style.RESET_ALL}\t"
-                f"{Fore.LIGHTBLACK_EX}{dt}{Style.RESET_ALL}\t"
-                f"{preview}{tag_str}"
-            )
-        else:
-            dt = pretty_time(note['timestamp'])
-            print(
-                f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
-                f"{Fore.LIGHTBLACK_EX}{dt}{Style.RESET_ALL}\t"
-                f"{preview}"
-            )
+    rows = store.listing(include_archived=include_archived, only_archived=only_archived,
+                         since=since, until=until, reverse=reverse, offset=offset, limit=limit)
+    rows = trace.iterate("rows", rows)  # what's left of "list" is rendering
+    shown = 0
+    batch = []
+    try:
+        for idx, nid, timestamp, date, tags, preview in rows:
+            shown += 1
+            if all_info:
+                tag_str = f" {Fore.MAGENTA}[{' '.join(tags)}]{Style.RESET_ALL}" if tags else ""
+                batch.append(
+                    f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
+                    f"{Fore.BLUE}{nid}{Style.RESET_ALL}\t"
+                    f"{Fore.LIGHTBLACK_EX}{date}{Style.RESET_ALL}\t"
+                    f"{preview}{tag_str}"
+                )
+            else:
+                batch.append(
+                    f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
+                    f"{Fore.LIGHTBLACK_EX}{short_date(date)}{Style.RESET_ALL}\t"
+                    f"{preview}"
+                )
+            # colorama converts and flushes every write, so write rows in small batches
+            if len(batch) == LIST_BATCH:
+                print("\n".join(batch))
+                batch.clear()
+        if batch:
+            print("\n".join(batch))
+    except BrokenPipeError:
+        discard_stdout()
+        return
+    if not shown:
+        print("No notes match.")
 
 def delete_note(line_number, *, only_archived=False, include_archived=False):
     nid = resolve_note_id_by_index(line_number, include_archived=include_archived, only_archived=only_archived)
@@ -267,20 +516,83 @@ def delete_note(line_number, *, only_archived=False, include_archived=False):
         print("Invalid note number for this view.")
         return
 
-    db = load_db()
-    preview = db[nid].get('content', '').replace('\n', ' ')
+    store = get_store()
+    preview = store.get(nid, inline=False).get('content', '').replace('\n', ' ')  # a blob's preview will do
     preview = (preview[:PREVIEW_LENGTH] + '...') if len(preview) > PREVIEW_LENGTH else preview
     confirm = input(f"Are you sure you want to delete note {line_number}? Preview: \"{preview}\" (y/n) > ").strip().lower()
     if confirm == 'y':
-        del db[nid]
-        save_db(db)
+        store.delete(nid)
         print(f"Deleted note {line_number}")
     else:
         print("Cancelled.")
 
+QUERY_USAGE = "(--where tag=<tag> | --where since=<date> | --where until=<date> | --search <query>)... [--archive]"
+
+def query_args(args):
+    """Split the filters of a bulk command off ``args``; return ``(query, rest)``.
+
+    ``query`` holds the keyword arguments of the store's where().  Raises
+    ValueError for a malformed filter.
+    """
+    query, rest = {}, []
+    it = iter(args)
+    for a in it:
+        if a == "--where":
+            key, sep, value = next(it, "").partition("=")
+            if not value:
+                raise ValueError
+            if key == "tag":
+                query.setdefault("tags", []).append(value.lower())
+            elif key in ("since", "until"):
+                query[key] = parse_date(value)
+            else:
+                raise ValueError
+        elif a == "--search":
+            query["text"] = next(it, None)
+            if not query["text"]:
+                raise ValueError
+        elif a == "--archive":
+            query["only_archived"] = True
+        else:
+            rest.append(a)
+    return query, rest
+
+def delete_matching(args):
+    try:
+        query, rest = query_args(args)
+        if rest or not set(query) - {"only_archived"}:
+            raise ValueError
+    except ValueError:
+        print(f"Usage: note del {QUERY_USAGE}")
+        return
+    store = get_store()
+    count = len(store.where(**query))
+    if not count:
+        print("No notes match.")
+        return
+    confirm = input(f"Are you sure you want to delete {count} matching note(s)? (y/n) > ").strip().lower()
+    if confirm == 'y':
+        print(f"Deleted {store.delete_where(**query)} note(s)")
+    else:
+        print("Cancelled.")
+
+def tag_matching(args, remove=False):
+    try:
+        query, tags = query_args(args)
+        if not tags or not set(query) - {"only_archived"}:
+            raise ValueError
+    except ValueError:
+        print(f"Usage: note {'tagrm' if remove else 'tagadd'} {QUERY_USAGE} tag1 tag2")
+        return
+    tags = sorted(set(t.lower() for t in tags))
+    store = get_store()
+    with store.transaction():
+        nids = store.where(**query)
+        changed = store.tag_many(nids, remove=tags) if remove else store.tag_many(nids, add=tags)
+    print(f"{'Removed' if remove else 'Added'} tags on {changed} of {len(nids)} matching note(s): {', '.join(tags)}")
+
 def delete_all_notes():
-    db = load_db()
-    if not db:
+    if not get_store().count():
         print("No notes to delete.")
         return
     confirm = input("Are you sure you want to delete ALL notes? (y/n) > ").strip().lower()
@@ -291,48 +603,76 @@ def delete_all_notes():
         print("Cancelled.")
 
 def archive_older_than(days):
-    db = load_db()
     cutoff = datetime.now() - timedelta(days=int(days))
-    changed = 0
-
-    for nid, note in db.items():
-        # skip already-archived
-        if note.get('archived'):
-            continue
-        # parse timestamp and compare
-        try:
-            ts = datetime.fromisoformat(note['timestamp'])
-        except Exception:
-            # if malformed timestamp, skip
-            continue
-        if ts < cutoff:
-            note['archived'] = True
-            note['archived_at'] = datetime.now().isoformat()
-            changed += 1
-
-    save_db(db)
+    changed = get_store().archive_where(until=cutoff.isoformat())
     print(f"Archived {changed} note(s) older than {days} day(s).")
 
-def append_note(line_number, text, *, only_archived=False, include_archived=False):
-    nid = resolve_note_id_by_index(line_number, include_archived=include_archived, only_archived=only_archived)
-    if not nid:
-        print("Invalid note number for this view.")
+DEDUPE_USAGE = "Usage: note dedupe [--threshold 0.8] [--merge | --archive]"
+
+@trace.phase("dedupe")
+def find_duplicates(threshold, action=None):
+    store = get_store()
+    hashed = store.minhashes()
+    groups = [[hashed[i] for i in group] for group in dedupe.clusters([sig for _, _, sig in hashed], threshold)]
+    if not groups:
+        print("No near-duplicate notes found.")
+        return
+    notes = dict(store.get_many([nid for group in groups for _, nid, _ in group], inline=False))
+    for n, group in enumerate(groups, start=1):
+        print(f"{Fore.YELLOW}Cluster {n}{Style.RESET_ALL} ({len(group)} notes)")
+        first_sig = group[0][2]
+        for idx, nid, sig in group:
+            note = notes[nid]
+            preview = note.get('content', '').replace('\n', ' ')
+            preview = (preview[:PREVIEW_LENGTH] + '...') if len(preview) > PREVIEW_LENGTH else preview
+            print(f"  {Fore.GREEN}{idx}{Style.RESET_ALL}\t"
+                  f"{Fore.LIGHTBLACK_EX}{pretty_time(note['timestamp'])}{Style.RESET_ALL}\t"
+                  f"{dedupe.similarity(first_sig, sig):4.0%}\t{preview}")
+    extra = sum(len(group) - 1 for group in groups)
+    print(f"{len(groups)} cluster(s); {extra} note(s) could go, keeping the first of each.")
+    if action is None:
+        print("Run with --merge to fold each cluster into its first note, or --archive to archive the rest.")
         return
+    if action == "--merge":
+        confirm = input(f"Merge {extra} note(s) into the first of their cluster and delete them? (y/n) > ")
+        if confirm.strip().lower() != 'y':
+            print("Cancelled.")
+            return
+    changed = dedupe.collapse(store, [[nid for _, nid, _ in group] for group in groups],
+                              archive=action == "--archive")
+    print(f"{'Archived' if action == '--archive' else 'Merged'} {changed} note(s).")
 
-    db = load_db()
-    db[nid]['content'] = (db[nid].get('content', '') + ("\n" if db[nid].get('content') else "") + text)
-    save_db(db)
+def append_note(line_number, text, *, only_archived=False, include_archived=False):
+    store = get_store()
+    with store.locked():
+        nid = store.nth(line_number, include_archived=include_archived, only_archived=only_archived)
+        if not nid:
+            print("Invalid note number for this view.")
+            return
+
+        try:
+            note = store.get(nid)
+        except blobs.BlobError:
+            print(MISSING_CONTENT.format(line_number))
+            return
+        note['content'] = (note.get('content', '') + ("\n" if note.get('content') else "") + text)
+        store.update(nid, note)
     print(f"Appended to note {line_number}")
 
 def edit_note(line_number, *, only_archived=False, include_archived=False):
     import os, tempfile, subprocess
 
-    items = get_filtered_items(include_archived=include_archived, only_archived=only_archived)
-    if not (1 <= line_number <= len(items)):
+    store = get_store()
+    nid = store.nth(line_number, include_archived=include_archived, only_archived=only_archived)
+    if not nid:
         print("Invalid note number for this view.")
         return
 
-    nid, note = items[line_number - 1]
+    try:
+        note = store.get(nid)
+    except blobs.BlobError:
+        print(MISSING_CONTENT.format(line_number))
+        return
     original = note.get('content', '')
     editor = os.environ.get("EDITOR", "nano")
 
@@ -352,16 +692,23 @@ def edit_note(line_number, *, only_archived=False, include_archived=False):
             pass
 
     if updated.strip() != original.strip():
-        db = load_db()
-        db[nid]['content'] = updated
-        save_db(db)
+        with store.locked():
+            # keep tag or archive changes made while the editor was open
+            note = store.get(nid) or note
+            note['content'] = updated
+            store.update(nid, note)
         print(f"Note {line_number} updated.")
     else:
         print("No changes made.")
 
 def edit_note_by_id(nid):
-    db = load_db()
-    content = db[nid]['content']
+    store = get_store()
+    try:
+        note = store.get(nid)
+    except blobs.BlobError:
+        print(MISSING_CONTENT.format(nid))
+        return
+    content = note['content']
 
     editor = os.environ.get("EDITOR", "nano")
     with tempfile.NamedTemporaryFile(mode="w+", delete=False) as tmp:
@@ -377,115 +724,194 @@ def edit_note_by_id(nid):
     os.unlink(tmp_path)
 
     if updated_content.strip() != content.strip():
-        db[nid]['content'] = updated_content
-        save_db(db)
+        with store.locked():
+            note = store.get(nid) or note
+            note['content'] = updated_content
+            store.update(nid, note)
         print("Note updated.")
     else:
         print("No changes made.")
 
-def search_notes(keyword):
-    db = load_db()
-    keyword = keyword.lower()
+def highlight(text, spans):
+    out, pos = [], 0
+    for start, end in spans:
+        out.append(text[pos:start] + f"{Style.BRIGHT}{Fore.RED}{text[start:end]}{Style.RESET_ALL}")
+        pos = end
+    return "".join(out) + text[pos:]
+
+@trace.phase("scan")
+def scan_notes(query, fuzzy=False, context=0, include_archive=False):
+    from note import scan
+    views = [False, True] if include_archive else [False]
     found = False
-    for idx, (nid, note) in enumerate(((k,v) for k,v in db.items() if not v.get('archived', False)), start=1):
-        if keyword in note['content'].lower():
-            dt = note['timestamp']
-            preview = note['content'][:100].replace('\n', ' ')
-            print(f"{idx}\t{nid}\t{dt}\t{preview}")
-            found = True
-    if not found:
-        print(f"No notes found containing '{keyword}'.")
-
-def add_tags_to_note(line_number, tags_to_add):
-    db = load_db()
-    keys = list(db.keys())
-
-    if not (1 <= line_number <= len(keys)):
-        print("Invalid note number.")
-        return
-
-    nid = keys[line_number - 1]
-    existing_tags = set(db[nid].get('tags', []))
-    new_tags = set(t.lower() for t in tags_to_add)
+    try:
+        for only_archived in views:
+            try:
+                hits = scan.search(
+                    ((idx, nid, note['timestamp'], note.get('content', ''))
+                     for idx, (nid, note) in enumerate(get_store().iter_notes(only_archived=only_archived), start=1)),
+                    query, fuzzy=fuzzy, context=context)
+            except re.error as e:
+                print(f"Invalid regular expression: {e}")
+                return
+            # printed as the scan finds them
+            for i, hit in enumerate(hits):
+                if only_archived and i == 0:
+                    print("Archived:")
+                print_scan_hits([hit])
+                found = True
+        if not found:
+            print(f"No notes found matching '{query}'.")
+    except BrokenPipeError:
+        discard_stdout()
+
+def print_scan_hits(hits):
+    for score, idx, nid, timestamp, count, lines in hits:
+        out = [f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t{Fore.BLUE}{nid}{Style.RESET_ALL}\t"
+               f"{Fore.LIGHTBLACK_EX}{pretty_time(timestamp, year=True)}{Style.RESET_ALL}\t"
+               f"{count} match{'es' if count != 1 else ''}"]
+        previous = None
+        for number, text, spans, is_match in lines:
+            if previous is not None and number != previous + 1:
+                out.append("  --")
+            sep = ":" if is_match else "-"
+            out.append(f"  {Fore.LIGHTBLACK_EX}{number}{sep}{Style.RESET_ALL} {highlight(text, spans)}")
+            previous = number
+        print("\n".join(out) + "\n")
+
+@trace.phase("search")
+def search_notes(keyword, substring=False, include_archive=False, top=None, as_json=False, words=False):
+    store = get_store()
+    views = [False, True] if include_archive else [False]
+    found = False
+    for only_archived in views:
+        # archived hits are numbered as in the archived view (`note list --archive`)
+        if top is None:
+            hits = [hit + (None,) for hit in store.search(keyword, substring=substring, only_archived=only_archived, words=words)]
+        else:
+            hits = store.ranked(keyword, top, only_archived=only_archived)
+        for i, (idx, nid, dt, preview, score) in enumerate(hits):
+            if as_json:
+                row = {"line": idx, "id": nid, "timestamp": dt, "archived": only_archived, "preview": preview}
+                if score is not None:
+                    row["score"] = round(score, 4)
+                print(json.dumps(row))
+                continue
+            if only_archived and not i:
+                print("Archived:")
+            print(f"{idx}\t{nid}\t{dt}\t{preview}" if score is None else f"{idx}\t{nid}\t{dt}\t{score:.2f}\t{preview}")
+        found = found or bool(hits)
+    if not found and not as_json:
+        print(f"No notes found containing '{keyword.lower()}'.")
+
+def add_tags_to_note(line_number, tags_to_add, *, only_archived=False):
+    store = get_store()
+    with store.transaction():
+        nid = store.nth(line_number, only_archived=only_archived)
+        if not nid:
+            print("Invalid note number for this view.")
+            return
 
-    updated_tags = list(existing_tags.union(new_tags))
-    db[nid]['tags'] = sorted(updated_tags)
-    save_db(db)
+        new_tags = set(t.lower() for t in tags_to_add)
+        store.tag_many([nid], add=new_tags)
 
     print(f"Added tags to note {line_number}: {', '.join(new_tags)}")
 
-def remove_tags_from_note(line_number, tags_to_remove):
-    db = load_db()
-    keys = list(db.keys())
-
-    if not (1 <= line_number <= len(keys)):
-        print("Invalid note number.")
-        return
-
-    nid = keys[line_number - 1]
-    current_tags = set(db[nid].get('tags', []))
-    tags_to_remove = set(t.lower() for t in tags_to_remove)
+def remove_tags_from_note(line_number, tags_to_remove, *, only_archived=False):
+    store = get_store()
+    with store.transaction():
+        nid = store.nth(line_number, only_archived=only_archived)
+        if not nid:
+            print("Invalid note number for this view.")
+            return
 
-    updated_tags = list(current_tags - tags_to_remove)
-    db[nid]['tags'] = sorted(updated_tags)
-    save_db(db)
+        tags_to_remove = set(t.lower() for t in tags_to_remove)
+        store.tag_many([nid], remove=tags_to_remove)
 
     print(f"Removed tags from note {line_number}: {', '.join(tags_to_remove)}")
 
-def pick_with_fzf():
-    db = load_db()
+def list_tags(counts=False):
+    store = get_store()
+    if not counts:
+        print("Tags:", ", ".join(store.tags()))
+        return
+    for tag, total, archived in store.tag_counts():
+        extra = f" {Fore.LIGHTBLACK_EX}({archived} archived){Style.RESET_ALL}" if archived else ""
+        print(f"{Fore.MAGENTA}{tag}{Style.RESET_ALL}\t{total}{extra}")
 
-    # Build active list (exclude archived) and keep insertion order
-    active_items = [(nid, note) for nid, note in db.items() if not note.get('archived', False)]
-    if not active_items:
-        print("No notes to pick.")
+def show_day_counts(since=None, until=None):
+    rows = get_store().day_counts(since=since, until=until)
+    if not rows:
+        print("No notes match.")
         return
+    for day, total, archived in rows:
+        extra = f" {Fore.LIGHTBLACK_EX}({archived} archived){Style.RESET_ALL}" if archived else ""
+        print(f"{Fore.GREEN}{day}{Style.RESET_ALL}\t{total}{extra}")
 
-    # Prepare display lines (1-based indices), include tags in magenta
-    lines = []
-    for idx, (nid, note) in enumerate(active_items, start=1):
-        dt = pretty_time(note['timestamp'])
-        raw = note['content'].replace('\n', ' ')
-        preview = (raw[:PREVIEW_LENGTH] + '...') if len(raw) > PREVIEW_LENGTH else raw
-        tags = note.get('tags', [])
+def show_tagged(all_of=(), any_of=()):
+    rows = get_store().tagged(all_of=all_of, any_of=any_of)
+    if not rows:
+        print("No notes match.")
+        return
+    for idx, nid, timestamp, tags, preview in rows:
+        dt = pretty_time(timestamp)
+        tag_str = f" {Fore.MAGENTA}[{' '.join(tags)}]{Style.RESET_ALL}"
+        print(
+            f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
+            f"{Fore.LIGHTBLACK_EX}{dt}{Style.RESET_ALL}\t"
+            f"{preview}{tag_str}")
+
+def picker_lines(rows):
+    # The note id rides along as a hidden first field (see --with-nth below);
+    # tags are shown in magenta.
+    for idx, nid, timestamp, date, tags, preview in rows:
         tag_str = f"\033[35m[{', '.join(tags)}]\033[0m" if tags else ""
-        lines.append(f"{idx}\t{dt}\t{preview} {tag_str}")
-
+        yield f"{nid}\t{idx}\t{short_date(date)}\t{preview} {tag_str}"
+
+@trace.phase("fzf")
+def run_fzf(lines):
+    """Feed ``lines`` to fzf as they are produced; return the chosen note ids."""
+    preview = f"{shlex.quote(sys.executable)} -m note.client preview {{1}}"
+    fzf = subprocess.Popen(
+        ["fzf", "--multi", "--ansi", "--prompt=Select note(s): ",
+         "--delimiter=\t", "--with-nth=2..",
+         f"--preview={preview}", "--preview-window=right:50%:wrap"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
     try:
-        fzf = subprocess.run(
-            ["fzf", "--multi", "--ansi", "--prompt=Select note(s): "],
-            input="\n".join(lines),
-            text=True,
-            capture_output=True
-        )
-        if fzf.returncode != 0 or not fzf.stdout.strip():
-            return
+        for i, line in enumerate(lines, start=1):
+            fzf.stdin.write(line + "\n")
+            if i % LIST_BATCH == 0:
+                fzf.stdin.flush()  # the first rows show up while the rest are still coming
+        fzf.stdin.close()
+    except BrokenPipeError:
+        pass  # picked (or quit) before every row was sent
+    chosen = fzf.stdout.read()
+    with contextlib.suppress(BrokenPipeError):
+        fzf.stdin.close()
+    if fzf.wait() != 0:
+        return []
+    return [line.split("\t", 1)[0] for line in chosen.splitlines() if line]
 
-        selected_lines = fzf.stdout.strip().splitlines()
-        # first field is the 1-based index we printed
-        selected_idxs = [int(line.split("\t")[0]) for line in selected_lines]
+def pick_with_fzf():
+    store = get_store()
 
-        # Map indices back to note IDs using the SAME active_items list
-        selected_ids = []
-        for i in selected_idxs:
-            if 1 <= i <= len(active_items):
-                selected_ids.append(active_items[i - 1][0])
+    # Active notes in insertion order, read lazily
+    rows = trace.iterate("rows", store.listing())
+    first = next(rows, None)
+    if first is None:
+        print("No notes to pick.")
+        return
 
+    try:
+        selected_ids = run_fzf(picker_lines(itertools.chain([first], rows)))
         if not selected_ids:
             return
 
         # ----- Single selection: view on Enter, then offer actions -----
         if len(selected_ids) == 1:
             nid = selected_ids[0]
-            note = db[nid]
-            dt_full = pretty_time(note["timestamp"], year=True)
-            tags = note.get("tags", [])
-            tag_str = f"[{', '.join(tags)}]" if tags else ""
-
-            # Show the full note
-            print(f"\n{Fore.GREEN}Note ({nid}){Style.RESET_ALL}")
-            print(f"{Fore.LIGHTBLACK_EX}{dt_full}{Style.RESET_ALL} {Fore.MAGENTA}{tag_str}{Style.RESET_ALL}\n")
-            print(note.get('content', ''))
+            note = store.get(nid, inline=False)
+            show_note(nid, note)
 
             # Post-view actions
             next_action = input("\n(e)dit, (a)ppend, (d)elete, or (Enter) to cancel > ").strip().lower()
@@ -497,8 +923,13 @@ def pick_with_fzf():
             elif next_action == "a":
                 text = input("Append text: ")
                 if text.strip():
-                    db[nid]['content'] = (db[nid].get('content', '') + ("\n" if db[nid].get('content') else "") + text)
-                    save_db(db)
+                    with store.locked():
+                        note = store.get(nid)  # the whole content; raises if its blob is missing
+                        if note is None:
+                            print("Note not found.")
+                            return
+                        note['content'] = (note.get('content', '') + ("\n" if note.get('content') else "") + text)
+                        store.update(nid, note)
                     print("Note updated.")
                 else:
                     print("Cancelled.")
@@ -506,8 +937,7 @@ def pick_with_fzf():
             elif next_action == "d":
                 confirm = input(f"Delete note {nid}? (y/n) > ").strip().lower()
                 if confirm == 'y':
-                    del db[nid]
-                    save_db(db)
+                    store.delete(nid)
                     print("Note deleted.")
                 else:
                     print("Cancelled.")
@@ -515,17 +945,41 @@ def pick_with_fzf():
                 print("No changes made.")
             return
 
-        # ----- Multi-select: bulk delete -----
+        # ----- Multi-select: bulk actions, each a single write -----
         print("Selected notes:")
         for sid in selected_ids:
             print(f"- {sid}")
-        confirm = input("Delete all selected notes? (y/n) > ").strip().lower()
-        if confirm == 'y':
-            for sid in selected_ids:
-                if sid in db:
-                    del db[sid]
-            save_db(db)
-            print(f"Deleted {len(selected_ids)} notes.")
+        action = input("(d)elete, (t)ag, (a)rchive, or (Enter) to cancel > ").strip().lower()
+
+        if action == "d":
+            confirm = input("Delete all selected notes? (y/n) > ").strip().lower()
+            if confirm == 'y':
+                store.delete(*selected_ids)
+                print(f"Deleted {len(selected_ids)} notes.")
+            else:
+                print("Cancelled.")
+
+        elif action == "t":
+            new_tags = {t.lower() for t in input("Tags to add (space-separated) > ").split()}
+            if not new_tags:
+                print("Cancelled.")
+                return
+            with store.locked():
+                notes = store.get_many(selected_ids, inline=False)
+                changed = [(nid, dict(note, tags=sorted(set(note.get('tags', [])) | new_tags)))
+                           for nid, note in notes if note is not None]
+                store.update_many(changed, op="tag")
+            print(f"Added tags to {len(changed)} notes: {', '.join(sorted(new_tags))}")
+
+        elif action == "a":
+            now = datetime.now().isoformat()
+            with store.locked():
+                notes = store.get_many(selected_ids, inline=False)
+                changed = [(nid, dict(note, archived=True, archived_at=now))
+                           for nid, note in notes if note is not None and not note.get('archived')]
+                store.update_many(changed)
+            print(f"Archived {len(changed)} notes.")
+
         else:
             print("Cancelled.")
 
@@ -541,6 +995,12 @@ def main():
     if args[0] in ["-h", "--help", "help"]:
         print_help()
 
+    elif args[0] == "backup" and any(a in ("--incremental", "--list", "--prune") for a in args[1:]):
+        backup_snapshots(args[1:])
+
+    elif args[0] == "restore" and any(a in ("--snapshot", "--id") for a in args[1:]):
+        restore_snapshot(args[1:])
+
     elif args[0] == "backup" and len(args) == 2:
         backup_notes(args[1])
 
@@ -548,15 +1008,19 @@ def main():
         restore_notes(args[1])
 
 
+    elif args[0] == "export" and any(a in EXPORT_FILTERS for a in args[1:]):
+        export_matching(args[1:])
+
     elif args[0] == "export" and len(args) >= 2:
         only_archived = ("--archive" in args[1:])
         try:
             nonflags = [a for a in args[1:] if not a.startswith("-")]
             num = int(nonflags[0])
             fname = nonflags[1] if len(nonflags) > 1 else None
-            export_note(num, fname, only_archived=only_archived)
-        except Exception:
+        except (IndexError, ValueError):
             print("Usage: note export <number> [filename] [--archive]")
+            return
+        export_note(num, fname, only_archived=only_archived)
 
     elif args[0] == "--archive" and len(args) == 2:
         try:
@@ -566,90 +1030,203 @@ def main():
             return
         archive_older_than(days)
 
-    elif args[0] == "import" and len(args) == 2:
-        import_note(args[1])
+    elif args[0] == "import" and len(args) >= 2:
+        rest, tags = extract_tags(args[1:])
+        sources = [a for a in rest if a != "--jsonl"]
+        if sources:
+            import_notes(sources, tags=tags, jsonl="--jsonl" in rest)
+        else:
+            print("Usage: note import <file|dir|glob|-> ... [--jsonl] [--tags tag1 tag2]")
+
+    elif args[0] == "sync" and len(args) == 2:
+        sync_stores(args[1])
+
+    elif args[0] == "dedupe":
+        options = {"--threshold": str(dedupe.THRESHOLD)}
+        actions = []
+        it = iter(args[1:])
+        try:
+            for a in it:
+                if a in options:
+                    options[a] = next(it)
+                elif a in ("--merge", "--archive"):
+                    actions.append(a)
+                else:
+                    raise ValueError
+            threshold = float(options["--threshold"])
+            if not 0 < threshold <= 1 or len(actions) > 1:
+                raise ValueError
+        except (StopIteration, ValueError):
+            print(DEDUPE_USAGE)
+            return
+        find_duplicates(threshold, actions[0] if actions else None)
+
+    elif args[0] == "migrate" and len(args) == 1:
+        migrate_to_sqlite()
+
+    elif args[0] == "--serve" and len(args) == 1:
+        from note import server
+        server.serve(SOCKET_PATH)
 
     elif args[0] == "add":
         args, tags = extract_tags(args[1:])  # skip "add"
         add_note_with_editor(tags=tags)
 
+    elif args[0] == "preview" and len(args) == 2:
+        preview_note(args[1])
+
     elif args[0] in ["view", "v", "show"] and len(args) == 2:
         only_archived = ("--archive" in args[1:])
         try:
             num = int([a for a in args[1:] if not a.startswith("-")][0])
-            view_note(num, only_archived=only_archived)
-        except Exception:
+        except (IndexError, ValueError):
             print("Usage: note view <number> [--archive]")
+            return
+        view_note(num, only_archived=only_archived)
 
     elif args[0] in ["list", "ls", "--list"]:
-        show_all_info = ("-a" in args[1:])
-        only_archived = ("--archive" in args[1:])
-        list_notes(all_info=show_all_info, include_archived=False, only_archived=only_archived)
+        options = {"--since": None, "--until": None, "--offset": "0", "--limit": None}
+        flags = set()
+        it = iter(args[1:])
+        for a in it:
+            if a in options:
+                options[a] = next(it, None)
+            else:
+                flags.add(a)
+        try:
+            since, until = (parse_date(options[k]) if options[k] else None for k in ("--since", "--until"))
+            offset = int(options["--offset"])
+            limit = int(options["--limit"]) if options["--limit"] is not None else None
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError
+        except (TypeError, ValueError):
+            print("Usage: note list [-a] [--archive] [--reverse] [--since <date>] [--until <date>] "
+                  "[--offset N] [--limit N]")
+            return
+        list_notes(all_info="-a" in flags, include_archived=False, only_archived="--archive" in flags,
+                   since=since, until=until, reverse="--reverse" in flags, offset=offset, limit=limit)
+
+    elif args[0] == "stats":
+        options = {"--since": None, "--until": None}
+        it = iter(a for a in args[1:] if a != "--by-day")
+        try:
+            if "--by-day" not in args[1:]:
+                raise ValueError
+            for a in it:
+                if a not in options:
+                    raise ValueError
+                options[a] = parse_date(next(it))
+        except (StopIteration, TypeError, ValueError):
+            print("Usage: note stats --by-day [--since <date>] [--until <date>]")
+            return
+        show_day_counts(since=options["--since"], until=options["--until"])
 
     elif args[0] == "tags":
-        db = load_db()
-        if len(args) == 1:
-            all_tags = set()
-            for note in db.values():
-                all_tags.update(note.get('tags', []))
-            print("Tags:", ", ".join(sorted(all_tags)))
-        elif len(args) == 2:
-            tag = args[1].lower()
-            for idx, (nid, note) in enumerate(db.items(), start=1):
-                if tag in note.get('tags', []):
-                    dt = pretty_time(note['timestamp'])
-                    preview = note['content'][:PREVIEW_LENGTH].replace('\n', ' ')
-                    tags = note.get('tags', [])
-                    tag_str = f" {Fore.MAGENTA}[{' '.join(tags)}]{Style.RESET_ALL}"
-                    print(
-                        f"{Fore.GREEN}{idx}{Style.RESET_ALL}\t"
-                        f"{Fore.LIGHTBLACK_EX}{dt}{Style.RESET_ALL}\t"
-                        f"{preview}{tag_str}")
+        rest = args[1:]
+        if not rest:
+            list_tags()
+        elif rest == ["--counts"]:
+            list_tags(counts=True)
+        elif len(rest) == 1 and not rest[0].startswith("-"):
+            show_tagged(all_of=[rest[0].lower()])
+        elif rest[0] in ("--all-of", "--any-of"):
+            filters = {"--all-of": [], "--any-of": []}
+            for a in rest:
+                if a in filters:
+                    current = filters[a]
+                else:
+                    current.append(a.lower())
+            show_tagged(all_of=filters["--all-of"], any_of=filters["--any-of"])
         else:
-            print("Usage: note tags [tagname]")
+            print("Usage: note tags [tagname | --counts | --all-of tag1 tag2 | --any-of tag1 tag2]")
 
     elif args[0] == "--delete-all":
         delete_all_notes()
 
+    elif args[0] == "del" and any(a in ("--where", "--search") for a in args[1:]):
+        delete_matching(args[1:])
+
+    elif args[0] in ("tagadd", "tagrm") and any(a in ("--where", "--search") for a in args[1:]):
+        tag_matching(args[1:], remove=args[0] == "tagrm")
+
     elif args[0] == "del" and len(args) >= 2:
         only_archived = ("--archive" in args[1:])
         try:
             num = int([a for a in args[1:] if not a.startswith("-")][0])
-            delete_note(num, only_archived=only_archived)
-        except Exception:
+        except (IndexError, ValueError):
             print("Usage: note del <number> [--archive]")
+            return
+        delete_note(num, only_archived=only_archived)
 
     elif args[0] == "append" and len(args) >= 3:
         only_archived = ("--archive" in args[1:])
         try:
             num = int([a for a in args[1:] if not a.startswith("-")][0])
-            append_note(num, ' '.join([a for a in args[2:] if not a.startswith("-")]), only_archived=only_archived)
-        except Exception:
+        except (IndexError, ValueError):
             print("Usage: note append <number> <text> [--archive]")
+            return
+        append_note(num, ' '.join([a for a in args[2:] if not a.startswith("-")]), only_archived=only_archived)
 
 
     elif args[0] == "edit" and len(args) >= 2:
         only_archived = ("--archive" in args[1:])
         try:
             num = int([a for a in args[1:] if not a.startswith("-")][0])
-            edit_note(num, only_archived=only_archived)
-        except Exception:
+        except (IndexError, ValueError):
             print("Usage: note edit <number> [--archive]")
+            return
+        edit_note(num, only_archived=only_archived)
+
+    elif args[0] == "search" and ("--regex" in args[1:] or "--fuzzy" in args[1:]):
+        words, context = [], 0
+        it = iter(args[1:])
+        try:
+            for a in it:
+                if a in ("-C", "--context"):
+                    context = int(next(it))
+                elif a not in ("--regex", "--fuzzy", "--include-archive"):
+                    words.append(a)
+            if not words or context < 0:
+                raise ValueError
+        except (StopIteration, ValueError):
+            print("Usage: note search (--regex <pattern> | --fuzzy <text>) [-C <lines>] [--include-archive]")
+            return
+        scan_notes(' '.join(words), fuzzy="--fuzzy" in args[1:], context=context,
+                   include_archive="--include-archive" in args[1:])
 
     elif args[0] == "search" and len(args) >= 2:
-        search_notes(' '.join(args[1:]))
+        words, top = [], None
+        it = iter(args[1:])
+        try:
+            for a in it:
+                if a == "--top":
+                    top = int(next(it))
+                elif a not in ("--substring", "--words", "--include-archive", "--json"):
+                    words.append(a)
+            if not words or (top is not None and (top < 1 or "--substring" in args[1:])) or \
+                    {"--substring", "--words"} <= set(args[1:]):
+                raise ValueError
+        except (StopIteration, ValueError):
+            print("Usage: note search <terms> [--words] [--top <n>] [--json] [--include-archive]")
+            print("       note search --substring <text> [--json] [--include-archive]")
+            return
+        search_notes(' '.join(words), substring="--substring" in args[1:],
+                     include_archive="--include-archive" in args[1:], top=top, as_json="--json" in args[1:],
+                     words="--words" in args[1:])
 
     elif args[0] == "tagadd" and len(args) >= 3:
+        only_archived = ("--archive" in args[2:])
         try:
             line_number = int(args[1])
-            add_tags_to_note(line_number, args[2:])
+            add_tags_to_note(line_number, [a for a in args[2:] if a != "--archive"], only_archived=only_archived)
         except ValueError:
             print("Please provide a valid number.")
 
     elif args[0] == "tagrm" and len(args) >= 3:
+        only_archived = ("--archive" in args[2:])
         try:
             line_number = int(args[1])
-            remove_tags_from_note(line_number, args[2:])
+            remove_tags_from_note(line_number, [a for a in args[2:] if a != "--archive"], only_archived=only_archived)
         except ValueError:
             print("Please provide a valid number.")
 
@@ -659,4 +1236,5 @@ def main():
         add_note(' '.join(args), tags=tags)
 
 if __name__ == "__main__":
+    sys.argv[1:] = trace.configure(sys.argv[1:])
     main()
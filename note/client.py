@@ -0,0 +1,78 @@
+"""Entry point that hands commands to a running ``note --serve``.
+
+Importing the CLI, colorama and the store costs more than most commands do,
+so this module only uses the standard library.  If a server is listening on
+SOCKET_PATH the command is sent there and its output copied back; otherwise
+quick adds go through quick.py, and everything else, including commands that
+need the terminal, runs the CLI here as usual.  Commands traced with
+``--profile`` or ``NOTE_TRACE`` always run here.
+"""
+import os, sys
+from note.config import SOCKET_PATH
+
+# Commands that prompt, open an editor or fzf, replace the whole store or write to another.
+LOCAL_COMMANDS = {"add", "edit", "del", "import", "export", "restore", "--delete-all", "migrate", "--serve", "sync", "dedupe"}
+
+# Every word cli.main() dispatches on; anything else is a quick add.
+COMMANDS = LOCAL_COMMANDS | {
+    "-h", "--help", "help", "backup", "--archive", "view", "v", "show", "list", "ls", "--list",
+    "tags", "append", "search", "tagadd", "tagrm", "preview", "stats",
+}
+
+def request(*fields):
+    """Send one request to the server and return its reply, or None if none is running."""
+    # NUL-separated fields: arguments can't contain NUL, and no json import
+    if not os.path.exists(SOCKET_PATH):
+        return None
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(SOCKET_PATH)
+            sock.sendall(b"\0".join(os.fsencode(field) for field in fields))
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except OSError:
+        return None
+    return b"".join(chunks)
+
+def forward(args):
+    reply = request("run", os.getcwd(), *args)
+    if reply is None:
+        return False
+    if not sys.stdout.isatty():
+        import re
+        reply = re.sub(rb"\x1b\[[0-9;]*m", b"", reply)  # as colorama does for pipes
+    try:
+        sys.stdout.buffer.write(reply)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())  # pager closed early
+    return True
+
+def main():
+    from note import trace
+    args = sys.argv[1:] = trace.configure(sys.argv[1:])
+    # traced commands run here, where their phases can be timed
+    if args and args[0] not in LOCAL_COMMANDS and not trace.enabled():
+        if forward(args):
+            return
+    elif args[:1] != ["--serve"]:
+        # make the server write out anything it is holding before we touch the files
+        request("flush")
+    if args and args[0] not in COMMANDS:
+        with trace.phase("quick add"):
+            from note import quick
+            if quick.add(args):
+                return
+    with trace.phase("import"):
+        from note import cli
+    with trace.phase("run"):
+        cli.main()
+
+if __name__ == "__main__":
+    main()
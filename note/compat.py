@@ -0,0 +1,13 @@
+"""Optional dependencies, imported on first use.
+
+Every command imports the modules that can use them, and most commands
+never get that far, so they are not imported at the top.
+"""
+
+def numpy():
+    """Return the numpy module, or None if it isn't installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
@@ -0,0 +1,23 @@
+"""File locations and user settings, kept free of heavy imports so the
+quick-add path and the server client can read them cheaply."""
+import os
+
+DB_PATH = os.path.expanduser("~/.notes_db.json")
+SQLITE_PATH = os.path.expanduser("~/.notes_db.sqlite")
+CONFIG_PATH = os.path.expanduser("~/.noterc")
+SOCKET_PATH = os.path.expanduser("~/.notes_db.sock")
+
+def read_config():
+    # "key = value" lines; '#' starts a comment
+    config = {}
+    try:
+        with open(CONFIG_PATH, 'r') as f:
+            for line in f:
+                key, sep, value = line.split('#', 1)[0].partition('=')
+                if sep:
+                    config[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return config
+
+BACKEND = os.environ.get("NOTE_BACKEND") or read_config().get("backend", "json")
@@ -0,0 +1,245 @@
+"""Near-duplicate notes, for ``note dedupe``.
+
+A note's content is lowercased, its whitespace collapsed, and cut into
+overlapping SHINGLE_BYTES-byte shingles, each read as a number.  Its
+MinHash signature keeps, for each of NUM_HASHES hash functions, the
+smallest hash of any shingle; two signatures agree in about the same share
+of places as the notes share shingles (their Jaccard similarity), so notes
+are compared without reading them again.  To avoid comparing every pair, signatures are cut into BANDS
+bands and only notes that agree on a whole band are compared (LSH); those
+that agree in at least ``threshold`` of their values are linked, and each
+group of linked notes is a cluster.
+
+Signatures are worked out with NumPy when it is installed, many notes at
+a time, and in pure Python otherwise, with the same result.  They are kept
+per note, by the MinHashIndex sidecar for the JSON store and in a table of
+the SQLite store, so a rerun only hashes notes added or changed since.
+"""
+import zlib
+from array import array
+from note import blobs, compat, journal, sidecar
+
+INDEX_SUFFIX = ".minhash"
+SHINGLE_BYTES = 5
+MAX_SHINGLED = 64 << 10  # bytes of a (normalized) note that are shingled; longer ones are judged by these
+NUM_HASHES = 64
+BANDS, ROWS = 16, 4      # BANDS * ROWS == NUM_HASHES; pairs this side of ~0.5 similar rarely meet
+THRESHOLD = 0.8
+MAX_REPS = 4             # notes of a bucket the rest are compared with, so a band shared by thousands stays cheap
+MASK = (1 << 64) - 1     # hash functions are ((a * x + b) mod 2**64) >> 32 over 40-bit shingles
+HASH_BATCH = 1 << 16     # bytes of text hashed at once with NumPy (x NUM_HASHES x 8 bytes of scratch)
+NOTE_BATCH = 4096        # notes whose text is held at once while hashing
+
+# fixed, so signatures from any process and either code path compare
+_A = [zlib.crc32(b"a%d" % i) << 32 | zlib.crc32(b"A%d" % i) | 1 for i in range(NUM_HASHES)]
+_B = [zlib.crc32(b"b%d" % i) << 32 | zlib.crc32(b"B%d" % i) for i in range(NUM_HASHES)]
+
+def normalize(text):
+    return " ".join(text.lower().split()).encode()[:MAX_SHINGLED]
+
+def shingles(data):
+    """The set of shingles of normalized ``data``, as numbers."""
+    if len(data) <= SHINGLE_BYTES:
+        return {int.from_bytes(data, 'big')} if data else set()
+    return {int.from_bytes(data[i:i + SHINGLE_BYTES], 'big') for i in range(len(data) - SHINGLE_BYTES + 1)}
+
+def _signature(hashes):
+    return array('I', [min([(a * x + b) & MASK for x in hashes]) >> 32 for a, b in zip(_A, _B)]).tobytes()
+
+def signatures(texts):
+    """Return the signature (bytes) of each normalized text; an empty one for an empty text."""
+    np = compat.numpy()
+    if np is None:
+        return [_signature(shingles(data)) if data else b"" for data in texts]
+    out = [b""] * len(texts)
+    a, b = np.array(_A, dtype=np.uint64)[:, None], np.array(_B, dtype=np.uint64)[:, None]
+    todo = [i for i, data in enumerate(texts) if data]
+    at = 0
+    while at < len(todo):
+        batch, size = [], 0
+        while at < len(todo) and (not batch or size + len(texts[todo[at]]) <= HASH_BATCH):
+            size += len(texts[todo[at]])
+            batch.append(todo[at])
+            at += 1
+        # every window of the batch's texts laid end to end, read as a number,
+        # less those straddling two texts; a short text is one shingle of its own
+        joined = np.frombuffer(b"".join(texts[i] for i in batch), dtype=np.uint8).astype(np.uint64)
+        windows = np.zeros(max(len(joined) - SHINGLE_BYTES + 1, 0), dtype=np.uint64)
+        for k in range(SHINGLE_BYTES):
+            windows = windows << np.uint64(8) | joined[k:len(joined) - SHINGLE_BYTES + 1 + k]
+        keep = np.zeros(len(windows), dtype=bool)
+        parts, offset = [], 0
+        for i in batch:
+            n = len(texts[i])
+            if n >= SHINGLE_BYTES:
+                keep[offset:offset + n - SHINGLE_BYTES + 1] = True
+                parts.append(n - SHINGLE_BYTES + 1)
+            offset += n
+        flat = windows[keep]
+        short = [i for i in batch if len(texts[i]) < SHINGLE_BYTES]
+        if short:
+            flat = np.concatenate([flat, np.array([int.from_bytes(texts[i], 'big') for i in short], dtype=np.uint64)])
+            parts += [1] * len(short)
+        order = [i for i in batch if len(texts[i]) >= SHINGLE_BYTES] + short
+        starts = np.cumsum([0] + parts[:-1])
+        # one row per hash function, so each text's shingles are a contiguous run; uint64 wraps
+        mins = np.minimum.reduceat(a * flat + b, starts, axis=1) >> np.uint64(32)
+        for i, row in zip(order, mins.T.astype(np.uint32)):
+            out[i] = row.tobytes()
+    return out
+
+def similarity(a, b):
+    """The share of places where signatures ``a`` and ``b`` agree."""
+    diff = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')  # zero words where they agree
+    return array('I', diff.to_bytes(len(a), 'little')).count(0) / NUM_HASHES
+
+def _bucket_pairs(sigs, threshold):
+    # LSH in pure Python: each note is compared with the first MAX_REPS notes
+    # of every bucket it is in, so a band thousands of notes share (a template,
+    # say) stays cheap; a near-duplicate missed there usually shares another band
+    width = ROWS * 4
+    for band in range(BANDS):
+        buckets = {}
+        for i, sig in enumerate(sigs):
+            buckets.setdefault(sig[band * width:(band + 1) * width], []).append(i)
+        for members in buckets.values():
+            for n, j in enumerate(members[:MAX_REPS]):
+                for i in members[n + 1:]:
+                    if similarity(sigs[i], sigs[j]) >= threshold:
+                        yield j, i
+
+def _bucket_pairs_numpy(np, sigs, threshold):
+    # the same comparisons as _bucket_pairs(), a band at a time: a stable sort
+    # puts each bucket's notes together, in order, and each run is compared
+    # with its first MAX_REPS notes in one go
+    m = np.frombuffer(b"".join(sigs), dtype=np.uint32).reshape(len(sigs), NUM_HASHES)
+    at = np.arange(len(sigs))
+    for band in range(BANDS):
+        cols = m[:, band * ROWS:(band + 1) * ROWS]
+        order = np.lexsort(cols.T[::-1])
+        ordered = cols[order]
+        new = np.ones(len(sigs), dtype=bool)
+        new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+        start = np.maximum.accumulate(np.where(new, at, 0))
+        for r in range(MAX_REPS):
+            later = np.flatnonzero(at - start > r)
+            for chunk in range(0, len(later), HASH_BATCH):
+                part = later[chunk:chunk + HASH_BATCH]
+                a, b = order[start[part] + r], order[part]
+                close = (m[a] == m[b]).sum(axis=1) / NUM_HASHES >= threshold
+                yield from zip(a[close].tolist(), b[close].tolist())
+
+def clusters(sigs, threshold=THRESHOLD):
+    """Group near-duplicate signatures.
+
+    Returns lists of positions in ``sigs``, each in order, ordered by their
+    first; notes with an empty signature are left out.
+    """
+    parent = {}
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # identical signatures are one cluster already; only one of each goes through LSH
+    first = {}
+    for i, sig in enumerate(sigs):
+        if sig:
+            parent[i] = first.setdefault(sig, i)
+    reps = list(first.values())
+    np = compat.numpy()
+    pairs = _bucket_pairs(list(first), threshold) if np is None else _bucket_pairs_numpy(np, list(first), threshold)
+    for j, i in pairs:
+        ri, rj = root(reps[i]), root(reps[j])
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    groups = {}
+    for i in parent:
+        groups.setdefault(root(i), []).append(i)
+    return sorted(g for g in groups.values() if len(g) > 1)
+
+def merge(notes):
+    """Fold ``notes`` (a cluster, in order) into its first: lines it lacks are appended, tags joined."""
+    keep = dict(notes[0])
+    lines = keep.get('content', '').split('\n')
+    seen = {normalize(line) for line in lines}  # as shingled: case and spacing don't count
+    tags = set(keep.get('tags', []))
+    for note in notes[1:]:
+        for line in note.get('content', '').split('\n'):
+            if normalize(line) not in seen:
+                seen.add(normalize(line))
+                lines.append(line)
+        tags.update(note.get('tags', []))
+    keep['content'] = '\n'.join(lines)
+    keep['tags'] = sorted(tags)
+    return keep
+
+def collapse(store, groups, archive=False):
+    """Keep the first note of each group of ids; merge the others into it and delete them, or archive them.
+
+    All of it is one write.  Returns how many notes were merged away or archived.
+    """
+    from datetime import datetime
+    with store.transaction():
+        notes = dict(store.get_many([nid for group in groups for nid in group], inline=not archive))
+        groups = [g for g in ([nid for nid in group if nid in notes] for group in groups) if len(g) > 1]
+        if archive:
+            now = datetime.now().isoformat()
+            store.update_many([(nid, dict(notes[nid], archived=True, archived_at=now))
+                               for group in groups for nid in group[1:]])
+        else:
+            store.update_many([(group[0], merge([notes[nid] for nid in group])) for group in groups])
+            store.delete(*[nid for group in groups for nid in group[1:]])
+    return sum(len(group) - 1 for group in groups)
+
+class MinHashIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    version = (1, SHINGLE_BYTES, MAX_SHINGLED, NUM_HASHES)  # rebuilt if signatures would differ
+    binary = True
+    save_after_bytes = 0  # hashing is what costs; never redo it next run
+
+    def build(self, db):
+        self.sigs = {}  # nid -> signature
+        self.keys = {}  # nid -> what its signature was worked out from (a crc)
+        self._hash(db.items())
+
+    def restore(self, data):
+        self.sigs = data['sigs']
+        self.keys = data['keys']
+
+    def dump(self):
+        return {"sigs": self.sigs, "keys": self.keys}
+
+    def apply(self, op):
+        self.apply_all([op])
+
+    def apply_all(self, ops):
+        changed = {}
+        for op in ops:
+            nid = op['id']
+            if op['op'] == 'delete' or (op['op'] != 'add' and nid not in self.keys and nid not in changed):
+                changed.pop(nid, None)
+                self.sigs.pop(nid, None)
+                self.keys.pop(nid, None)
+            else:
+                changed[nid] = op['note']
+        self._hash(changed.items())
+
+    def _hash(self, items):
+        # only notes whose text changed (a tag or archive op leaves it alone) are hashed again
+        nids, texts = [], []
+        for nid, note in items:
+            # a large note's blob is named by its content: no need to read it to see it's the same
+            key = zlib.crc32(note['blob'].encode() if blobs.is_blob(note) else note.get('content', '').encode())
+            if self.keys.get(nid) == key and nid in self.sigs:
+                continue
+            self.keys[nid] = key
+            nids.append(nid)
+            texts.append(normalize(blobs.content(self.db_path, note, partial=True)))
+            if len(texts) >= NOTE_BATCH:
+                self.sigs.update(zip(nids, signatures(texts)))
+                nids, texts = [], []
+        self.sigs.update(zip(nids, signatures(texts)))
+
+journal.snapshot_hooks.append(MinHashIndex.carry_over)
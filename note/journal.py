@@ -0,0 +1,600 @@
+"""Append-only storage engine for the JSON note store.
+
+The store is a compacted snapshot at DB_PATH (the same ``{id: note}`` JSON the
+tool has always written, so old databases load as-is) plus an operation
+journal next to it.  Mutations append one JSON line to the journal instead of
+rewriting the snapshot; loading replays the journal over the snapshot, and the
+journal is folded back into the snapshot once it grows past a threshold.
+
+Every op carries the full resulting note (or just the id for deletes), so
+replaying an op twice is harmless.  That is what makes compaction crash-safe:
+the new snapshot is renamed into place before the journal is truncated.
+
+Derived index files remember which snapshot and journal offset they reflect
+(see sidecar.py) and catch up by replaying only the journal tail.
+
+Archived notes move out of the snapshot into a compressed cold segment at
+compaction time (see evict()), leaving a small stub in their place, so commands
+that only look at active notes never parse their bodies.
+
+Concurrent processes coordinate through an advisory lock file: appends and
+snapshot rewrites hold it exclusively, readers hold it shared so a compaction
+can't truncate the journal halfway through a replay.  Appends are fsynced
+after the lock is released, and a writer whose bytes were already covered by
+another writer's fsync skips its own, so writers queued behind each other
+share one sync (group commit).
+"""
+import collections, contextlib, gzip, io, json, mmap, os, struct
+from note import trace
+from note.model import JOURNAL, SNAPSHOT, NoteStore, with_defaults
+try:
+    import fcntl
+except ImportError:  # no advisory locks on Windows; one process at a time there
+    fcntl = None
+try:
+    import lzma
+except ImportError:  # Python built without liblzma; cold members are gzipped instead
+    lzma = None
+
+JOURNAL_SUFFIX = ".journal"
+LOCK_SUFFIX = ".lock"
+SYNC_SUFFIX = ".sync"  # lock for fsyncing the journal; holds the offset synced so far
+COMPACT_MIN_BYTES = 1 << 20  # never compact a journal smaller than this...
+COMPACT_RATIO = 0.25         # ...or smaller than this fraction of the snapshot
+COLD_SUFFIX = ".cold"        # followed by the generation: .cold.1, .cold.2, ...
+COLD_MEMBER_BYTES = 256 << 10  # notes compressed together; reading one decompresses its member
+COLD_PRESET = 1              # lzma level; higher levels are many times slower for little gain
+COLD_STALE_MIN = 1000        # stale cold copies tolerated before a new generation is written
+COLD_CACHE_MEMBERS = 16      # decoded members a reader keeps, for notes read out of member order
+
+OPS = ("add", "update", "tag", "delete")
+
+# Index modules register callables here so rewriting the snapshot doesn't
+# leave them to be rebuilt from scratch.  Each is called as
+# ``hook(db_path, carry)`` before the snapshot is written -- ``carry`` is true
+# when the new snapshot holds exactly the old snapshot plus the journal -- and
+# may return a function that receives the new db (a NoteStore) and the
+# ``{nid: (offset, length)}`` locations of its notes once it is in place.
+snapshot_hooks = []
+
+def journal_path(db_path):
+    return db_path + JOURNAL_SUFFIX
+
+_locks = {}  # lock path -> [fd, exclusive, depth] for locks this process holds
+
+@contextlib.contextmanager
+def lock(db_path, exclusive=True, suffix=LOCK_SUFFIX):
+    """Hold the store's advisory lock.
+
+    Nested calls share the outer lock; asking for an exclusive lock inside a
+    shared one upgrades it until the inner block ends.
+    """
+    if fcntl is None:
+        yield
+        return
+    path = db_path + suffix
+    held = _locks.get(path)
+    upgraded = False
+    if held is None:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held = _locks[path] = [fd, exclusive, 0]
+    elif exclusive and not held[1]:
+        fcntl.flock(held[0], fcntl.LOCK_EX)
+        held[1] = upgraded = True
+    held[2] += 1
+    try:
+        yield
+    finally:
+        held[2] -= 1
+        if upgraded:
+            fcntl.flock(held[0], fcntl.LOCK_SH)
+            held[1] = False
+        if not held[2]:
+            del _locks[path]
+            os.close(held[0])
+
+def sync_dir(path):
+    if fcntl is None:
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+_SYNCED = struct.Struct("<Q")
+
+def _synced(fd):
+    data = os.pread(fd, _SYNCED.size, 0)
+    return _SYNCED.unpack(data)[0] if len(data) == _SYNCED.size else 0
+
+def sync_journal(db_path, end):
+    """Make the journal durable up to byte ``end``, sharing fsyncs between writers."""
+    with lock(db_path, suffix=SYNC_SUFFIX):
+        if fcntl is not None:
+            fd = _locks[db_path + SYNC_SUFFIX][0]
+            if _synced(fd) >= end:
+                return  # someone else's fsync already covered our bytes
+        with open(journal_path(db_path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            os.fsync(f.fileno())
+        if fcntl is not None:
+            os.pwrite(fd, _SYNCED.pack(size), 0)
+
+def read_snapshot(path):
+    """Return a NoteStore of the snapshot at ``path`` without parsing it into dicts.
+
+    Each note is kept as its byte range in the file, which is mapped rather
+    than read.  A file not laid out one note per line is parsed whole.
+    """
+    with open(path, 'rb') as f:
+        if os.name == "nt" or not os.fstat(f.fileno()).st_size:
+            data = f.read()  # Windows can't rename over a mapped file; an empty one can't be mapped
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            trace.add(read=len(data))  # read through the mapping, out of sight of the I/O counters
+    db = NoteStore(snapshot=data)
+    pos = 0
+    for line in io.BytesIO(data) if isinstance(data, bytes) else iter(data.readline, b""):
+        start, pos = pos, pos + len(line)
+        body = line.rstrip(b",\r\n")
+        if body.strip() in (b"{", b"}", b""):
+            continue
+        # write_snapshot's lines are  "<id>": <note>  with the id unescaped
+        # unless it needs escapes; anything else is parsed the long way
+        colon = body.find(b'": ', 3)
+        if body.startswith(b'  "') and colon != -1 and b"\\" not in body[3:colon]:
+            try:
+                note = json.loads(body[colon + 3:])
+            except ValueError:
+                note = None
+            if isinstance(note, dict):
+                db.put(body[3:colon].decode(), note, SNAPSHOT, start + colon + 3, len(body) - colon - 3)
+                continue
+        try:
+            (nid, note), = json.loads(b"{" + body + b"}").items()
+        except ValueError:
+            if len(db):
+                raise
+            # not one note per line (an old json.dump): parse it whole
+            db.update(json.loads(data[:]))
+            return db
+        db.put(nid, note)  # keep the note itself rather than work out where it is
+    if not len(db):
+        json.loads(data[:])  # "{}" is fine; an empty or garbled file isn't
+    return db
+
+def journal_size(db_path):
+    try:
+        return os.path.getsize(journal_path(db_path))
+    except OSError:
+        return 0
+
+def snapshot_id(db_path):
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    # compaction renames a new file into place, so the inode changes too
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+def read_records(db_path, start=0):
+    """Return ``(offset, length, op)`` for each op from byte offset ``start`` on,
+    and the offset after the last one."""
+    try:
+        f = open(journal_path(db_path), 'rb')
+    except FileNotFoundError:
+        return [], 0
+    with f:
+        f.seek(start)
+        return _records(f, start)
+
+def _records(lines, offset):
+    records = []
+    for line in lines:
+        if not line.endswith(b"\n"):
+            break  # torn write from a process that died mid-append
+        records.append((offset, len(line), json.loads(line)))
+        offset += len(line)
+    return records, offset
+
+def read_tail(db_path, start=0):
+    """Return the ops from byte offset ``start`` on, and the offset after the last one."""
+    records, end = read_records(db_path, start)
+    return [op for _, _, op in records], end
+
+def read_note(db_path, segment, offset, length):
+    path = db_path if segment == SNAPSHOT else journal_path(db_path)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = json.loads(f.read(length))
+    return with_defaults(data['note'] if segment == JOURNAL else data)
+
+def read_notes(db_path, locations):
+    """Yield ``(nid, note)`` for ``{nid: (segment, offset, length)}``, in file order."""
+    paths = {SNAPSHOT: db_path, JOURNAL: journal_path(db_path)}
+    for segment in (SNAPSHOT, JOURNAL):
+        wanted = sorted((offset, length, nid) for nid, (seg, offset, length) in locations.items()
+                        if seg == segment)
+        if not wanted:
+            continue
+        with open(paths[segment], 'rb') as f:
+            for offset, length, nid in wanted:
+                f.seek(offset)
+                data = json.loads(f.read(length))
+                yield nid, with_defaults(data['note'] if segment == JOURNAL else data)
+
+def read_ops(db_path, start=0):
+    return read_tail(db_path, start)[0]
+
+def apply_op(db, op):
+    nid = op['id']
+    if op['op'] == 'delete':
+        if nid in db:
+            del db[nid]
+    elif op['op'] == 'add' or nid in db:
+        # updates to a note deleted in the meantime are dropped
+        db[nid] = op['note']
+
+def replay(db_path, thaw=False):
+    """Return the db, as a NoteStore, and the journal offset it reflects.
+
+    Archived notes stay cold stubs unless ``thaw`` is set.
+    """
+    with lock(db_path, exclusive=False):
+        try:
+            db = read_snapshot(db_path)
+        except FileNotFoundError:
+            db = NoteStore()
+        try:
+            with open(journal_path(db_path), 'rb') as f:
+                db.tail = f.read()  # a compaction truncates it in place, so keep a copy
+        except FileNotFoundError:
+            pass
+        records, end = _records(io.BytesIO(db.tail), 0)
+        for offset, length, op in records:
+            if op['op'] == 'delete' or (op['op'] != 'add' and op['id'] not in db):
+                apply_op(db, op)
+            else:
+                db.put(op['id'], op['note'], JOURNAL, offset, length)
+        if thaw:
+            db.thaw(ColdReader(db_path))
+    return db, end
+
+def load(db_path):
+    return replay(db_path, thaw=True)[0]
+
+_MEMBER = struct.Struct("<II")  # notes in a cold member, compressed length that follows
+
+def cold_path(db_path, generation):
+    return f"{db_path}{COLD_SUFFIX}.{generation}"
+
+def cold_generations(db_path):
+    """Generations of the cold segment on disk, oldest first."""
+    directory, name = os.path.split(os.path.abspath(db_path))
+    prefix = name + COLD_SUFFIX + "."
+    return sorted(int(f[len(prefix):]) for f in os.listdir(directory)
+                  if f.startswith(prefix) and f[len(prefix):].isdigit())
+
+def is_cold(note):
+    return 'cold' in note
+
+def _members(f):
+    # (offset, count) of each complete member; a torn one at the end is ignored
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while offset + _MEMBER.size <= size:
+        f.seek(offset)
+        count, length = _MEMBER.unpack(f.read(_MEMBER.size))
+        if offset + _MEMBER.size + length > size:
+            break
+        yield offset, count
+        offset += _MEMBER.size + length
+
+def read_member(f, offset):
+    """Return ``{key: line}`` for the member at ``offset``; each line is a JSON
+    array whose first element is its key (a note id here, a digest in backups)."""
+    f.seek(offset)
+    _, length = _MEMBER.unpack(f.read(_MEMBER.size))
+    data = f.read(length)
+    data = gzip.decompress(data) if data[:2] == b"\x1f\x8b" else lzma.decompress(data)
+    # {nid: line}; a line is only parsed when its note is asked for
+    lines = {}
+    for line in data.splitlines():
+        nid = line[2:line.find(b'"', 2)]  # the id, unless it holds escapes
+        lines[json.loads(line)[0] if b"\\" in nid else nid.decode()] = line
+    return lines
+
+class ColdReader:
+    """Reads stubbed notes back from the cold segment, keeping recent members decoded.
+
+    Open it under the store lock: every generation is opened right away, so
+    a compaction that replaces them afterwards doesn't pull them from under it.
+    """
+    def __init__(self, db_path):
+        self.files = {gen: open(cold_path(db_path, gen), 'rb') for gen in cold_generations(db_path)}
+        self._cache = collections.OrderedDict()  # (generation, offset) -> member
+
+    def get(self, nid, stub):
+        key = tuple(stub['cold'])
+        member = self._cache.get(key)
+        if member is None:
+            generation, offset = key
+            member = self._cache[key] = read_member(self.files[generation], offset)
+            if len(self._cache) > COLD_CACHE_MEMBERS:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return with_defaults(json.loads(member[nid])[1])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def read_cold(db_path, stubs):
+    """Return ``{nid: note}`` for the ``{nid: stub}`` given."""
+    with contextlib.closing(ColdReader(db_path)) as reader:
+        # member by member, so each is decompressed only once
+        return {nid: reader.get(nid, stub)
+                for nid, stub in sorted(stubs.items(), key=lambda item: item[1]['cold'])}
+
+def _write_cold(path, notes):
+    # Appends members holding ``(nid, note)`` pairs; returns ``{nid: offset}``
+    # of the member each note went into.
+    created = not os.path.exists(path)
+    locations = {}
+    with open(path, 'ab') as f:
+        pos = f.seek(0, os.SEEK_END)
+        batch, size = [], 0
+        for nid, note in notes:
+            line = json.dumps([nid, note]).encode() + b"\n"
+            batch.append(line)
+            size += len(line)
+            locations[nid] = pos
+            if size >= COLD_MEMBER_BYTES:
+                pos += write_member(f, batch)
+                batch, size = [], 0
+        if batch:
+            write_member(f, batch)
+        f.flush()
+        os.fsync(f.fileno())
+    if created:
+        sync_dir(path)
+    return locations
+
+def write_member(f, lines):
+    data = b"".join(lines)
+    data = lzma.compress(data, preset=COLD_PRESET) if lzma else gzip.compress(data)
+    return f.write(_MEMBER.pack(len(lines), len(data)) + data)
+
+def evict(db_path, db, rewrite=False):
+    """Move archived notes' bodies out of the NoteStore ``db`` into the cold segment.
+
+    Each evicted note is left in ``db`` as a stub holding its timestamp and
+    where it went, so it keeps its place in the store; ``db`` is hot (not
+    thawed) afterwards.  Members are only ever appended to the newest
+    generation; copies no stub points at any more (archived notes since
+    edited, unarchived or deleted) are dropped by writing a new generation
+    once they outnumber the live ones, or right away with ``rewrite``.  Call
+    it holding the lock, before the snapshot that refers to it is written.
+    """
+    db.thaw(None)
+    stubs = db.stubs()
+    fresh = [nid for nid in db if db.archived(nid) and nid not in stubs]
+    if not stubs and not fresh:
+        return
+    generations = cold_generations(db_path)
+    generation = generations[-1] if generations else 1
+    if stubs and not rewrite:
+        with open(cold_path(db_path, generation), 'rb') as f:
+            stale = sum(count for _, count in _members(f)) - len(stubs)
+        rewrite = (stale > max(len(stubs), COLD_STALE_MIN)
+                   or any(gen != generation for gen, _ in stubs.values()))
+    if rewrite:
+        fresh = [nid for nid in db if db.archived(nid)]
+        generation = generations[-1] + 1 if generations else 1
+    elif not fresh:
+        return
+    with contextlib.closing(ColdReader(db_path)) as reader:
+        # streamed, so only one member's worth of notes is held at a time
+        notes = ((nid, reader.get(nid, {"cold": stubs[nid]}) if nid in stubs else db[nid]) for nid in fresh)
+        locations = _write_cold(cold_path(db_path, generation), notes)
+    for nid, offset in locations.items():
+        db.set_cold(nid, generation, offset)
+
+def _drop_cold(db_path, db):
+    # generations the new snapshot no longer points into
+    live = {generation for generation, _ in db.stubs().values()}
+    for generation in cold_generations(db_path):
+        if generation not in live:
+            os.remove(cold_path(db_path, generation))
+
+def _snapshot_notes(f):
+    # write_snapshot puts each note on its own line, so the file can be read
+    # a note at a time; anything else (an old json.dump) is parsed whole.
+    first = True
+    for line in f:
+        line = line.strip().rstrip(b",")
+        if line in (b"{", b"}", b""):
+            continue
+        try:
+            (nid, note), = json.loads(b"{" + line + b"}").items()
+        except ValueError:
+            if not first:
+                raise
+            f.seek(0)
+            yield from json.load(f).items()
+            return
+        first = False
+        yield nid, note
+
+def _settle(note, ops):
+    """Replay one note's ops over ``note``; return it and the index of the
+    op that last (re)inserted it, which puts it at the end of the store."""
+    moved = None
+    for i, op in ops:
+        if op['op'] == 'delete':
+            note = None
+        elif op['op'] == 'add' or note is not None:
+            if note is None:
+                moved = i
+            note = op['note']
+    return note, moved
+
+def iter_notes(db_path, thaw=False):
+    """Yield ``(nid, note)`` in the order replay() would, without loading the store.
+
+    Only the journal's ops are held in memory; the snapshot is read one note
+    at a time, and notes the journal added are yielded at the end.  Archived
+    notes stay cold stubs unless ``thaw`` is set.
+    """
+    with lock(db_path, exclusive=False):
+        ops, _ = read_tail(db_path)
+        try:
+            f = open(db_path, 'rb')  # stays readable if a compaction replaces it
+        except FileNotFoundError:
+            f = None
+        cold = ColdReader(db_path) if thaw else None
+    with contextlib.closing(cold) if cold else contextlib.nullcontext():
+        yield from _iter_notes(f, ops, cold)
+
+def _iter_notes(f, ops, cold):
+    pending = {}
+    for i, op in enumerate(ops):
+        pending.setdefault(op['id'], []).append((i, op))
+    moved = []
+    if f is not None:
+        with f:
+            for nid, note in _snapshot_notes(f):
+                note, at = _settle(note, pending.pop(nid, ()))
+                if note is None:
+                    continue
+                if at is None:
+                    yield nid, cold.get(nid, note) if cold and is_cold(note) else with_defaults(note)
+                else:
+                    moved.append((at, nid, note))
+    for nid, note_ops in pending.items():
+        note, at = _settle(None, note_ops)
+        if note is not None:
+            moved.append((at, nid, note))
+    for _, nid, note in sorted(moved, key=lambda m: m[0]):
+        yield nid, with_defaults(note)
+
+def make_op(op, nid, note=None):
+    entry = {"op": op, "id": nid}
+    if note is not None:
+        entry["note"] = note
+    return entry
+
+def _drop_torn_tail(db_path, f):
+    # A process that died mid-append leaves a partial last line; the next op
+    # written would be glued onto it, and the journal would no longer replay.
+    end = f.seek(0, os.SEEK_END)
+    if not end:
+        return
+    f.seek(end - 1)
+    if f.read(1) == b"\n":
+        return
+    keep = pos = end
+    while pos:
+        start = max(0, pos - (64 << 10))
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b"\n")
+        if newline != -1:
+            keep = start + newline + 1
+            break
+        pos = keep = start
+    f.truncate(keep)
+    # another writer's fsync may have counted the torn bytes as synced
+    with lock(db_path, suffix=SYNC_SUFFIX):
+        if fcntl is not None:
+            fd = _locks[db_path + SYNC_SUFFIX][0]
+            if _synced(fd) > keep:
+                os.pwrite(fd, _SYNCED.pack(keep), 0)
+
+def append(db_path, ops, compact_after=True, sync=True):
+    """Append ops to the journal and return its new size.
+
+    With ``sync=False`` the caller is left to call sync_journal() once it has
+    let go of the lock.
+    """
+    data = "".join(json.dumps(op) + "\n" for op in ops).encode()
+    if not data:
+        return journal_size(db_path)
+    path = journal_path(db_path)
+    with lock(db_path):
+        created = not os.path.exists(path)
+        with open(path, 'a+b') as f:
+            _drop_torn_tail(db_path, f)
+            f.write(data)
+            size = f.tell()
+        if created:
+            sync_dir(path)
+        if compact_after and needs_compaction(db_path, size):
+            compact(db_path)  # the fsynced snapshot now holds our ops
+            return 0
+    if sync:
+        sync_journal(db_path, size)
+    return size
+
+def needs_compaction(db_path, journal_size):
+    try:
+        snapshot_size = os.path.getsize(db_path)
+    except OSError:
+        snapshot_size = 0
+    return journal_size > max(COMPACT_MIN_BYTES, snapshot_size * COMPACT_RATIO)
+
+def write_snapshot(path, db):
+    """Write ``db`` atomically; return ``{nid: (offset, length)}`` of each note's JSON."""
+    # One note per line keeps the file valid JSON while staying cheap to write.
+    locations = {}
+    tmp = path + ".tmp"
+    if isinstance(db, NoteStore):
+        bodies = db.dumps()
+    else:
+        bodies = ((nid, json.dumps(note).encode()) for nid, note in db.items())
+    with open(tmp, 'wb') as f:
+        pos = f.write(b"{")
+        sep = b"\n"
+        for nid, body in bodies:
+            head = sep + b"  " + json.dumps(nid).encode() + b": "
+            locations[nid] = (pos + len(head), len(body))
+            pos += f.write(head) + f.write(body)
+            sep = b",\n"
+        f.write(b"\n}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    sync_dir(path)
+    return locations
+
+def truncate_journal(db_path):
+    # Offsets synced in the old journal mean nothing for the new one.
+    with lock(db_path, suffix=SYNC_SUFFIX):
+        with open(journal_path(db_path), 'wb'):
+            pass
+        if fcntl is not None:
+            os.pwrite(_locks[db_path + SYNC_SUFFIX][0], _SYNCED.pack(0), 0)
+
+def _rewrite(db_path, db, carry):
+    # ``db`` is taken over: a NoteStore is turned into the hot store in place
+    if not isinstance(db, NoteStore):
+        db, notes = NoteStore(), db
+        db.update(notes)
+    with lock(db_path):
+        evict(db_path, db, rewrite=not carry)
+        pending = [hook(db_path, carry) for hook in snapshot_hooks]
+        locations = write_snapshot(db_path, db)
+        for finish in pending:
+            if finish:
+                finish(db, locations)
+        truncate_journal(db_path)
+        _drop_cold(db_path, db)
+
+def compact(db_path):
+    with lock(db_path), trace.phase("compact"):
+        _rewrite(db_path, replay(db_path)[0], carry=True)
+
+def replace(db_path, db):
+    _rewrite(db_path, db, carry=False)
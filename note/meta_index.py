@@ -0,0 +1,149 @@
+"""Metadata and preview file for the JSON store.
+
+Listing notes needs only each note's timestamp, tags, archived flag and a
+short preview, so those live in their own compact file, one column per field.
+Note bodies stay in the snapshot and journal, which the ordinal index
+addresses by offset; ``note list`` and the picker never read them.  Previews
+and display dates are rendered once, when a note is written, rather than on
+every listing.
+"""
+from datetime import datetime
+from note import journal, sidecar
+
+INDEX_SUFFIX = ".meta"
+PREVIEW_LENGTH = 40 #length of note content in list views
+DATE_FORMAT = "%-I:%M%p %a, %b %d"
+YEAR_FORMAT = DATE_FORMAT + " %Y"
+
+def make_preview(content):
+    raw = content[:PREVIEW_LENGTH].replace('\n', ' ')
+    return raw + "..." if len(content) > PREVIEW_LENGTH else raw
+
+def format_time(timestring, year=False):
+    return datetime.fromisoformat(timestring).strftime(YEAR_FORMAT if year else DATE_FORMAT)
+
+def short_date(date):
+    """The DATE_FORMAT part of a date rendered with YEAR_FORMAT."""
+    return date[:date.rindex(" ")]
+
+def in_range(timestamp, since=None, until=None):
+    # ISO timestamps compare correctly as strings
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+def shown(archived, include_archived, only_archived):
+    if only_archived:
+        return archived
+    return include_archived or not archived
+
+class MetaIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    version = (2, PREVIEW_LENGTH, YEAR_FORMAT)  # rebuilt if what we render changes
+    binary = True
+
+    def build(self, db):
+        self.ids, self.timestamps, self.dates, self.tags, self.previews = [], [], [], [], []
+        self.archived = bytearray()
+        self._by_id = None
+        for nid, note in db.items():
+            self._append(nid, note)
+
+    def restore(self, data):
+        self.ids = data['ids']
+        self.timestamps = data['timestamps']
+        self.dates = data['dates']
+        self.tags = data['tags']
+        self.previews = data['previews']
+        self.archived = bytearray(data['archived'])
+        self._by_id = None
+
+    def dump(self):
+        return {"ids": self.ids, "timestamps": self.timestamps, "dates": self.dates, "tags": self.tags,
+                "previews": self.previews, "archived": bytes(self.archived)}
+
+    def _find(self, nid):
+        if self._by_id is None:
+            self._by_id = {n: i for i, n in enumerate(self.ids)}
+        return self._by_id.get(nid)
+
+    def _append(self, nid, note):
+        if self._by_id is not None:
+            self._by_id[nid] = len(self.ids)
+        self.ids.append(nid)
+        self.timestamps.append(note['timestamp'])
+        self.dates.append(format_time(note['timestamp'], year=True))
+        self.tags.append(list(note.get('tags', [])))
+        self.previews.append(make_preview(note.get('content', '')))
+        self.archived.append(bool(note.get('archived', False)))
+
+    def apply(self, op):
+        i = self._find(op['id'])
+        if op['op'] == 'delete' or (op['op'] != 'add' and i is None):
+            if i is not None:
+                for column in (self.ids, self.timestamps, self.dates, self.tags, self.previews, self.archived):
+                    del column[i]
+                self._by_id = None
+            return
+        if i is None:
+            self._append(op['id'], op['note'])
+            return
+        note = op['note']
+        if self.timestamps[i] != note['timestamp']:
+            self.timestamps[i] = note['timestamp']
+            self.dates[i] = format_time(note['timestamp'], year=True)
+        self.tags[i] = list(note.get('tags', []))
+        self.previews[i] = make_preview(note.get('content', ''))
+        self.archived[i] = bool(note.get('archived', False))
+
+    def rows(self, include_archived=False, only_archived=False):
+        """Return ``(line_number, nid, timestamp, tags, preview)`` for a view."""
+        rows = []
+        for i, archived in enumerate(self.archived):
+            if shown(archived, include_archived, only_archived):
+                rows.append((len(rows) + 1, self.ids[i], self.timestamps[i], self.tags[i], self.previews[i]))
+        return rows
+
+    def listing(self, include_archived=False, only_archived=False, since=None, until=None, reverse=False,
+                among=None):
+        """Yield ``(line_number, nid, timestamp, date, tags, preview)`` for a view,
+        optionally newest first, as it goes.  ``date`` is rendered with YEAR_FORMAT.
+
+        With ``among``, only those ids are listed, without visiting the rest.
+        """
+        if among is not None:
+            rows = list(self._numbered(sorted(i for i in map(self._find, among) if i is not None),
+                                       include_archived, only_archived))
+            yield from reversed(rows) if reverse else rows
+            return
+        archived = self.archived.count(1)
+        total = archived if only_archived else len(self.ids) if include_archived else len(self.ids) - archived
+        line, step = (total, -1) if reverse else (1, 1)
+        for i in (range(len(self.ids) - 1, -1, -1) if reverse else range(len(self.ids))):
+            if not shown(self.archived[i], include_archived, only_archived):
+                continue
+            if in_range(self.timestamps[i], since, until):
+                yield line, self.ids[i], self.timestamps[i], self.dates[i], self.tags[i], self.previews[i]
+            line += step
+
+    def _numbered(self, indexes, include_archived, only_archived):
+        # line numbers of the given rows (in order), counting what lies between in C
+        line, start = 0, 0
+        for i in indexes:
+            if not shown(self.archived[i], include_archived, only_archived):
+                continue
+            if only_archived:
+                line += self.archived.count(1, start, i)
+            elif include_archived:
+                line += i - start
+            else:
+                line += i - start - self.archived.count(1, start, i)
+            line += 1
+            start = i + 1
+            yield line, self.ids[i], self.timestamps[i], self.dates[i], self.tags[i], self.previews[i]
+
+    def row(self, nid):
+        i = self._find(nid)
+        if i is None:
+            return None
+        return nid, self.timestamps[i], self.tags[i], self.previews[i]
+
+journal.snapshot_hooks.append(MetaIndex.carry_over)
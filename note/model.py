@@ -0,0 +1,207 @@
+"""Compact in-memory form of the JSON store.
+
+Held as a dict of dicts, a store costs several hundred bytes per note on top
+of its content: a dict per note, a list per note's tags, a string per
+timestamp, all of it parsed up front.  NoteStore keeps one row per note in
+columns instead -- ids, fixed-width timestamps, a flag byte, tags as numbers
+into a table of interned names -- plus where the note's JSON can be read
+back from: a byte range of the snapshot (mapped, not read) or of the journal,
+its member in the cold segment, or, for notes set since loading, the note
+itself.  A note's JSON is only parsed when the note is looked up.
+
+NoteStore is the ``{nid: note}`` mapping the rest of note expects, in
+insertion order; lookups return a fresh dict, so a changed note has to be
+stored again, as it always had to be saved.
+"""
+import json
+from array import array
+from collections.abc import MutableMapping
+
+STAMP_WIDTH = 26  # len(datetime.now().isoformat()); longer timestamps are kept aside
+
+# Where a row's note is read from; SNAPSHOT and JOURNAL match journal.py.
+SNAPSHOT, JOURNAL, COLD, MEMORY = 0, 1, 2, 3
+
+# Flag bits
+ARCHIVED = 1
+STUB = 2  # only a stub is in the hot store; the note itself is in the cold segment
+
+def with_defaults(note):
+    if 'tags' not in note: note['tags'] = []
+    if 'archived' not in note: note['archived'] = False
+    if 'archived_at' not in note: note['archived_at'] = None
+    return note
+
+class NoteStore(MutableMapping):
+    def __init__(self, snapshot=b"", tail=b""):
+        self.snapshot = snapshot  # the snapshot's bytes, usually a mmap
+        self.tail = tail          # the journal's bytes
+        self.cold = None          # a ColdReader once archived notes are thawed
+        self.ids = []             # row -> nid, None once deleted
+        self._rows = {}           # nid -> row
+        self._stamps = bytearray()
+        self._odd_stamps = {}     # row -> timestamp that doesn't fit STAMP_WIDTH
+        self._flags = bytearray()
+        self._tag_names = []      # tag number -> name
+        self._tag_numbers = {}    # name -> tag number
+        self._tag_refs = array('I')
+        self._tag_start = array('I')  # row -> its first entry in _tag_refs
+        self._tag_end = array('I')
+        self._source = bytearray()
+        self._offset = array('Q')  # byte offset, or the member offset for COLD
+        self._length = array('I')  # byte length, or the generation for COLD
+        self._notes = {}           # row -> note, for MEMORY rows
+        self._blobs = {}           # row -> digest, for notes whose content is in a blob (see blobs.py)
+
+    def put(self, nid, note, source=MEMORY, offset=0, length=0):
+        """Store ``note``, which can be read back from ``source`` at ``offset``."""
+        flags = (ARCHIVED if note.get('archived', False) else 0) | (STUB if 'cold' in note else 0)
+        start = len(self._tag_refs)  # a retagged note's old entries are simply left behind
+        numbers = self._tag_numbers
+        self._tag_refs.extend([numbers[tag] if tag in numbers else self._intern(tag)
+                               for tag in note.get('tags', ())])
+        row = self._rows.get(nid)
+        if row is None:
+            row = self._rows[nid] = len(self.ids)
+            self.ids.append(nid)
+            self._stamps += self._stamp_bytes(row, note['timestamp'])
+            self._flags.append(flags)
+            self._tag_start.append(start)
+            self._tag_end.append(len(self._tag_refs))
+            self._source.append(source)
+            self._offset.append(offset)
+            self._length.append(length)
+        else:
+            self._stamps[row * STAMP_WIDTH:(row + 1) * STAMP_WIDTH] = self._stamp_bytes(row, note['timestamp'])
+            self._flags[row] = flags
+            self._tag_start[row], self._tag_end[row] = start, len(self._tag_refs)
+            self._source[row], self._offset[row], self._length[row] = source, offset, length
+        if source == MEMORY:
+            self._notes[row] = note
+        else:
+            self._notes.pop(row, None)
+        if 'blob' in note:
+            self._blobs[row] = note['blob']
+        else:
+            self._blobs.pop(row, None)
+
+    def location(self, nid):
+        """Return ``(source, offset, length)`` the note is read back from, as given to put()."""
+        row = self._rows[nid]
+        return self._source[row], self._offset[row], self._length[row]
+
+    def _stamp_bytes(self, row, timestamp):
+        raw = timestamp.encode() if isinstance(timestamp, str) and timestamp.isascii() else None
+        if raw is not None and len(raw) <= STAMP_WIDTH and not raw.endswith(b" "):
+            self._odd_stamps.pop(row, None)
+            return raw.ljust(STAMP_WIDTH)
+        self._odd_stamps[row] = timestamp
+        return b" " * STAMP_WIDTH
+
+    def _intern(self, tag):
+        number = self._tag_numbers[tag] = len(self._tag_names)
+        self._tag_names.append(tag)
+        return number
+
+    def set_cold(self, nid, generation, offset):
+        """Leave only a stub for the note, which now lives in the cold segment."""
+        row = self._rows[nid]
+        self._flags[row] = ARCHIVED | STUB
+        self._tag_start[row] = self._tag_end[row] = 0  # stubs carry no tags
+        self._source[row], self._offset[row], self._length[row] = COLD, offset, generation
+        self._notes.pop(row, None)
+
+    def thaw(self, reader):
+        """Have lookups return archived notes from ``reader`` instead of their stubs."""
+        self.cold = reader
+
+    def __getitem__(self, nid):
+        row = self._rows[nid]
+        note = self._read(row)
+        if self.cold is not None and self._flags[row] & STUB:
+            return self.cold.get(nid, note)
+        return note
+
+    def _read(self, row):
+        source, offset = self._source[row], self._offset[row]
+        if source == SNAPSHOT:
+            return with_defaults(json.loads(self.snapshot[offset:offset + self._length[row]]))
+        if source == JOURNAL:
+            return with_defaults(json.loads(self.tail[offset:offset + self._length[row]])['note'])
+        if source == COLD:
+            stub = {"timestamp": self._stamp(row), "archived": True, "cold": [self._length[row], offset]}
+            if row in self._blobs:
+                stub['blob'] = self._blobs[row]  # so the blob outlives compactions while the note is cold
+            return with_defaults(stub)
+        return with_defaults(self._notes[row])
+
+    def __setitem__(self, nid, note):
+        self.put(nid, note)
+
+    def __delitem__(self, nid):
+        row = self._rows.pop(nid)
+        self.ids[row] = None
+        self._odd_stamps.pop(row, None)
+        self._notes.pop(row, None)
+        self._blobs.pop(row, None)
+
+    def __iter__(self):
+        return (nid for nid in self.ids if nid is not None)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, nid):
+        return nid in self._rows
+
+    def _stamp(self, row):
+        if row in self._odd_stamps:
+            return self._odd_stamps[row]
+        return self._stamps[row * STAMP_WIDTH:(row + 1) * STAMP_WIDTH].rstrip(b" ").decode()
+
+    def timestamp(self, nid):
+        return self._stamp(self._rows[nid])
+
+    def tags(self, nid):
+        row = self._rows[nid]
+        return [self._tag_names[n] for n in self._tag_refs[self._tag_start[row]:self._tag_end[row]]]
+
+    def archived(self, nid):
+        return bool(self._flags[self._rows[nid]] & ARCHIVED)
+
+    def is_stub(self, nid):
+        return bool(self._flags[self._rows[nid]] & STUB)
+
+    def stubs(self):
+        """Return ``{nid: (generation, offset)}`` for every note left as a stub."""
+        found = {}
+        for nid in self:
+            row = self._rows[nid]
+            if self._flags[row] & STUB:
+                found[nid] = ((self._length[row], self._offset[row]) if self._source[row] == COLD
+                              else tuple(self._read(row)['cold']))
+        return found
+
+    def blobs(self):
+        """Return ``{nid: digest}`` for every note whose content is in a blob."""
+        return {self.ids[row]: digest for row, digest in self._blobs.items()}
+
+    def large(self, min_bytes):
+        """Return the ids of notes that may hold ``min_bytes`` of content, judged by their JSON's length."""
+        found = []
+        for nid in self:
+            row = self._rows[nid]
+            source = self._source[row]
+            if source == MEMORY or (source != COLD and self._length[row] >= min_bytes):
+                found.append(nid)
+        return found
+
+    def dumps(self):
+        """Yield ``(nid, JSON bytes)``; notes unchanged since loading are copied as they are."""
+        for nid in self:
+            row = self._rows[nid]
+            if self._source[row] == SNAPSHOT and not (self.cold is not None and self._flags[row] & STUB):
+                offset = self._offset[row]
+                yield nid, self.snapshot[offset:offset + self._length[row]]
+            else:
+                yield nid, json.dumps(self[nid]).encode()
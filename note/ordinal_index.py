@@ -0,0 +1,343 @@
+"""Line-number index for the JSON store.
+
+Two fixed-width binary files list the active and the archived view in
+insertion order, so record N is line N+1 and resolving a line number is a
+single seek.  Each record holds the note id, its insertion position and where
+the note's latest full JSON lives (snapshot or journal, offset, length), so
+the note itself can be read without parsing anything else.
+
+New notes are appended and edits overwrite their record in place; only
+deletes and archive moves rewrite a view file, and a long run of ops (an
+archive run, an import) is applied in memory with each file written once.  The files are rebuilt from
+the byte locations write_snapshot reports whenever the snapshot is rewritten,
+and when missing or stale from where a replay of the snapshot and journal
+found each note; that only reads the store, so it doesn't wait for writers.
+A snapshot written by an older version of note, not one note per line, has
+no such locations: the views stay unusable (callers fall back to loading
+the store) until the next compaction rewrites it.
+"""
+import mmap, os, struct
+from note import journal, sidecar
+
+INDEX_SUFFIX = ".ordinal"
+REBUILD_LOCK_SUFFIX = INDEX_SUFFIX + ".lock"  # two readers rebuilding at once would share temp files
+VIEWS = ("active", "archived")
+ID_WIDTH = 16
+RECORD = struct.Struct(f"<{ID_WIDTH}sB3xIQQ")  # id, segment, length, offset, position
+
+def _key(nid):
+    raw = nid.encode()
+    return raw.ljust(ID_WIDTH, b"\0") if len(raw) <= ID_WIDTH else None
+
+def _unpack(raw):
+    key, segment, length, offset, pos = RECORD.unpack(raw)
+    return key.rstrip(b"\0").decode(), segment, offset, length, pos
+
+def _contains(path, needle):
+    try:
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm.find(needle) != -1
+    except OSError:
+        return False
+
+def id_in_use(db_path, nid):
+    """Whether ``nid`` may already name a note, without loading the store.
+
+    Checks the view files when they are current, else the snapshot, and the
+    whole journal.  Matching some other bytes is possible, so a true answer
+    only means the caller should pick another id.
+    """
+    quoted = b'"' + nid.encode() + b'"'
+    header = sidecar.read(db_path + INDEX_SUFFIX, db_path)
+    key = _key(nid)
+    if header and header.get('usable') and key:
+        found = any(_contains(f"{db_path}{INDEX_SUFFIX}.{view}", key) for view in VIEWS)
+    else:
+        found = _contains(db_path, quoted)
+    return found or _contains(journal.journal_path(db_path), quoted)
+
+def _bisect_pos(data, pos, lo=0):
+    # index of the first record in ``data`` at or after insertion position ``pos``
+    hi = len(data) // RECORD.size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if RECORD.unpack_from(data, mid * RECORD.size)[4] < pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _write_file(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class OrdinalIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    save_after_bytes = 0  # the view files are already updated; keep the header in step
+
+    def view_path(self, view):
+        return f"{self.path}.{view}"
+
+    @classmethod
+    def open(cls, db_path):
+        index = super().open(db_path)
+        for view in VIEWS:
+            try:
+                intact = os.path.getsize(index.view_path(view)) % RECORD.size == 0
+            except OSError:
+                intact = False
+            if not intact:
+                index.rebuild()
+                break
+        return index
+
+    def rebuild(self):
+        # Writers change the view files only under the exclusive store lock,
+        # so the shared one keeps them away while the files are replaced.
+        with journal.lock(self.db_path, exclusive=False), \
+                journal.lock(self.db_path, suffix=REBUILD_LOCK_SUFFIX):
+            db, end = journal.replay(self.db_path)
+            self._build(db, lambda nid: _file_location(db, nid), end)
+
+    def restore(self, data):
+        self.next_pos = data.get('next_pos', 0)
+        self.usable = data.get('usable', False)
+
+    def dump(self):
+        return {"next_pos": self.next_pos, "usable": self.usable}
+
+    def build_from(self, db, locations):
+        self._build(db, lambda nid: (journal.SNAPSHOT,) + locations[nid], 0)
+
+    def _build(self, db, locate, journal_end):
+        # locate(nid) -> (segment, offset, length) of the note's JSON, or None
+        views = {"active": [], "archived": []}
+        self.usable = True
+        for pos, nid in enumerate(db):
+            key, where = _key(nid), locate(nid)
+            if key is None or where is None:
+                self.usable = False  # ids this long, or notes not read from a file, can't be indexed; callers fall back
+                break
+            segment, offset, length = where
+            view = "archived" if db.archived(nid) else "active"
+            views[view].append(RECORD.pack(key, segment, length, offset, pos))
+        for view in VIEWS:
+            _write_file(self.view_path(view), b"".join(views[view]) if self.usable else b"")
+        self.next_pos = len(db)
+        self.snapshot = journal.snapshot_id(self.db_path)
+        self.journal_end = journal_end
+        self.save()
+
+    def catch_up(self):
+        if journal.journal_size(self.db_path) == self.journal_end:
+            return
+        # The view files are edited in place, so only one process may do this,
+        # starting from wherever the last one to do it left off.
+        with journal.lock(self.db_path):
+            data = sidecar.read(self.path, self.db_path)
+            if data is None:
+                self.rebuild()
+                return
+            self.snapshot = data['snapshot']
+            self.journal_end = data['journal']
+            self.restore(data)
+            records, end = journal.read_records(self.db_path, self.journal_end)
+            if not records:
+                return
+            if len(records) >= sidecar.BATCH_OPS:
+                self._apply_batch(records)
+            else:
+                for offset, length, op in records:
+                    self.apply(op, offset, length)
+            self.journal_end = end
+            self.save()
+
+    def apply(self, op, offset, length):
+        if not self.usable:
+            return
+        nid = op['id']
+        found = self.find(nid)
+        if op['op'] == 'delete' or (op['op'] != 'add' and found is None):
+            if found:
+                self._remove(*found)
+            return
+        key = _key(nid)
+        if key is None:
+            self.usable = False
+            return
+        view = "archived" if op['note'].get('archived', False) else "active"
+        if found is None:
+            with open(self.view_path(view), 'ab') as f:
+                f.write(RECORD.pack(key, journal.JOURNAL, length, offset, self.next_pos))
+            self.next_pos += 1
+            return
+        old_view, i = found
+        pos = self._record(old_view, i)[4]
+        record = RECORD.pack(key, journal.JOURNAL, length, offset, pos)
+        if old_view == view:
+            with open(self.view_path(view), 'r+b') as f:
+                f.seek(i * RECORD.size)
+                f.write(record)
+        else:
+            self._remove(old_view, i)
+            self._insert(view, record, pos)
+
+    def _apply_batch(self, records):
+        if not self.usable:
+            return
+        views = {}
+        where = {}  # key -> (view, index) of the records already on disk
+        for view in VIEWS:
+            with open(self.view_path(view), 'rb') as f:
+                views[view] = data = bytearray(f.read())
+            for i, (key, *_) in enumerate(RECORD.iter_unpack(data)):
+                where[key] = (view, i)
+        removed = {view: set() for view in VIEWS}
+        moved = {}  # key -> [view, position, record] to be merged in
+        for offset, length, op in records:
+            key = _key(op['id'])
+            if key is None:
+                self.usable = False
+                return
+            found = where.get(key)
+            if op['op'] == 'delete' or (op['op'] != 'add' and found is None and key not in moved):
+                if found:
+                    removed[found[0]].add(found[1])
+                    del where[key]
+                moved.pop(key, None)
+                continue
+            view = "archived" if op['note'].get('archived', False) else "active"
+            if key in moved:
+                pos = moved[key][1]
+            elif found:
+                pos = RECORD.unpack_from(views[found[0]], found[1] * RECORD.size)[4]
+            else:
+                pos = self.next_pos
+                self.next_pos += 1
+            record = RECORD.pack(key, journal.JOURNAL, length, offset, pos)
+            if found and found[0] == view:
+                i = found[1] * RECORD.size
+                views[view][i:i + RECORD.size] = record
+                continue
+            if found:
+                removed[found[0]].add(found[1])
+                del where[key]
+            moved[key] = [view, pos, record]
+        for view in VIEWS:
+            data, size = views[view], RECORD.size
+            kept, start = [], 0
+            for i in sorted(removed[view]):
+                kept.append(data[start * size:i * size])
+                start = i + 1
+            kept.append(data[start * size:])
+            data = b"".join(kept)
+            out, start = [], 0
+            for _, pos, record in sorted((m for m in moved.values() if m[0] == view), key=lambda m: m[1]):
+                i = _bisect_pos(data, pos, start)
+                out.append(data[start * size:i * size])
+                out.append(record)
+                start = i
+            out.append(data[start * size:])
+            _write_file(self.view_path(view), b"".join(out))
+
+    def count(self, view):
+        try:
+            return os.path.getsize(self.view_path(view)) // RECORD.size
+        except OSError:
+            return 0
+
+    def _record(self, view, i):
+        with open(self.view_path(view), 'rb') as f:
+            f.seek(i * RECORD.size)
+            return _unpack(f.read(RECORD.size))
+
+    def find(self, nid):
+        """Return ``(view, index)`` of a note's record, or None."""
+        key = _key(nid)
+        if key is None:
+            return None
+        for view in VIEWS:
+            if not self.count(view):
+                continue
+            with open(self.view_path(view), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                at = mm.find(key)
+                while at != -1:
+                    if at % RECORD.size == 0:
+                        return view, at // RECORD.size
+                    at = mm.find(key, at + 1)
+        return None
+
+    def _remove(self, view, i):
+        with open(self.view_path(view), 'rb') as f:
+            data = bytearray(f.read())
+        del data[i * RECORD.size:(i + 1) * RECORD.size]
+        _write_file(self.view_path(view), data)
+
+    def _insert(self, view, record, pos):
+        with open(self.view_path(view), 'rb') as f:
+            data = bytearray(f.read())
+        i = _bisect_pos(data, pos)
+        data[i * RECORD.size:i * RECORD.size] = record
+        _write_file(self.view_path(view), data)
+
+    def nth(self, line_number, view="active"):
+        """Return ``(nid, segment, offset, length)`` for a 1-based line, or None."""
+        k = line_number - 1
+        if view == "all":
+            return self._nth_merged(k)
+        if not 0 <= k < self.count(view):
+            return None
+        return self._record(view, k)[:4]
+
+    def _nth_merged(self, k):
+        # k-th record of both views merged by position, by bisecting on how
+        # many of the first k come from the active view.
+        a, b = self.count("active"), self.count("archived")
+        if not 0 <= k < a + b:
+            return None
+        pos = lambda view, i: self._record(view, i)[4]
+        lo, hi = max(0, k - b), min(k, a)
+        while lo < hi:
+            i = (lo + hi) // 2
+            if pos("active", i) < pos("archived", k - i - 1):
+                lo = i + 1
+            else:
+                hi = i
+        i, j = lo, k - lo
+        if i < a and (j >= b or pos("active", i) < pos("archived", j)):
+            return self._record("active", i)[:4]
+        return self._record("archived", j)[:4]
+
+    def locate(self, nid):
+        found = self.find(nid)
+        return self._record(*found)[1:4] if found else None
+
+    def locate_many(self, nids):
+        """Return ``{nid: (segment, offset, length)}`` for the listed notes, in one read."""
+        keys = {_key(nid) for nid in nids} - {None}
+        found = {}
+        for view in VIEWS:
+            try:
+                with open(self.view_path(view), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            for key, segment, length, offset, _ in RECORD.iter_unpack(data):
+                if key in keys:
+                    found[key.rstrip(b"\0").decode()] = (segment, offset, length)
+        return found
+
+def _file_location(db, nid):
+    segment, offset, length = db.location(nid)
+    return (segment, offset, length) if segment in (journal.SNAPSHOT, journal.JOURNAL) else None
+
+def _on_snapshot(db_path, carry):
+    return lambda db, locations: OrdinalIndex(db_path).build_from(db, locations)
+
+journal.snapshot_hooks.append(_on_snapshot)
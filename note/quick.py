@@ -0,0 +1,48 @@
+"""``note "text" --tags ...`` without loading the store.
+
+Adding a note doesn't need to know about any other note, so this path only
+appends the op to the journal (which every reader already replays on top of
+the snapshot) and leaves compaction and the indexes to the next full command.
+It avoids importing colorama and the index modules; client.py sends quick
+adds here before falling back to the CLI.
+"""
+import os
+from datetime import datetime
+from note import journal
+from note.blobs import BLOB_MIN_BYTES
+from note.config import BACKEND, DB_PATH
+from note.ordinal_index import id_in_use
+
+def extract_tags(args):
+    if '--tags' in args:
+        idx = args.index('--tags')
+        tags = args[idx + 1:]
+        args = args[:idx]
+    else:
+        tags = []
+    return args, [t.lower() for t in tags]
+
+def new_id(db_path):
+    while True:
+        nid = os.urandom(4).hex()
+        if not id_in_use(db_path, nid):
+            return nid
+
+def add(args):
+    """Add a one-line note; return False to leave the command to the CLI."""
+    if BACKEND != "json":
+        return False
+    if journal.needs_compaction(DB_PATH, journal.journal_size(DB_PATH)):
+        return False  # the CLI compacts after its append, carrying the indexes over
+    args, tags = extract_tags(args)
+    content = ' '.join(args)
+    if len(content) * 4 >= BLOB_MIN_BYTES:
+        return False  # may belong in a blob; the CLI writes those
+    op = journal.make_op("add", new_id(DB_PATH), {
+        "timestamp": datetime.now().isoformat(),
+        "content": content,
+        "tags": tags
+    })
+    journal.append(DB_PATH, [op], compact_after=False)
+    print(f"Note saved with ID {op['id']}")
+    return True
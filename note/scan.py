@@ -0,0 +1,156 @@
+"""Full-content scans for ``note search --regex`` and ``--fuzzy``.
+
+Neither can be answered from the inverted index, so every active note is
+read and matched.  Notes are grouped into chunks of about CHUNK_BYTES; once
+the store holds more than PARALLEL_MIN_BYTES of content (and there is more
+than one CPU), chunks are scanned on a process pool while the next ones are
+still being read, with only a few chunks in flight at a time.  Workers send
+back just the matching notes' scores and the lines to show.  Hits come out
+chunk by chunk, in store order, as soon as each chunk is scanned: they are
+ranked within their chunk, not across the whole store, so the first hits
+show up straight away and memory stays bounded. The price is that a
+strong hit late in the store is listed after weaker ones from earlier
+chunks.
+
+A fuzzy query matches a line holding its characters in order, like fzf; the
+tighter the match, the higher it ranks.  Regex hits rank by how often the
+pattern matches.
+"""
+import collections, itertools, os, re
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_BYTES = 1 << 20         # content per unit of work
+PARALLEL_MIN_BYTES = 4 << 20  # below this a pool costs more than it saves
+SHOW_MATCHES = 3              # matching lines shown per note
+FLAGS = re.IGNORECASE | re.MULTILINE  # ^ and $ anchor at each line, as in grep
+LINE_WIDTH = 160              # characters shown per line; long log lines are cut around the match
+
+def compile_query(query, fuzzy=False):
+    """Return the pattern source for a query; raises re.error if it's invalid."""
+    if fuzzy:
+        # c1[^c2\n]*c2[^c3\n]*c3...: each gap stops at the next wanted
+        # character, so the earliest match is found without backtracking
+        chars = [c for c in query if not c.isspace()]
+        source = re.escape(chars[0]) if chars else ""
+        for c in chars[1:]:
+            source += f"[^{re.escape(c)}\n]*{re.escape(c)}"
+    else:
+        source = query
+    re.compile(source, FLAGS)
+    return source
+
+def _clip(text, spans):
+    if len(text) <= LINE_WIDTH:
+        return text, spans
+    start = max(0, spans[0][0] - LINE_WIDTH // 4) if spans else 0
+    end = start + LINE_WIDTH
+    head = "..." if start else ""
+    tail = "..." if end < len(text) else ""
+    shifted = [(max(s, start) - start + len(head), min(e, end) - start + len(head))
+               for s, e in spans if s < end and e > start]
+    return head + text[start:end] + tail, shifted
+
+def scan_note(regex, content, context=0, fuzzy_length=None):
+    """Match one note; return ``(score, count, lines)`` or None.
+
+    ``lines`` holds ``(line_number, text, spans, is_match)`` for up to
+    SHOW_MATCHES matching lines and ``context`` lines around each.
+    """
+    count, best = 0, 0.0
+    found = {}  # line index -> spans within that line
+    line, pos, line_start, line_end = 0, 0, 0, -1
+    matches = regex.finditer(content)
+    for m in matches:
+        start, end = m.span()
+        if end == start:
+            continue
+        count += 1
+        if fuzzy_length:
+            best = max(best, fuzzy_length / (end - start))
+        if len(found) == SHOW_MATCHES and 0 <= line_end < start:
+            break  # every line to show is known; the rest only add to the score
+        newlines = content.count("\n", pos, start)
+        if newlines:
+            line += newlines
+            line_start = content.rindex("\n", pos, start) + 1
+        pos = start
+        if line in found or len(found) < SHOW_MATCHES:
+            line_end = content.find("\n", start)
+            stop = end if line_end == -1 else min(end, line_end)
+            found.setdefault(line, []).append((start - line_start, stop - line_start))
+    for m in matches:
+        start, end = m.span()
+        if end > start:
+            count += 1
+            if fuzzy_length:
+                best = max(best, fuzzy_length / (end - start))
+    if not count:
+        return None
+
+    text = content.split("\n")
+    shown = sorted({i for hit in found for i in range(max(0, hit - context), min(len(text), hit + context + 1))})
+    lines = [(i + 1, *_clip(text[i], found.get(i, [])), i in found) for i in shown]
+    return (best if fuzzy_length else float(count)), count, lines
+
+def scan_chunk(source, fuzzy_length, context, notes):
+    """Worker entry point: match ``(line_number, nid, timestamp, content)`` tuples."""
+    regex = re.compile(source, FLAGS)
+    hits = []
+    for idx, nid, timestamp, content in notes:
+        result = scan_note(regex, content, context, fuzzy_length)
+        if result:
+            score, count, lines = result
+            hits.append((score, idx, nid, timestamp, count, lines))
+    return hits
+
+def _chunks(notes):
+    chunk, size = [], 0
+    for note in notes:
+        chunk.append(note)
+        size += len(note[3])
+        if size >= CHUNK_BYTES:
+            yield chunk, size
+            chunk, size = [], 0
+    if chunk:
+        yield chunk, size
+
+def _parallel(source, fuzzy_length, context, chunks, workers):
+    # each chunk's hits, in the order the chunks were read
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for chunk, _ in chunks:
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(pool.submit(scan_chunk, source, fuzzy_length, context, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+def search(notes, query, fuzzy=False, context=0):
+    """Scan ``(line_number, nid, timestamp, content)`` tuples; return an
+    iterator over the hits, best first within each chunk.
+
+    Each hit is ``(score, line_number, nid, timestamp, count, lines)``.
+    Raises re.error for an invalid regex, before anything is read.
+    """
+    source = compile_query(query, fuzzy)
+    fuzzy_length = sum(not c.isspace() for c in query) if fuzzy else None
+    return _search(notes, source, fuzzy_length, context)
+
+def _search(notes, source, fuzzy_length, context):
+    chunks = _chunks(notes)
+    workers = os.cpu_count() or 1
+    # read ahead far enough to know whether the store is worth a pool
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += chunk[1]
+        if size >= PARALLEL_MIN_BYTES:
+            break
+    chunks = itertools.chain(head, chunks)
+    if workers > 1 and size >= PARALLEL_MIN_BYTES:
+        results = _parallel(source, fuzzy_length, context, chunks, workers)
+    else:
+        results = (scan_chunk(source, fuzzy_length, context, chunk) for chunk, _ in chunks)
+    for hits in results:
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        yield from hits
@@ -0,0 +1,353 @@
+"""Persistent inverted index for ``note search`` on the JSON store.
+
+Queries are whitespace-separated terms that must all match; ``OR`` between
+groups of terms matches either group.  A term matches anywhere inside a
+word, as the plain substring search ``note search`` started out with did
+(``ngin`` finds "nginx").  With ``--words`` a term has to be a whole word,
+and a trailing ``*`` makes it a prefix match::
+
+    note search nginx ssl
+    note search nginx OR apache
+    note search --words deploy*
+
+The index maps each word to document numbers; a term matched inside words
+is looked up under every indexed word containing it, so no note is read.  Documents are never edited in
+place: an update tombstones the old document and appends a new one that keeps
+the note's position, so applying a journal op never has to look up the terms a
+note used to contain.  Tombstones are purged whenever the index is rewritten
+for a compacted snapshot.  The sorted positions of each view's notes are kept
+too, so a hit's line number is a bisect; a long run of ops sorts them once,
+at the end.
+
+``note search --top N`` ranks the matches instead of listing them all.  For
+that the index also keeps how often each term occurs in each document, each
+document's length in terms and time, and which documents carry each tag, so
+a match scores BM25 over the query's terms (a prefix term over every term
+it expands to), raised for each query term the note is tagged with and for
+being recent.  Scoring is done for all matches at once with NumPy when it
+is installed, and note by note with a heap for the top N otherwise.
+"""
+import heapq, math, re, time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from note import blobs, compat, journal, sidecar
+from note.time_index import epoch
+
+INDEX_SUFFIX = ".search"
+SEARCH_PREVIEW = 100   # characters of content shown per search hit
+MAX_TF = 255           # occurrences of a term in a note counted (BM25 has long stopped caring)
+
+K1, B = 1.2, 0.75      # BM25 term-frequency saturation and length normalization
+TAG_BOOST = 0.5        # added to the score's multiplier per query term the note is tagged with
+RECENCY_BOOST = 0.5    # ... and for a note written just now, halving every HALF_LIFE_DAYS
+HALF_LIFE_DAYS = 30
+
+GONE, ACTIVE, ARCHIVED = 0, 1, 2  # a document's state
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def parse_query(query):
+    """Parse a query into OR'ed clauses of AND'ed ``(term, is_prefix)`` pairs."""
+    clauses, clause = [], []
+    for word in query.split():
+        if word == "OR":
+            if clause:
+                clauses.append(clause)
+            clause = []
+            continue
+        terms = [(term, False) for term in tokenize(word)]
+        if terms and word.endswith("*"):
+            terms[-1] = (terms[-1][0], True)
+        clause.extend(terms)
+    if clause:
+        clauses.append(clause)
+    return clauses
+
+def matches(clauses, text, words=False):
+    """Whether ``text`` satisfies parsed ``clauses``, as SearchIndex.search would find it."""
+    if not words:
+        # a term is all word characters, so it is inside a word wherever it occurs
+        text = text.lower()
+        return any(all(term in text for term, _ in clause) for clause in clauses)
+    found = set(tokenize(text))
+    return any(all(term in found or (prefix and any(w.startswith(term) for w in found))
+                   for term, prefix in clause)
+               for clause in clauses)
+
+def boost(tag_hits, age_days):
+    """The multiplier on a note's BM25 score; works on NumPy arrays as well as numbers."""
+    return (1 + TAG_BOOST * tag_hits) * (1 + RECENCY_BOOST * 0.5 ** (age_days / HALF_LIFE_DAYS))
+
+class SearchIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    version = 3  # term frequencies, lengths, times and tags for ranking; view positions
+    binary = True
+
+    def build(self, db):
+        self.next_pos = 0
+        self.docs = []      # docnum -> [nid, pos, archived, timestamp, preview] or None
+        self.postings = {}  # term -> array of docnums, ascending
+        self.freqs = {}     # term -> its occurrences in each of those documents, up to MAX_TF
+        self.tagged = {}    # lowercased tag -> array of docnums, ascending
+        self.states = bytearray()   # docnum -> GONE, ACTIVE or ARCHIVED
+        self.positions = array('I') # docnum -> the note's position, as in docs
+        self.lengths = array('I')   # docnum -> terms in the document
+        self.times = array('d')     # docnum -> epoch seconds of its timestamp (0 if unreadable)
+        self.views = {ACTIVE: array('I'), ARCHIVED: array('I')}  # sorted positions of each view's notes
+        self._by_id = {}    # nid -> live docnum
+        self._terms = None  # sorted postings keys, built for prefix queries
+        for nid, note in db.items():
+            self._add(nid, self.next_pos, note)
+            self.next_pos += 1
+
+    def restore(self, data):
+        self.next_pos = data['next_pos']
+        self.docs = data['docs']
+        self.postings = {term: array('I', nums) for term, nums in data['postings'].items()}
+        self.freqs = {term: bytearray(counts) for term, counts in data['freqs'].items()}
+        self.tagged = {tag: array('I', nums) for tag, nums in data['tagged'].items()}
+        self.states = bytearray(data['states'])
+        self.positions = array('I', data['positions'])
+        self.lengths = array('I', data['lengths'])
+        self.times = array('d', data['times'])
+        self.views = {state: array('I', nums) for state, nums in data['views'].items()}
+        self._by_id = None
+        self._terms = None
+
+    def dump(self):
+        return {"next_pos": self.next_pos, "docs": self.docs,
+                "postings": {term: nums.tobytes() for term, nums in self.postings.items()},
+                "freqs": {term: bytes(counts) for term, counts in self.freqs.items()},
+                "tagged": {tag: nums.tobytes() for tag, nums in self.tagged.items()},
+                "states": bytes(self.states), "positions": self.positions.tobytes(),
+                "lengths": self.lengths.tobytes(), "times": self.times.tobytes(),
+                "views": {state: nums.tobytes() for state, nums in self.views.items()}}
+
+    def _find(self, nid):
+        # only applying an op needs to look a note up; a query never does
+        if self._by_id is None:
+            self._by_id = {doc[0]: n for n, doc in enumerate(self.docs) if doc is not None}
+        return self._by_id.get(nid)
+
+    def apply(self, op):
+        nid = op['id']
+        old = self._find(nid)
+        pos = None
+        if old is not None:
+            del self._by_id[nid]
+            pos = self.docs[old][1]
+            if self.views is not None:
+                view = self.views[self.states[old]]
+                del view[bisect_left(view, pos)]
+            self.docs[old] = None
+            self.states[old] = GONE
+        if op['op'] == 'delete' or (op['op'] != 'add' and old is None):
+            return
+        if pos is None:
+            pos = self.next_pos
+            self.next_pos += 1
+        self._add(nid, pos, op['note'])
+
+    def apply_all(self, ops):
+        if len(ops) < sidecar.BATCH_OPS:
+            super().apply_all(ops)
+            return
+        # sorted once at the end rather than kept up op by op
+        self.views = None
+        try:
+            super().apply_all(ops)
+        finally:
+            views = {ACTIVE: [], ARCHIVED: []}
+            for pos, state in zip(self.positions, self.states):
+                if state != GONE:
+                    views[state].append(pos)
+            self.views = {state: array('I', sorted(nums)) for state, nums in views.items()}
+
+    def _add(self, nid, pos, note):
+        docnum = len(self.docs)
+        content = blobs.content(self.db_path, note, partial=True)
+        archived = bool(note.get('archived', False))
+        self.docs.append([nid, pos, archived, note['timestamp'],
+                          content[:SEARCH_PREVIEW].replace('\n', ' ')])
+        if self._by_id is not None:
+            self._by_id[nid] = docnum
+        counts = Counter(tokenize(content))
+        self.states.append(ARCHIVED if archived else ACTIVE)
+        self.positions.append(pos)
+        if self.views is not None:
+            insort(self.views[self.states[-1]], pos)
+        self.lengths.append(sum(counts.values()))
+        self.times.append(epoch(note['timestamp']) or 0.0)
+        for term, count in counts.items():
+            if term not in self.postings:
+                self.postings[term] = array('I')
+                self.freqs[term] = bytearray()
+                self._terms = None
+            self.postings[term].append(docnum)
+            self.freqs[term].append(min(count, MAX_TF))
+        for tag in {tag.lower() for tag in note.get('tags', [])}:
+            self.tagged.setdefault(tag, array('I')).append(docnum)
+
+    def _purge(self):
+        # Renumber live documents so tombstones don't outlive a compaction.
+        remap, docs = {}, []
+        for docnum, doc in sorted(enumerate(self.docs), key=lambda d: d[1][1] if d[1] else -1):
+            if doc is not None:
+                remap[docnum] = len(docs)
+                docs.append(doc)
+        postings, freqs = {}, {}
+        for term, nums in self.postings.items():
+            live = sorted((remap[n], count) for n, count in zip(nums, self.freqs[term]) if n in remap)
+            if live:
+                postings[term] = array('I', [n for n, _ in live])
+                freqs[term] = bytearray(count for _, count in live)
+        tagged = {}
+        for tag, nums in self.tagged.items():
+            live = sorted(remap[n] for n in nums if n in remap)
+            if live:
+                tagged[tag] = array('I', live)
+        old = sorted(remap, key=remap.get)
+        self.states = bytearray(self.states[n] for n in old)
+        self.positions = array('I', [self.positions[n] for n in old])
+        self.lengths = array('I', [self.lengths[n] for n in old])
+        self.times = array('d', [self.times[n] for n in old])
+        self.docs, self.postings, self.freqs, self.tagged, self._terms = docs, postings, freqs, tagged, None
+        self._by_id = None
+
+    def rebase(self):
+        self._purge()
+        super().rebase()
+
+    def _expand(self, term, prefix, words=True):
+        # the index terms a query term stands for
+        if not words:
+            return [name for name in self.postings if term in name]
+        if not prefix:
+            return [term] if term in self.postings else []
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        i = j = bisect_left(self._terms, term)
+        while j < len(self._terms) and self._terms[j].startswith(term):
+            j += 1
+        return self._terms[i:j]
+
+    def _lookup(self, term, prefix, words=True):
+        found = set()
+        for name in self._expand(term, prefix, words):
+            found.update(self.postings[name])
+        return found
+
+    def _matches(self, clauses, words=True):
+        matches = set()
+        for clause in clauses:
+            hits = None
+            for term, prefix in clause:
+                found = self._lookup(term, prefix, words)
+                hits = found if hits is None else hits & found
+                if not hits:
+                    break
+            matches |= hits or set()
+        return matches
+
+    def search(self, query, only_archived=False, words=False):
+        """Return ``(line_number, nid, timestamp, preview)`` for active (or archived) matches.
+
+        Terms match inside words, or with ``words`` only whole words (and prefixes).
+        """
+        only_archived = bool(only_archived)
+        hits = sorted((self.docs[n] for n in self._matches(parse_query(query), words)
+                       if self.docs[n] is not None and self.docs[n][2] == only_archived),
+                      key=lambda doc: doc[1])
+        # line numbers count the view's notes in insertion order
+        view = self.views[ARCHIVED if only_archived else ACTIVE]
+        return [(bisect_left(view, pos) + 1, nid, ts, preview)
+                for nid, pos, _, ts, preview in hits]
+
+    def rank(self, query, top=10, only_archived=False, now=None):
+        """Return ``(line_number, nid, timestamp, preview, score)`` for the ``top``
+        best active (or archived) matches, best first; equal scores in insertion order.
+        """
+        clauses = parse_query(query)
+        live = len(self.states) - self.states.count(GONE)
+        if not clauses or top <= 0 or not live:
+            return []
+        words = list(dict.fromkeys(term for clause in clauses for term, _ in clause))
+        terms = list(dict.fromkeys(name for clause in clauses for term, prefix in clause
+                                   for name in self._expand(term, prefix)))
+        tags = [self.tagged[word] for word in words if word in self.tagged]
+        want = ARCHIVED if only_archived else ACTIVE
+        now = time.time() if now is None else now
+        np = compat.numpy()
+        if np is None:
+            best = self._rank_python(clauses, terms, tags, live, want, top, now)
+        else:
+            best = self._rank_numpy(np, clauses, terms, tags, live, want, top, now)
+        # line numbers count the view's notes in insertion order
+        view = self.views[want]
+        return [(bisect_left(view, self.positions[n]) + 1, self.docs[n][0], self.docs[n][3], self.docs[n][4], score)
+                for score, n in best]
+
+    def _rank_python(self, clauses, terms, tags, live, want, top, now):
+        candidates = {n for n in self._matches(clauses) if self.states[n] == want}
+        avgdl = sum(length for length, state in zip(self.lengths, self.states) if state != GONE) / live or 1
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in terms:
+            nums = self.postings[term]
+            idf = _idf(live, sum(1 for n in nums if self.states[n] != GONE))
+            for n, tf in zip(nums, self.freqs[term]):
+                if n in scores:
+                    scores[n] += _bm25(idf, tf, self.lengths[n], avgdl)
+        tag_hits = Counter(n for nums in tags for n in nums if n in scores)
+        for n in scores:
+            scores[n] *= boost(tag_hits[n], max(now - self.times[n], 0) / 86400)
+        best = heapq.nlargest(top, scores, key=lambda n: (scores[n], -self.positions[n]))
+        return [(scores[n], n) for n in best]
+
+    def _rank_numpy(self, np, clauses, terms, tags, live, want, top, now):
+        # every candidate scored at once; only the top ones are sorted
+        states = np.frombuffer(self.states, dtype=np.uint8)
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        postings = {term: np.frombuffer(self.postings[term], dtype=np.uint32) for term in terms}
+        candidates = np.zeros(len(states), dtype=bool)
+        for clause in clauses:
+            hits = None
+            for term, prefix in clause:
+                found = np.zeros(len(states), dtype=bool)
+                for name in self._expand(term, prefix):
+                    found[postings[name]] = True
+                hits = found if hits is None else hits & found
+            candidates |= hits
+        candidates = np.flatnonzero(candidates & (states == want))
+        if not len(candidates):
+            return []
+        avgdl = int(lengths[states != GONE].sum()) / live or 1
+        scores = np.zeros(len(states))
+        for term in terms:
+            nums = postings[term]
+            idf = _idf(live, int(np.count_nonzero(states[nums])))
+            tf = np.frombuffer(self.freqs[term], dtype=np.uint8).astype(np.float64)
+            scores[nums] += _bm25(idf, tf, lengths[nums], avgdl)
+        tag_hits = np.zeros(len(states))
+        for nums in tags:
+            tag_hits[np.frombuffer(nums, dtype=np.uint32)] += 1
+        ages = np.maximum(now - np.frombuffer(self.times, dtype=np.float64)[candidates], 0) / 86400
+        scores = scores[candidates] * boost(tag_hits[candidates], ages)
+        if len(scores) > top:
+            # all that tie with the top-th best stay in, for insertion order to settle
+            keep = np.flatnonzero(scores >= np.partition(scores, len(scores) - top)[len(scores) - top])
+            candidates, scores = candidates[keep], scores[keep]
+        best = sorted(zip(scores.tolist(), candidates.tolist()), key=lambda s: (-s[0], self.positions[s[1]]))
+        return best[:top]
+
+def _idf(live, df):
+    return math.log(1 + (live - df + 0.5) / (df + 0.5))
+
+def _bm25(idf, tf, length, avgdl):
+    # one term's part of a document's score; works on NumPy arrays as well as numbers
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avgdl))
+
+journal.snapshot_hooks.append(SearchIndex.carry_over)
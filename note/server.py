@@ -0,0 +1,91 @@
+"""``note --serve``: keep the store open and answer commands over a Unix socket.
+
+Each request from client.py is a NUL-separated list: ``run``, the client's
+working directory and the command's arguments, or just ``flush`` before a
+client touches the files itself.  Requests are handled one at a time, so writes are
+serialized.  Replies wait until the writes are in the journal: those of
+requests already queued on the socket (up to FLUSH_REQUESTS) are held in
+memory and appended, and fsynced, together before any of them is answered.
+Before each command the store picks up whatever other processes wrote.
+"""
+import contextlib, io, os, signal, socket, sys
+from note import cli
+
+FLUSH_REQUESTS = 100  # requests whose writes are appended together at most
+
+def _run(args, cwd):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            os.chdir(cwd)
+            sys.argv = ["note"] + args
+            cli.main()
+        except Exception as e:
+            print(f"Error: {e}")
+    return out.getvalue().encode()
+
+def _listen(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        pass
+    else:
+        sock.close()
+        return None
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)  # left behind by a server that didn't shut down cleanly
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(64)
+    return sock
+
+def _commit(store, waiting):
+    # the writes of every waiting request reach the journal, then each is answered
+    store.flush()
+    for conn, reply in waiting:
+        with conn:
+            with contextlib.suppress(OSError):
+                conn.sendall(reply)
+    waiting.clear()
+
+def serve(path):
+    sock = _listen(path)
+    if sock is None:
+        print(f"A note server is already listening on {path}")
+        return
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    sys.stdin = open(os.devnull)  # a command that prompts gets EOF, not our terminal
+    store = cli.get_store()
+    store.hold()
+    print(f"Serving notes on {path}")
+    waiting = []  # (connection, reply) until their writes are flushed
+    try:
+        while True:
+            sock.settimeout(0 if waiting else None)
+            try:
+                conn, _ = sock.accept()
+            except (BlockingIOError, socket.timeout):
+                _commit(store, waiting)  # nothing else queued
+                continue
+            conn.settimeout(None)
+            with conn.makefile('rb') as f:
+                fields = [os.fsdecode(field) for field in f.read().split(b"\0")]
+            store.refresh()
+            reply = b""
+            if fields[0] == "run" and len(fields) >= 2:
+                reply = _run(fields[2:], fields[1])
+            waiting.append((conn, reply))
+            if fields[0] == "flush" or len(waiting) >= FLUSH_REQUESTS:
+                _commit(store, waiting)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _commit(store, waiting)
+        sock.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
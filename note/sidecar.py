@@ -0,0 +1,113 @@
+"""Helpers for derived index files kept next to the JSON store.
+
+A sidecar records the snapshot it was built from and how far into the journal
+it has applied.  If the snapshot has changed underneath it (restore, a manual
+edit, compaction by a process that didn't carry it over) it is stale and gets
+rebuilt; otherwise the owner replays the journal tail and carries on.
+"""
+import gc, json, marshal, os
+from note import journal
+
+BATCH_OPS = 256  # ops caught up at once past which an index may apply them wholesale
+
+def read(path, db_path, binary=False):
+    # marshal.load() on a file object reads it in tiny pieces, several times
+    # slower than loading the bytes; and nothing loaded here can form a cycle,
+    # so the collector would only walk the growing lists again and again.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        data = marshal.loads(raw) if binary else json.loads(raw)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+    if not isinstance(data, dict) or data.get('snapshot') != journal.snapshot_id(db_path):
+        return None
+    return data
+
+def write(path, data, binary=False):
+    # binary sidecars use marshal: private caches with many small strings,
+    # which it loads several times faster than json
+    tmp = f"{path}.{os.getpid()}.tmp"  # readers in other processes may save the same file
+    with open(tmp, 'wb') as f:
+        if binary:
+            marshal.dump(data, f)
+        else:
+            f.write(json.dumps(data, separators=(',', ':')).encode())
+    os.replace(tmp, path)
+
+class Sidecar:
+    """Base for indexes that follow the journal.
+
+    Subclasses set ``suffix`` and implement ``build(db)``, ``apply(op)``,
+    ``dump()`` and ``restore(data)``, and may override ``apply_all(ops)``
+    when a long run of ops is cheaper to apply in one pass.
+    """
+    suffix = None
+    version = 1
+    binary = False
+    save_after_bytes = 64 * 1024  # persist once this much journal has been replayed
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.path = db_path + self.suffix
+        self.snapshot = None
+        self.journal_end = 0
+        self._unsaved = 0
+
+    @classmethod
+    def open(cls, db_path):
+        index = cls(db_path)
+        with journal.lock(db_path, exclusive=False):
+            data = read(index.path, db_path, cls.binary)
+            if data is None or data.get('version') != cls.version:
+                index.rebuild()
+            else:
+                index.snapshot = data['snapshot']
+                index.journal_end = data['journal']
+                index.restore(data)
+                index.catch_up()
+        return index
+
+    def rebuild(self):
+        self.snapshot = journal.snapshot_id(self.db_path)
+        db, self.journal_end = journal.replay(self.db_path, thaw=True)
+        self.build(db)
+        self.save()
+
+    def catch_up(self):
+        with journal.lock(self.db_path, exclusive=False):
+            ops, end = journal.read_tail(self.db_path, self.journal_end)
+        self.apply_all(ops)
+        self._unsaved += end - self.journal_end
+        self.journal_end = end
+        if self._unsaved > self.save_after_bytes:
+            self.save()
+
+    def apply_all(self, ops):
+        for op in ops:
+            self.apply(op)
+
+    def save(self):
+        data = self.dump()
+        data.update(version=self.version, snapshot=self.snapshot, journal=self.journal_end)
+        write(self.path, data, self.binary)
+        self._unsaved = 0
+
+    def rebase(self):
+        # The compacted snapshot holds exactly what we've replayed so far.
+        self.snapshot = journal.snapshot_id(self.db_path)
+        self.journal_end = 0
+        self.save()
+
+    @classmethod
+    def carry_over(cls, db_path, carry):
+        # A replaced snapshot just leaves the file stale; it is rebuilt on use.
+        if not carry or not os.path.exists(db_path + cls.suffix):
+            return None
+        index = cls.open(db_path)
+        return lambda db, locations: index.rebase()
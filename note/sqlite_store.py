@@ -0,0 +1,571 @@
+"""SQLite backend.
+
+Notes, tags and archive state live in indexed tables; ``seq`` preserves
+insertion order so line numbers match the JSON store.  Content is mirrored
+into an FTS5 table with the trigram tokenizer, which answers the same
+case-insensitive substring queries ``note search`` has always supported
+without lowercasing every note in Python.  The AND/OR query syntax of the JSON
+search index maps straight onto FTS5 expressions; with trigrams every term
+matches anywhere inside a word, as it does there.
+
+Whole words can't come from FTS5 either: trigrams are not the words the
+JSON store's search index holds.  Instead each note's words and their
+counts go into a ``words`` table (filled on first use, like the MinHash
+signatures, and dropped with the note's content), which answers
+``note search --words`` and from which ranked() computes the same scores
+as SearchIndex.rank, so they can be compared across backends.
+"""
+import contextlib, io, sqlite3, time
+from collections import Counter
+from datetime import datetime
+from note import journal, trace
+from note.meta_index import PREVIEW_LENGTH, format_time, make_preview
+from note.search_index import B, K1, MAX_TF, SEARCH_PREVIEW, _idf, boost, parse_query, tokenize
+from note.time_index import epoch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    content TEXT NOT NULL,
+    archived INTEGER NOT NULL DEFAULT 0,
+    archived_at TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_view ON notes(archived, seq);
+CREATE INDEX IF NOT EXISTS notes_age ON notes(archived, timestamp);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    note_seq INTEGER NOT NULL REFERENCES notes(seq) ON DELETE CASCADE,
+    pos INTEGER NOT NULL,
+    PRIMARY KEY (tag, note_seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_note ON tags(note_seq, pos);
+CREATE TRIGGER IF NOT EXISTS notes_fts_ins AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(rowid, content) VALUES (new.seq, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_del AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_fts_upd AFTER UPDATE OF content ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+    INSERT INTO notes_fts(rowid, content) VALUES (new.seq, new.content);
+END;
+CREATE TABLE IF NOT EXISTS minhash (
+    note_seq INTEGER PRIMARY KEY REFERENCES notes(seq) ON DELETE CASCADE,
+    sig BLOB NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS notes_minhash_upd AFTER UPDATE OF content ON notes
+WHEN old.content IS NOT new.content BEGIN
+    DELETE FROM minhash WHERE note_seq = old.seq;
+END;
+CREATE TABLE IF NOT EXISTS words (
+    term TEXT NOT NULL,
+    note_seq INTEGER NOT NULL REFERENCES notes(seq) ON DELETE CASCADE,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, note_seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS words_note ON words(note_seq);
+CREATE TABLE IF NOT EXISTS word_counts (
+    note_seq INTEGER PRIMARY KEY REFERENCES notes(seq) ON DELETE CASCADE,
+    length INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS notes_words_upd AFTER UPDATE OF content ON notes
+WHEN old.content IS NOT new.content BEGIN
+    DELETE FROM words WHERE note_seq = old.seq;
+    DELETE FROM word_counts WHERE note_seq = old.seq;
+END;
+"""
+
+FTS_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(content, content='notes', content_rowid='seq'{})"
+
+# Trigram matching needs at least this many characters; shorter keywords
+# fall back to a scan.
+MIN_FTS_KEYWORD = 3
+ITER_BATCH = 500  # rows per fetch when streaming; also bounds the tag lookup's IN list
+
+def _view_clause(include_archived=False, only_archived=False):
+    if only_archived:
+        return "WHERE archived = 1"
+    if include_archived:
+        return ""
+    return "WHERE archived = 0"
+
+def _fts_expression(clauses):
+    # the FTS5 query for OR'ed clauses of AND'ed terms, or None if a term is too short for it
+    if not all(len(term) >= MIN_FTS_KEYWORD for clause in clauses for term in clause):
+        return None
+    return " OR ".join("(" + " AND ".join('"' + term.replace('"', '""') + '"' for term in clause) + ")"
+                       for clause in clauses)
+
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        try:
+            self.conn.execute(FTS_TABLE.format(", tokenize='trigram'"))
+        except sqlite3.OperationalError:
+            # SQLite < 3.34 has no trigram tokenizer; word matching is the best we get
+            self.conn.execute(FTS_TABLE.format(""))
+        self.conn.executescript(SCHEMA)
+        self._batching = False  # inside transaction()
+
+    def _writing(self):
+        # a transaction of its own, unless transaction() already opened one
+        return contextlib.nullcontext() if self._batching else self.conn
+
+    def _tags_for(self, seqs=None):
+        if seqs is None:
+            rows = self.conn.execute("SELECT note_seq, tag FROM tags ORDER BY note_seq, pos")
+        else:
+            marks = ",".join("?" * len(seqs))
+            rows = self.conn.execute(
+                f"SELECT note_seq, tag FROM tags WHERE note_seq IN ({marks}) ORDER BY note_seq, pos", seqs)
+        tags = {}
+        for seq, tag in rows:
+            tags.setdefault(seq, []).append(tag)
+        return tags
+
+    def _notes(self, rows, tags):
+        return [(seq, nid, {
+            "timestamp": ts,
+            "content": content,
+            "tags": tags.get(seq, []),
+            "archived": bool(archived),
+            "archived_at": archived_at,
+        }) for seq, nid, ts, content, archived, archived_at in rows]
+
+    def _select(self, where="", params=(), all_tags=False):
+        rows = self.conn.execute(
+            "SELECT seq, id, timestamp, content, archived, archived_at FROM notes "
+            f"{where} ORDER BY seq", params).fetchall()
+        tags = self._tags_for() if all_tags else self._tags_for([r[0] for r in rows])
+        return self._notes(rows, tags)
+
+    def load(self, thaw=False):
+        # nothing is ever left in a cold segment here, so there is nothing to thaw
+        with trace.phase("load") as p:
+            db = {nid: note for _, nid, note in self._select(all_tags=True)}
+            trace.count(p, len(db))
+        return db
+
+    def replace(self, db):
+        with self._writing(), trace.phase("replace") as p:
+            trace.count(p, len(db))
+            self.conn.execute("DELETE FROM notes")
+            self._insert(db.items())
+
+    def _insert(self, items):
+        for nid, note in items:
+            cur = self.conn.execute(
+                "INSERT INTO notes (id, timestamp, content, archived, archived_at) VALUES (?, ?, ?, ?, ?)",
+                (nid, note['timestamp'], note.get('content', ''),
+                 int(bool(note.get('archived', False))), note.get('archived_at')))
+            self._set_tags(cur.lastrowid, note.get('tags', []))
+
+    def _set_tags(self, seq, tags):
+        self.conn.execute("DELETE FROM tags WHERE note_seq = ?", (seq,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO tags (tag, note_seq, pos) VALUES (?, ?, ?)",
+            [(tag, seq, pos) for pos, tag in enumerate(tags)])
+
+    # Each write is its own WAL commit, which with synchronous=NORMAL costs no
+    # fsync, and other connections' commits are visible to the next query, so
+    # there is nothing to batch or to catch up on.
+    def hold(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Make the writes in the block one SQLite transaction, holding the lock; see JsonStore."""
+        if self._batching:
+            yield self
+            return
+        with journal.lock(self.path), self.conn:
+            self._batching = True
+            try:
+                yield self
+            finally:
+                self._batching = False
+
+    def locked(self):
+        """Keep other processes from writing while a note is read, changed and saved."""
+        # Each write is its own transaction, so a read-modify-write needs the
+        # same advisory lock the JSON store uses.
+        return journal.lock(self.path)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def items(self, include_archived=False, only_archived=False):
+        return [(nid, note) for _, nid, note in
+                self._select(_view_clause(include_archived, only_archived))]
+
+    def iter_notes(self, include_archived=False, only_archived=False, inline=True):
+        """Yield ``(nid, note)`` for the view a batch of rows at a time."""
+        # ``inline`` is for JsonStore's sake: contents are always inline here
+        cur = self.conn.execute(
+            "SELECT seq, id, timestamp, content, archived, archived_at FROM notes "
+            f"{_view_clause(include_archived, only_archived)} ORDER BY seq")
+        while True:
+            rows = cur.fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            for _, nid, note in self._notes(rows, self._tags_for([r[0] for r in rows])):
+                yield nid, note
+
+    def rows(self, include_archived=False, only_archived=False):
+        """Return ``(line_number, nid, timestamp, tags, preview)`` without reading note bodies."""
+        rows = self.conn.execute(
+            "SELECT seq, id, timestamp, substr(content, 1, ?) FROM notes "
+            f"{_view_clause(include_archived, only_archived)} ORDER BY seq",
+            (PREVIEW_LENGTH + 1,)).fetchall()
+        tags = self._tags_for()
+        return [(idx, nid, ts, tags.get(seq, []), make_preview(head))
+                for idx, (seq, nid, ts, head) in enumerate(rows, start=1)]
+
+    def listing(self, include_archived=False, only_archived=False, since=None, until=None,
+                reverse=False, offset=0, limit=None):
+        """Yield ``(line_number, nid, timestamp, date, tags, preview)`` lazily; see JsonStore."""
+        # The date range, order and paging all go into the query, so only the
+        # rows actually printed are fetched and formatted.
+        where, params = [], [PREVIEW_LENGTH + 1]
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        params += [-1 if limit is None else limit, offset]
+        cur = self.conn.execute(
+            "SELECT rn, seq, id, timestamp, head FROM ("
+            " SELECT seq, id, timestamp, substr(content, 1, ?) AS head,"
+            " ROW_NUMBER() OVER (ORDER BY seq) AS rn FROM notes "
+            f"{_view_clause(include_archived, only_archived)}) "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+            f"ORDER BY seq {'DESC' if reverse else ''} LIMIT ? OFFSET ?", params)
+        while True:
+            rows = cur.fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            tags = self._tags_for([r[1] for r in rows])
+            for idx, seq, nid, ts, head in rows:
+                yield idx, nid, ts, format_time(ts, year=True), tags.get(seq, []), make_preview(head)
+
+    def nth(self, line_number, include_archived=False, only_archived=False):
+        if line_number < 1:
+            return None
+        row = self.conn.execute(
+            f"SELECT id FROM notes {_view_clause(include_archived, only_archived)} "
+            "ORDER BY seq LIMIT 1 OFFSET ?", (line_number - 1,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, nid, inline=True):
+        found = self._select("WHERE id = ?", (nid,))
+        return found[0][2] if found else None
+
+    def get_many(self, nids, inline=True):
+        """Return ``(nid, note)`` for those of ``nids`` that exist."""
+        found = {}
+        for start in range(0, len(nids), ITER_BATCH):
+            batch = list(nids[start:start + ITER_BATCH])
+            found.update((nid, note) for _, nid, note in
+                         self._select(f"WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return [(nid, found[nid]) for nid in nids if nid in found]
+
+    def open_content(self, note):
+        return io.BytesIO(note.get('content', '').encode())
+
+    def add(self, nid, note):
+        with self._writing():
+            self._insert([(nid, note)])
+
+    def add_many(self, items):
+        """Add ``(nid, note)`` pairs in one transaction."""
+        with self._writing():
+            self._insert(items)
+
+    def _update(self, nid, note):
+        self.conn.execute(
+            "UPDATE notes SET timestamp = ?, content = ?, archived = ?, archived_at = ? WHERE id = ?",
+            (note['timestamp'], note.get('content', ''),
+             int(bool(note.get('archived', False))), note.get('archived_at'), nid))
+        row = self.conn.execute("SELECT seq FROM notes WHERE id = ?", (nid,)).fetchone()
+        if row:
+            self._set_tags(row[0], note.get('tags', []))
+
+    def update(self, nid, note, op="update"):
+        with self._writing():
+            self._update(nid, note)
+
+    def update_many(self, items, op="update"):
+        """Update ``(nid, note)`` pairs in one transaction."""
+        with self._writing():
+            for nid, note in items:
+                self._update(nid, note)
+
+    def delete(self, *nids):
+        with self._writing():
+            self.conn.executemany("DELETE FROM notes WHERE id = ?", [(nid,) for nid in nids])
+
+    def _numbered(self, view_where, match_where, params):
+        # Line numbers come from the view; the match filter is applied on top.
+        rows = self.conn.execute(
+            "SELECT rn, seq, id, timestamp, content, archived, archived_at FROM ("
+            " SELECT *, ROW_NUMBER() OVER (ORDER BY seq) AS rn FROM notes "
+            f"{view_where}) {match_where} ORDER BY seq", params).fetchall()
+        tags = self._tags_for([r[1] for r in rows])
+        notes = self._notes([r[1:] for r in rows], tags)
+        return [(row[0], nid, note) for row, (_, nid, note) in zip(rows, notes)]
+
+    def _match(self, query, substring=False):
+        # the condition on notes for a search query, and its parameters
+        clauses = [[query]] if substring else [[term for term, _ in c] for c in parse_query(query)]
+        if not clauses:
+            clauses = [[query]]
+        terms = [term for clause in clauses for term in clause]
+        expr = _fts_expression(clauses)
+        if expr is not None:
+            return "seq IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)", [expr]
+        where = " OR ".join(
+            "(" + " AND ".join("instr(lower(content), ?) > 0" for _ in clause) + ")"
+            for clause in clauses)
+        return f"({where})", [t.lower() for t in terms]
+
+    def _word_match(self, clauses):
+        # the condition on notes for whole-word (or prefix) terms, from the words table
+        self._index_words()
+        where, params = [], []
+        for clause in clauses:
+            where.append("(" + " AND ".join(
+                f"seq IN (SELECT note_seq FROM words WHERE term {'GLOB' if prefix else '='} ?)"
+                for _, prefix in clause) + ")")
+            params += [term + "*" if prefix else term for term, prefix in clause]
+        return "(" + " OR ".join(where) + ")", params
+
+    def search(self, query, substring=False, only_archived=False, words=False):
+        """Return ``(line_number, nid, timestamp, preview)`` for active (or archived) matches; see JsonStore."""
+        clauses = parse_query(query)
+        if words and clauses and not substring:
+            where, params = self._word_match(clauses)
+        else:
+            where, params = self._match(query, substring)
+        rows = self._numbered(_view_clause(only_archived=only_archived), f"WHERE {where}", params)
+        return [(idx, nid, note['timestamp'], note['content'][:SEARCH_PREVIEW].replace('\n', ' '))
+                for idx, nid, note in rows]
+
+    def _index_words(self):
+        # a note's rows go when its content changes (see SCHEMA), so only those without any are counted
+        if self.conn.execute("SELECT (SELECT COUNT(*) FROM notes) = (SELECT COUNT(*) FROM word_counts)").fetchone()[0]:
+            return
+        missing = [r[0] for r in self.conn.execute(
+            "SELECT seq FROM notes WHERE seq NOT IN (SELECT note_seq FROM word_counts)")]
+        for start in range(0, len(missing), ITER_BATCH):
+            batch = missing[start:start + ITER_BATCH]
+            rows = self.conn.execute(
+                f"SELECT seq, content FROM notes WHERE seq IN ({','.join('?' * len(batch))})", batch).fetchall()
+            words, lengths = [], []
+            for seq, content in rows:
+                counts = Counter(tokenize(content))
+                words.extend((term, seq, min(count, MAX_TF)) for term, count in counts.items())
+                lengths.append((seq, sum(counts.values())))
+            with self._writing():
+                self.conn.executemany("INSERT OR REPLACE INTO words (term, note_seq, tf) VALUES (?, ?, ?)", words)
+                self.conn.executemany("INSERT OR REPLACE INTO word_counts (note_seq, length) VALUES (?, ?)", lengths)
+
+    def _expand(self, term, prefix):
+        # the words a query term stands for, as SearchIndex._expand; words never hold GLOB's wildcards
+        if not prefix:
+            return [term] if self.conn.execute("SELECT 1 FROM words WHERE term = ?", (term,)).fetchone() else []
+        return [r[0] for r in self.conn.execute("SELECT DISTINCT term FROM words WHERE term GLOB ?", (term + "*",))]
+
+    def ranked(self, query, top=10, only_archived=False):
+        """Return ``(line_number, nid, timestamp, preview, score)`` for the ``top``
+        best active (or archived) matches, best first; see JsonStore.
+
+        Notes match and score as SearchIndex.rank has them, by whole words
+        (or prefixes), not the substrings search() finds.
+        """
+        clauses = parse_query(query)
+        if not clauses or top <= 0:
+            return []
+        self._index_words()
+        # each word found carries a bit for every query term it stands for
+        bits, masks = {}, {}
+        for clause in clauses:
+            for term in clause:
+                if term not in bits:
+                    bits[term] = 1 << len(bits)
+                    for name in self._expand(*term):
+                        masks[name] = masks.get(name, 0) | bits[term]
+        if not masks:
+            return []
+        # a note matches a clause when its words cover each of the clause's terms
+        having = " OR ".join("(" + " AND ".join(f"MAX(query.mask & {bits[term]})" for term in clause) + ")"
+                             for clause in clauses)
+        marks = ",".join("?" * len(masks))
+        live, total = self.conn.execute("SELECT COUNT(*), TOTAL(length) FROM word_counts").fetchone()
+        avgdl = total / live or 1
+        df = dict(self.conn.execute(f"SELECT term, COUNT(*) FROM words WHERE term IN ({marks}) GROUP BY term",
+                                    list(masks)))
+        query_rows = [value for name, mask in masks.items() for value in (name, _idf(live, df[name]), mask)]
+        words = list(dict.fromkeys(term for term, _ in bits))
+        now = time.time()
+        self.conn.create_function("note_lower", 1, str.lower, deterministic=True)
+        self.conn.create_function(
+            "note_boost", 2, lambda tag_hits, ts: boost(tag_hits, max(now - (epoch(ts) or 0.0), 0) / 86400))
+        rows = self.conn.execute(
+            f"WITH query(term, idf, mask) AS (VALUES {','.join(['(?, ?, ?)'] * len(masks))}), "
+            "scored(seq, bm25) AS (SELECT words.note_seq, "
+            "SUM(query.idf * words.tf * ? / (words.tf + ? * (1 - ? + ? * word_counts.length / ?))) "
+            "FROM query JOIN words ON words.term = query.term "
+            "JOIN word_counts ON word_counts.note_seq = words.note_seq "
+            f"GROUP BY words.note_seq HAVING {having}) "
+            "SELECT notes.seq, scored.bm25 * note_boost((SELECT COUNT(DISTINCT note_lower(tag)) FROM tags "
+            f"WHERE note_seq = notes.seq AND note_lower(tag) IN ({','.join('?' * len(words))})), notes.timestamp) "
+            "AS score FROM scored JOIN notes ON notes.seq = scored.seq "
+            "WHERE notes.archived = ? ORDER BY score DESC, notes.seq LIMIT ?",
+            query_rows + [K1 + 1, K1, B, B, avgdl] + words + [int(only_archived), top]).fetchall()
+        if not rows:
+            return []
+        scores = dict(rows)
+        best = [seq for seq, _ in rows]
+        numbered = dict(zip(sorted(best), self._numbered(
+            _view_clause(only_archived=only_archived), f"WHERE seq IN ({','.join('?' * len(best))})", best)))
+        out = []
+        for seq in best:
+            idx, nid, note = numbered[seq]
+            out.append((idx, nid, note['timestamp'], note['content'][:SEARCH_PREVIEW].replace('\n', ' '), scores[seq]))
+        return out
+
+    def tags(self):
+        return [r[0] for r in self.conn.execute("SELECT DISTINCT tag FROM tags ORDER BY tag")]
+
+    def tag_counts(self):
+        return self.conn.execute(
+            "SELECT tag, COUNT(*), SUM(notes.archived) FROM tags "
+            "JOIN notes ON notes.seq = tags.note_seq GROUP BY tag ORDER BY tag").fetchall()
+
+    def tagged(self, all_of=(), any_of=()):
+        where, params = [], []
+        if all_of:
+            all_of = sorted(set(all_of))
+            marks = ",".join("?" * len(all_of))
+            where.append(f"seq IN (SELECT note_seq FROM tags WHERE tag IN ({marks}) "
+                         "GROUP BY note_seq HAVING COUNT(*) = ?)")
+            params += all_of + [len(all_of)]
+        if any_of:
+            marks = ",".join("?" * len(any_of))
+            where.append(f"seq IN (SELECT note_seq FROM tags WHERE tag IN ({marks}))")
+            params += list(any_of)
+        if not where:
+            return []
+        return [(idx, nid, note['timestamp'], note['tags'], make_preview(note['content']))
+                for idx, nid, note in self._numbered(_view_clause(), "WHERE " + " AND ".join(where), params)]
+
+    def day_counts(self, since=None, until=None):
+        """Return ``(date, notes, archived notes)`` for each day with notes, oldest first."""
+        where, params = [], []
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        return self.conn.execute(
+            "SELECT substr(timestamp, 1, 10) AS day, COUNT(*), SUM(archived) FROM notes "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} GROUP BY day ORDER BY day", params).fetchall()
+
+    def _filter(self, tags=(), since=None, until=None, text=None, include_archived=False, only_archived=False):
+        # the WHERE clause for where()'s filters, and its parameters
+        where, params = [], []
+        view = _view_clause(include_archived, only_archived)
+        if view:
+            where.append(view[len("WHERE "):])
+        if tags:
+            tags = sorted(set(tags))
+            marks = ",".join("?" * len(tags))
+            where.append(f"seq IN (SELECT note_seq FROM tags WHERE tag IN ({marks}) "
+                         "GROUP BY note_seq HAVING COUNT(*) = ?)")
+            params += tags + [len(tags)]
+        # ISO timestamps sort lexically, so the age index answers these directly
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        if text is not None:
+            match, match_params = self._match(text)
+            where.append(match)
+            params += match_params
+        return ("WHERE " + " AND ".join(where) if where else ""), params
+
+    def where(self, **query):
+        """Return the ids of the view's notes matching every filter given; see JsonStore."""
+        where, params = self._filter(**query)
+        return [r[0] for r in self.conn.execute(f"SELECT id FROM notes {where} ORDER BY seq", params)]
+
+    def minhashes(self):
+        """Return ``(line_number, nid, signature)`` for the active notes; see JsonStore."""
+        from note import dedupe
+        # a note's row goes when its content changes (see SCHEMA), so only those without one are hashed
+        missing = [r[0] for r in self.conn.execute(
+            "SELECT seq FROM notes WHERE archived = 0 AND seq NOT IN (SELECT note_seq FROM minhash)")]
+        for start in range(0, len(missing), ITER_BATCH):
+            batch = missing[start:start + ITER_BATCH]
+            rows = self.conn.execute(
+                f"SELECT seq, content FROM notes WHERE seq IN ({','.join('?' * len(batch))})", batch).fetchall()
+            sigs = dedupe.signatures([dedupe.normalize(content) for _, content in rows])
+            with self._writing():
+                self.conn.executemany("INSERT OR REPLACE INTO minhash (note_seq, sig) VALUES (?, ?)",
+                                      [(seq, sig) for (seq, _), sig in zip(rows, sigs)])
+        rows = self.conn.execute(
+            "SELECT id, sig FROM notes JOIN minhash ON minhash.note_seq = notes.seq "
+            "WHERE archived = 0 ORDER BY seq").fetchall()
+        return [(idx, nid, sig) for idx, (nid, sig) in enumerate(rows, start=1)]
+
+    def tag_many(self, nids, add=(), remove=()):
+        """Add and remove tags on the notes ``nids`` in one transaction; return how many changed."""
+        changed = 0
+        with self.transaction():
+            for nid in nids:
+                row = self.conn.execute("SELECT seq FROM notes WHERE id = ?", (nid,)).fetchone()
+                if row is None:
+                    continue
+                tags = self._tags_for([row[0]]).get(row[0], [])
+                new = sorted(set(tags).union(add).difference(remove))
+                if new != tags:
+                    self._set_tags(row[0], new)
+                    changed += 1
+        return changed
+
+    def delete_where(self, **query):
+        """Delete the notes where(**query) finds in one statement; return how many."""
+        where, params = self._filter(**query)
+        with self.transaction():
+            return self.conn.execute(f"DELETE FROM notes {where}", params).rowcount
+
+    def archive_where(self, **query):
+        """Archive the active notes where(**query) finds in one statement; return how many."""
+        where, params = self._filter(**query)
+        with self.transaction():
+            return self.conn.execute(
+                f"UPDATE notes SET archived = 1, archived_at = ? {where or 'WHERE 1'} AND archived = 0",
+                [datetime.now().isoformat()] + params).rowcount
+
+    def import_notes(self, db):
+        with self._writing():
+            existing = {r[0] for r in self.conn.execute("SELECT id FROM notes")}
+            fresh = [nid for nid in db if nid not in existing]
+            self._insert((nid, db[nid]) for nid in fresh)
+        return len(fresh)
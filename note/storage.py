@@ -0,0 +1,434 @@
+"""Storage backends.
+
+Commands in cli.py talk to a store object rather than to the database file
+directly, so the JSON journal store and the SQLite store are interchangeable.
+Line numbers always mean the 1-based position of a note, in insertion order,
+within the filtered view (active, archived only, or everything).
+
+Scripts can use a store directly: open_store() returns the configured one,
+where() finds notes by tag, date and text, the ``*_many``/``*_where`` methods
+change many notes with one write, and transaction() batches any other
+writes the same way.
+"""
+import contextlib, itertools
+from datetime import datetime
+from note import blobs, journal, sync, trace  # sync: its index follows the journal too
+from note.config import BACKEND, DB_PATH, SQLITE_PATH
+from note.dedupe import MinHashIndex
+from note.meta_index import MetaIndex, format_time, in_range, make_preview, shown
+from note.ordinal_index import OrdinalIndex
+from note.search_index import SEARCH_PREVIEW, SearchIndex, parse_query
+from note.tag_index import TagIndex
+from note.time_index import TimeIndex, epoch
+
+def should_show(note, include_archived=False, only_archived=False):
+    if only_archived:
+        return note.get('archived', False)
+    if include_archived:
+        return True
+    return not note.get('archived', False)
+
+def open_store(backend=None, path=None):
+    """Return a store for ``backend`` (``json`` or ``sqlite``; the configured one by default) at ``path``."""
+    backend = backend or BACKEND
+    if backend == "sqlite":
+        from note.sqlite_store import SqliteStore
+        return SqliteStore(path or SQLITE_PATH)
+    return JsonStore(path or DB_PATH)
+
+class JsonStore:
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._indexes = {}
+        self._located = {}  # nid -> (segment, offset, length) from recent lookups
+        self._held = None   # ops not yet appended, while hold() is in effect
+        self._batching = False  # inside transaction()
+        self._forget()
+
+    def _index(self, cls):
+        self.flush()
+        with journal.lock(self.path, exclusive=False), trace.phase("index " + cls.suffix.lstrip(".")):
+            self.refresh()
+            index = self._indexes.get(cls)
+            if index is None:
+                index = self._indexes[cls] = cls.open(self.path)
+            else:
+                index.catch_up()
+        return index
+
+    def _ordinal(self):
+        # Until something loads the whole db, line numbers and single notes
+        # come straight from the ordinal index.
+        if self._db is not None:
+            return None
+        index = self._index(OrdinalIndex)
+        return index if index.usable else None
+
+    def load(self, thaw=False):
+        """Return the whole store; archived notes are cold stubs unless ``thaw``."""
+        if self._db is None:
+            self.flush()
+            with trace.phase("load") as p:
+                self._db, self._end = journal.replay(self.path, thaw)
+                trace.count(p, len(self._db))
+            self._thawed = thaw
+        elif thaw and not self._thawed:
+            with journal.lock(self.path, exclusive=False):
+                self.refresh()
+                if self._db is None:
+                    return self.load(thaw)
+                self._db.thaw(journal.ColdReader(self.path))
+            self._thawed = True
+        return self._db
+
+    def replace(self, db):
+        if self._held:
+            self._held = []
+        with journal.lock(self.path), trace.phase("replace") as p:
+            blobs.externalize_all(self.path, db)
+            journal.replace(self.path, db)
+            trace.count(p, len(db))
+        self._forget()
+
+    def _forget(self):
+        self._db = None
+        self._thawed = False
+        self._indexes = {}
+        self._located = {}
+        with journal.lock(self.path, exclusive=False):
+            self._snapshot = journal.snapshot_id(self.path)
+            self._end = journal.journal_size(self.path)
+
+    def refresh(self):
+        """Pick up what other processes wrote since this store last looked."""
+        with journal.lock(self.path, exclusive=False):
+            if journal.snapshot_id(self.path) != self._snapshot:
+                # rewritten underneath us; cached indexes point into the old files
+                self._forget()
+                return
+            ops, self._end = journal.read_tail(self.path, self._end)
+        for op in ops:
+            self._located.pop(op['id'], None)
+            if self._db is not None:
+                if 'note' in op:
+                    journal.with_defaults(op['note'])
+                journal.apply_op(self._db, op)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Keep other processes from writing while a note is read, changed and saved."""
+        with journal.lock(self.path):
+            self.refresh()
+            yield
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the lock for the block and append all its writes at the end, at once.
+
+        If the block raises, its writes not yet appended are dropped.  Reads
+        that go through an index append what is held first, so only a block
+        that reads nothing that way is sure to write once.
+        """
+        if self._batching:
+            yield self
+            return
+        with journal.lock(self.path):
+            self.refresh()
+            holding = self._held is not None
+            self.flush()
+            self.hold()
+            self._batching = True
+            try:
+                yield self
+            except BaseException:
+                self._held = []
+                self._forget()  # the loaded store has the dropped writes applied
+                raise
+            finally:
+                self._batching = False
+                self.flush()
+                if not holding:
+                    self._held = None
+
+    def hold(self):
+        """Keep writes in memory until flush(); reads through this store still see them."""
+        if self._held is None:
+            self._held = []
+
+    def flush(self):
+        if self._held:
+            ops, self._held = self._held, []
+            self._append(ops)
+
+    def _write(self, ops):
+        if self._db is not None:
+            for op in ops:
+                journal.apply_op(self._db, op)
+        for op in ops:
+            self._located.pop(op['id'], None)
+        if self._held is not None:
+            self._held.extend(ops)
+        else:
+            self._append(ops)
+
+    def _append(self, ops):
+        with trace.phase("append") as p:
+            trace.count(p, len(ops))
+            with journal.lock(self.path):
+                # under the lock, so no compaction sweeps a blob before its op is in
+                ops = [dict(op, note=blobs.externalize(self.path, op['note'])) if 'note' in op else op
+                       for op in ops]
+                self.refresh()
+                end = journal.append(self.path, ops, sync=False)
+                if journal.snapshot_id(self.path) != self._snapshot:
+                    self._forget()  # compacted, and the snapshot is already on disk
+                    return
+                self._end = end  # our own ops are already applied
+            journal.sync_journal(self.path, end)
+
+    def count(self):
+        ordinal = self._ordinal()
+        if ordinal:
+            return ordinal.count("active") + ordinal.count("archived")
+        return len(self.load())
+
+    def _ids(self, include_archived=False, only_archived=False):
+        # filtered on the archived flags alone, without reading any note
+        db = self.load()
+        return [nid for nid in db if shown(db.archived(nid), include_archived, only_archived)]
+
+    def items(self, include_archived=False, only_archived=False):
+        return list(self._items(include_archived, only_archived))
+
+    def _items(self, include_archived=False, only_archived=False):
+        # each note is read as it is reached
+        db = self.load(thaw=include_archived or only_archived)
+        return ((nid, db[nid]) for nid in self._ids(include_archived, only_archived))
+
+    def iter_notes(self, include_archived=False, only_archived=False, inline=True):
+        """Yield ``(nid, note)`` for the view without loading the whole store.
+
+        Large contents are read back from their blobs unless ``inline`` is off.
+        """
+        if self._db is not None:
+            notes = self._items(include_archived, only_archived)
+        else:
+            self.flush()
+            notes = ((nid, note) for nid, note in journal.iter_notes(self.path, thaw=include_archived or only_archived)
+                     if should_show(note, include_archived, only_archived))
+        for nid, note in notes:
+            yield nid, blobs.inline(self.path, note) if inline else note
+
+    def nth(self, line_number, include_archived=False, only_archived=False):
+        # a compaction elsewhere would move every offset, so hold it off
+        with journal.lock(self.path, exclusive=False):
+            self.refresh()
+            ordinal = self._ordinal()
+            if ordinal:
+                view = "archived" if only_archived else "all" if include_archived else "active"
+                found = ordinal.nth(line_number, view)
+                if not found:
+                    return None
+                self._located[found[0]] = found[1:]
+                return found[0]
+        ids = self._ids(include_archived, only_archived)
+        if 1 <= line_number <= len(ids):
+            return ids[line_number - 1]
+        return None
+
+    def get(self, nid, inline=True):
+        """Return note ``nid``, or None.
+
+        With ``inline`` off a large note's content is only its preview; read
+        the rest through open_content().
+        """
+        note = self._get(nid)
+        return blobs.inline(self.path, note) if inline and note is not None else note
+
+    def open_content(self, note):
+        """Return a binary file object reading ``note``'s whole content.
+
+        Raises blobs.BlobError if its blob is missing or damaged.
+        """
+        return blobs.open_content(self.path, note)
+
+    def _get(self, nid):
+        with journal.lock(self.path, exclusive=False):
+            self.refresh()
+            ordinal = self._ordinal()
+            if ordinal:
+                location = self._located.get(nid) or ordinal.locate(nid)
+                return self._warm(nid, journal.read_note(self.path, *location) if location else None)
+        return self._warm(nid, self.load().get(nid))
+
+    def _warm(self, nid, note):
+        # an archived note read from the hot store is only a stub
+        if note is None or not journal.is_cold(note):
+            return note
+        with journal.lock(self.path, exclusive=False):
+            return journal.read_cold(self.path, {nid: note})[nid]
+
+    def rows(self, include_archived=False, only_archived=False):
+        """Return ``(line_number, nid, timestamp, tags, preview)`` without reading note bodies."""
+        if self._db is not None:
+            return [(idx, nid, n['timestamp'], n.get('tags', []), make_preview(n.get('content', '')))
+                    for idx, (nid, n) in enumerate(self.items(include_archived, only_archived), start=1)]
+        return self._index(MetaIndex).rows(include_archived, only_archived)
+
+    def listing(self, include_archived=False, only_archived=False, since=None, until=None,
+                reverse=False, offset=0, limit=None):
+        """Yield ``(line_number, nid, timestamp, date, tags, preview)`` lazily.
+
+        Only notes with ``since <= timestamp < until`` are included, newest
+        first with ``reverse``; ``offset`` and ``limit`` page through what
+        is left.  Line numbers stay those of the whole view.
+        """
+        if self._db is not None:
+            numbered = list(enumerate(self.items(include_archived, only_archived), start=1))
+            rows = ((idx, nid, n['timestamp'], format_time(n['timestamp'], year=True),
+                     n.get('tags', []), make_preview(n.get('content', '')))
+                    for idx, (nid, n) in (reversed(numbered) if reverse else numbered)
+                    if in_range(n['timestamp'], since, until))
+        elif since is None and until is None:
+            rows = self._index(MetaIndex).listing(include_archived, only_archived, reverse=reverse)
+        else:
+            times = self._index(TimeIndex)
+            lo, hi = (None if t is None else epoch(t) for t in (since, until))
+            views = ["archived"] if only_archived else ["active", "archived"] if include_archived else ["active"]
+            among = [nid for view in views for nid in times.between(view, lo, hi)]
+            rows = self._index(MetaIndex).listing(include_archived, only_archived, reverse=reverse, among=among)
+        return itertools.islice(rows, offset, None if limit is None else offset + limit)
+
+    def add(self, nid, note):
+        self._write([journal.make_op("add", nid, note)])
+
+    def add_many(self, items):
+        """Add ``(nid, note)`` pairs with one journal append."""
+        self._write([journal.make_op("add", nid, note) for nid, note in items])
+
+    def update(self, nid, note, op="update"):
+        self._write([journal.make_op(op, nid, note)])
+
+    def update_many(self, items, op="update"):
+        """Update ``(nid, note)`` pairs with one journal append."""
+        self._write([journal.make_op(op, nid, note) for nid, note in items])
+
+    def delete(self, *nids):
+        self._write([journal.make_op("delete", nid) for nid in nids])
+
+    def search(self, query, substring=False, only_archived=False, words=False):
+        """Return ``(line_number, nid, timestamp, preview)`` for active (or archived) matches.
+
+        Each term of ``query`` matches inside words, or with ``words`` only
+        whole words (see search_index.py); with ``substring`` the whole
+        query is one plain substring.
+        """
+        if substring or not parse_query(query):
+            # slow path: scan every note's content
+            keyword = query.lower()
+            return [(idx, nid, note['timestamp'], note['content'][:SEARCH_PREVIEW].replace('\n', ' '))
+                    for idx, (nid, note) in enumerate(self.iter_notes(only_archived=only_archived), start=1)
+                    if keyword in note['content'].lower()]
+        return self._index(SearchIndex).search(query, only_archived, words)
+
+    def ranked(self, query, top=10, only_archived=False):
+        """Return ``(line_number, nid, timestamp, preview, score)`` for the ``top``
+        best active (or archived) matches, best first; see search_index.py.
+        """
+        return self._index(SearchIndex).rank(query, top, only_archived)
+
+    def tags(self):
+        return sorted(self._index(TagIndex).counts)
+
+    def tag_counts(self):
+        return self._index(TagIndex).tag_counts()
+
+    def tagged(self, all_of=(), any_of=()):
+        meta = self._index(MetaIndex)
+        return [(idx,) + meta.row(nid) for idx, nid in self._index(TagIndex).query(all_of, any_of)]
+
+    def day_counts(self, since=None, until=None):
+        """Return ``(date, notes, archived notes)`` for each day with notes, oldest first."""
+        times = self._index(TimeIndex)
+        lo, hi = (None if t is None else epoch(t) for t in (since, until))
+        active, archived = times.per_day("active", lo, hi), times.per_day("archived", lo, hi)
+        return [(day.isoformat(), active.get(day, 0) + archived.get(day, 0), archived.get(day, 0))
+                for day in sorted(active.keys() | archived.keys())]
+
+    def where(self, tags=(), since=None, until=None, text=None, include_archived=False, only_archived=False):
+        """Return the ids of the view's notes matching every filter given, in view order.
+
+        A note has to carry all of ``tags``, have ``since <= timestamp <
+        until`` (ISO strings) and match ``text`` as ``note search`` would.
+        Each filter is answered by its index; no note is read.
+        """
+        views = ["archived"] if only_archived else ["active", "archived"] if include_archived else ["active"]
+        among = None
+        if tags:
+            among = self._index(TagIndex).having(tags)
+        if since is not None or until is not None:
+            times = self._index(TimeIndex)
+            lo, hi = (None if t is None else epoch(t) for t in (since, until))
+            found = {nid for view in views for nid in times.between(view, lo, hi)}
+            among = found if among is None else among & found
+        if text is not None:
+            found = {nid for view in views for _, nid, _, _ in self.search(text, only_archived=view == "archived")}
+            among = found if among is None else among & found
+        return [row[1] for row in self._index(MetaIndex).listing(include_archived, only_archived, among=among)]
+
+    def minhashes(self):
+        """Return ``(line_number, nid, signature)`` for the active notes (see dedupe.py).
+
+        Only notes added or changed since the last call are hashed.
+        """
+        sigs = self._index(MinHashIndex).sigs
+        return [(idx, nid, sigs[nid]) for idx, nid, *_ in self._index(MetaIndex).listing()]
+
+    def get_many(self, nids, inline=True):
+        """Return ``(nid, note)`` for those of ``nids`` that exist, reading each file once."""
+        if not nids:
+            return []
+        with journal.lock(self.path, exclusive=False):
+            self.refresh()
+            ordinal = self._ordinal()
+            if ordinal:
+                notes = dict(journal.read_notes(self.path, ordinal.locate_many(nids)))
+            else:
+                db = self.load()
+                notes = {nid: db[nid] for nid in nids if nid in db}
+            stubs = {nid: note for nid, note in notes.items() if journal.is_cold(note)}
+            if stubs:
+                notes.update(journal.read_cold(self.path, stubs))
+        return [(nid, blobs.inline(self.path, notes[nid]) if inline else notes[nid]) for nid in nids if nid in notes]
+
+    def write_ops(self, ops):
+        """Write ops made with journal.make_op(), which may carry a ``rev`` (see sync.py)."""
+        self._write(ops)
+
+    def tag_many(self, nids, add=(), remove=()):
+        """Add and remove tags on the notes ``nids`` with one append; return how many changed."""
+        with self.transaction():
+            ops = []
+            for nid, note in self.get_many(nids, inline=False):
+                tags = sorted(set(note.get('tags', [])).union(add).difference(remove))
+                if tags != note.get('tags', []):
+                    ops.append(journal.make_op("tag", nid, dict(note, tags=tags)))
+            self._write(ops)
+        return len(ops)
+
+    def delete_where(self, **query):
+        """Delete the notes where(**query) finds with one append; return how many."""
+        with self.transaction():
+            nids = self.where(**query)
+            self.delete(*nids)
+        return len(nids)
+
+    def archive_where(self, **query):
+        """Archive the active notes where(**query) finds with one append; return how many."""
+        now = datetime.now().isoformat()
+        with self.transaction():
+            ops = [journal.make_op("update", nid, dict(note, archived=True, archived_at=now))
+                   for nid, note in self.get_many(self.where(**query), inline=False) if not note.get('archived')]
+            self._write(ops)
+        return len(ops)
@@ -0,0 +1,216 @@
+"""Two-way sync between JSON stores.
+
+``note sync <path>`` merges the store at ``<path>`` (or ``<dir>/.notes_db.json``)
+and the local one until both hold the same notes.  Each store keeps a
+SyncIndex next to it, following its journal like the other indexes: for
+every note ever seen, a revision counter (bumped by each write to it) and a
+digest of its JSON, with deletes left as tombstones; a counter of changes
+and the log of which note each one touched; and, per store it has synced
+with, how far both had got then.  A sync only looks at notes either side
+changed since their last sync, so when little has changed it reads two
+small files and a handful of notes, however large the stores are.
+
+Where only one side changed a note, its version is copied to the other.
+Where both did, an edit beats a delete, then the higher revision wins,
+then the larger digest; if the loser's content differs it is kept as a
+new note tagged ``conflict``, under an id derived from it, so syncing
+either way round ends the same.  Stores meeting for the first time (or
+after one was replaced or restored) compare every note.
+"""
+import hashlib, json, os
+from array import array
+from bisect import bisect_right
+from note import journal, sidecar
+from note.model import with_defaults
+
+INDEX_SUFFIX = ".syncstate"
+DIGEST_BYTES = 16
+DELETED = bytes(DIGEST_BYTES)  # the digest of a note that is gone
+CONFLICT_TAG = "conflict"
+SCAN_LOOKUPS = 64  # notes looked up by scanning the ids before a dict of them pays off
+
+def note_digest(note):
+    # of the note as stored (a large one with its blob's name), whichever
+    # keys it was written with
+    canonical = json.dumps(with_defaults(dict(note)), sort_keys=True).encode()
+    return hashlib.sha256(canonical).digest()[:DIGEST_BYTES]
+
+class SyncIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    binary = True
+
+    def build(self, db):
+        self.replica = os.urandom(8).hex()  # a rebuilt index has no history to share
+        self.peers = {}  # replica -> [our change count, theirs] as of our last sync
+        self.seq = 0
+        self.ids = []
+        self._by_id = {}
+        self._scans = 0
+        self.revs = array('I')
+        self.digests = bytearray()
+        self.seqs = array('Q')      # row -> the change that last touched it
+        self.log_rows = array('I')  # changes in order; superseded ones are dropped now and then
+        self.log_seqs = array('Q')
+        for nid, note in db.items():
+            self._set(nid, None, 1, note_digest(note))
+
+    def restore(self, data):
+        self.replica = data['replica']
+        self.peers = data['peers']
+        self.seq = data['seq']
+        self.ids = data['ids']
+        self._by_id = None
+        self._scans = 0
+        self.revs = array('I', data['revs'])
+        self.digests = bytearray(data['digests'])
+        self.seqs = array('Q', data['seqs'])
+        self.log_rows = array('I', data['log_rows'])
+        self.log_seqs = array('Q', data['log_seqs'])
+
+    def dump(self):
+        return {"replica": self.replica, "peers": self.peers, "seq": self.seq, "ids": self.ids,
+                "revs": self.revs.tobytes(), "digests": bytes(self.digests), "seqs": self.seqs.tobytes(),
+                "log_rows": self.log_rows.tobytes(), "log_seqs": self.log_seqs.tobytes()}
+
+    def _row(self, nid):
+        if self._by_id is None and self._scans < SCAN_LOOKUPS:
+            # a sync that has little to do looks up a few notes; hashing every id costs more
+            self._scans += 1
+            try:
+                return self.ids.index(nid)
+            except ValueError:
+                return None
+        if self._by_id is None:
+            self._by_id = {n: i for i, n in enumerate(self.ids)}
+        return self._by_id.get(nid)
+
+    def _digest(self, row):
+        return bytes(self.digests[row * DIGEST_BYTES:(row + 1) * DIGEST_BYTES])
+
+    def apply(self, op):
+        nid = op['id']
+        row = self._row(nid)
+        live = row is not None and self._digest(row) != DELETED
+        if op['op'] == 'delete':
+            if not live:
+                return
+            digest = DELETED
+        elif op['op'] != 'add' and not live:
+            return  # as apply_op() does: an update to a missing note is dropped
+        else:
+            digest = note_digest(op['note'])
+        rev = op.get('rev') or (self.revs[row] + 1 if row is not None else 1)
+        self._set(nid, row, rev, digest)
+
+    def _set(self, nid, row, rev, digest):
+        self.seq += 1
+        if row is None:
+            row = len(self.ids)
+            if self._by_id is not None:
+                self._by_id[nid] = row
+            self.ids.append(nid)
+            self.revs.append(rev)
+            self.digests += digest
+            self.seqs.append(self.seq)
+        else:
+            self.revs[row] = rev
+            self.digests[row * DIGEST_BYTES:(row + 1) * DIGEST_BYTES] = digest
+            self.seqs[row] = self.seq
+        self.log_rows.append(row)
+        self.log_seqs.append(self.seq)
+        if len(self.log_rows) > 2 * len(self.ids) + 1024:
+            live = [(r, s) for r, s in zip(self.log_rows, self.log_seqs) if self.seqs[r] == s]
+            self.log_rows = array('I', (r for r, _ in live))
+            self.log_seqs = array('Q', (s for _, s in live))
+
+    def entry(self, nid):
+        """Return ``(revision, digest)`` for ``nid``, with None for the digest of a deleted note, or None."""
+        row = self._row(nid)
+        if row is None:
+            return None
+        digest = self._digest(row)
+        return self.revs[row], None if digest == DELETED else digest
+
+    def changed_since(self, seq):
+        """Ids of the notes (deleted ones too) changed after change ``seq``."""
+        start = bisect_right(self.log_seqs, seq)
+        return {self.ids[row] for row in self.log_rows[start:]}
+
+journal.snapshot_hooks.append(SyncIndex.carry_over)
+
+def store_path(path):
+    """The JSON store ``path`` names: the file itself, or ``.notes_db.json`` in a directory."""
+    return os.path.join(path, ".notes_db.json") if os.path.isdir(path) else path
+
+def _conflict_copy(nid, note):
+    # the same id and note on both sides, whichever way round they sync
+    copy_id = hashlib.sha256(f"{nid}:{note_digest(note).hex()}".encode()).hexdigest()[:8]
+    tags = sorted(set(note.get('tags', [])) | {CONFLICT_TAG})
+    return copy_id, dict(note, tags=tags)
+
+def sync(local, remote):
+    """Make the JSON stores at ``local`` and ``remote`` hold the same notes.
+
+    Returns ``(sent, received, conflicts)``: how many notes were copied to
+    ``remote``, how many from it, and how many had been edited on both sides.
+    """
+    from note.storage import JsonStore
+    if os.path.abspath(local) == os.path.abspath(remote):
+        raise ValueError("cannot sync a store with itself")
+    stores = {local: JsonStore(local), remote: JsonStore(remote)}
+    first, second = sorted(stores)  # one order, so two syncs running at once can't deadlock
+    with journal.lock(first), journal.lock(second):
+        ours, theirs = SyncIndex.open(local), SyncIndex.open(remote)
+        mark = ours.peers.get(theirs.replica)
+        if mark is not None and theirs.peers.get(ours.replica) == mark[::-1]:
+            changed_ours, changed_theirs = ours.changed_since(mark[0]), theirs.changed_since(mark[1])
+        else:
+            changed_ours, changed_theirs = set(ours.ids), set(theirs.ids)
+
+        # (nid, revision, deleted) to copy each way, and (nid, losing side) of conflicts
+        send, receive, conflicts = [], [], []
+        for nid in sorted(changed_ours | changed_theirs):
+            a, b = ours.entry(nid) or (0, None), theirs.entry(nid) or (0, None)
+            if a[1] == b[1]:
+                continue
+            if (nid in changed_ours) != (nid in changed_theirs):
+                winner = a if nid in changed_ours else b
+            elif a[1] is None or b[1] is None:
+                winner = b if a[1] is None else a  # an edit beats a delete
+            else:
+                winner = max(a, b)  # the higher revision, then the larger digest
+                conflicts.append((nid, remote if winner is a else local))
+            (send if winner is a else receive).append((nid, winner[0], winner[1] is None))
+
+        local_store, remote_store = stores[local], stores[remote]
+        notes = dict(local_store.get_many([nid for nid, _, gone in send if not gone]))
+        notes.update(remote_store.get_many([nid for nid, _, gone in receive if not gone]))
+        extra = []
+        for side in (local, remote):
+            for nid, note in stores[side].get_many([nid for nid, loser in conflicts if loser == side]):
+                if note.get('content') != notes[nid].get('content'):
+                    extra.append(_conflict_copy(nid, note))
+
+        def ops(changes, index):
+            out = []
+            for nid, rev, gone in changes:
+                if gone:
+                    out.append(dict(journal.make_op("delete", nid), rev=rev))
+                else:
+                    kind = "update" if (index.entry(nid) or (0, None))[1] is not None else "add"
+                    out.append(dict(journal.make_op(kind, nid, notes[nid]), rev=rev))
+            for nid, note in extra:
+                if (index.entry(nid) or (0, None))[1] is None:
+                    out.append(dict(journal.make_op("add", nid, note), rev=1))
+            return out
+
+        remote_store.write_ops(ops(send, theirs))
+        local_store.write_ops(ops(receive, ours))
+
+        # reopened, since an append may have compacted either store
+        ours, theirs = SyncIndex.open(local), SyncIndex.open(remote)
+        ours.peers[theirs.replica] = [ours.seq, theirs.seq]
+        theirs.peers[ours.replica] = [theirs.seq, ours.seq]
+        ours.save()
+        theirs.save()
+    return len(send), len(receive), len(conflicts)
@@ -0,0 +1,152 @@
+"""Tag index for the JSON store.
+
+Keeps, for every tag, the ids of the notes carrying it in insertion order,
+plus per-tag counts and the sorted positions of active notes, so ``note tags``
+and tag filters are answered with set operations and a bisect instead of a
+walk over every note.  Archiving or editing a note without changing its tags
+leaves the per-tag lists alone, so archiving many notes stays linear; a
+large batch of retags puts the lists it touched back in order once, at the end.
+"""
+from bisect import bisect_left, insort
+from note import journal, sidecar
+
+INDEX_SUFFIX = ".tags"
+
+class TagIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    _unsorted = None  # during a large apply_all(), tags whose id lists need sorting out
+
+    def build(self, db):
+        self.next_pos = 0
+        self.notes = {}   # nid -> [pos, archived, tags]
+        self.tags = {}    # tag -> [nid, ...] ordered by pos
+        self.counts = {}  # tag -> [notes, archived notes]
+        self.active = []  # sorted positions of active notes
+        for nid, note in db.items():
+            self._add(nid, self.next_pos, note)
+            self.next_pos += 1
+
+    def restore(self, data):
+        self.next_pos = data['next_pos']
+        self.notes = data['notes']
+        self.tags = data['tags']
+        self.counts = data['counts']
+        self.active = data['active']
+
+    def dump(self):
+        return {"next_pos": self.next_pos, "notes": self.notes, "tags": self.tags,
+                "counts": self.counts, "active": self.active}
+
+    def apply(self, op):
+        nid = op['id']
+        old = self.notes.get(nid)
+        if op['op'] == 'delete' or (op['op'] != 'add' and old is None):
+            if old is not None:
+                self._remove(nid)
+            return
+        if old is not None:
+            note = op['note']
+            if list(dict.fromkeys(note.get('tags', []))) == old[2]:
+                self._flag(nid, bool(note.get('archived', False)))
+                return
+            pos = old[0]
+            self._remove(nid)
+        else:
+            pos = self.next_pos
+            self.next_pos += 1
+        self._add(nid, pos, op['note'])
+
+    def apply_all(self, ops):
+        if len(ops) < sidecar.BATCH_OPS:
+            super().apply_all(ops)
+            return
+        # sorted once at the end rather than kept up op by op
+        self.active = None
+        self._unsorted = set()
+        try:
+            super().apply_all(ops)
+        finally:
+            self.active = sorted(pos for pos, archived, _ in self.notes.values() if not archived)
+            for tag in self._unsorted & self.tags.keys():
+                ids = [nid for nid in dict.fromkeys(self.tags[tag])
+                       if nid in self.notes and tag in self.notes[nid][2]]
+                self.tags[tag] = sorted(ids, key=lambda nid: self.notes[nid][0])
+            self._unsorted = None
+
+    def _flag(self, nid, archived):
+        entry = self.notes[nid]
+        if entry[1] == archived:
+            return
+        entry[1] = archived
+        for tag in entry[2]:
+            self.counts[tag][1] += 1 if archived else -1
+        if self.active is not None:
+            if archived:
+                del self.active[bisect_left(self.active, entry[0])]
+            else:
+                insort(self.active, entry[0])
+
+    def _add(self, nid, pos, note):
+        archived = bool(note.get('archived', False))
+        tags = list(dict.fromkeys(note.get('tags', [])))
+        self.notes[nid] = [pos, archived, tags]
+        if not archived and self.active is not None:
+            insort(self.active, pos)
+        for tag in tags:
+            ids = self.tags.setdefault(tag, [])
+            count = self.counts.setdefault(tag, [0, 0])
+            count[0] += 1
+            count[1] += archived
+            if self._unsorted is not None:
+                ids.append(nid)
+                self._unsorted.add(tag)
+                continue
+            # almost always an append; otherwise keep the list in position order
+            i = len(ids)
+            while i and self.notes[ids[i - 1]][0] > pos:
+                i -= 1
+            ids.insert(i, nid)
+
+    def _remove(self, nid):
+        pos, archived, tags = self.notes.pop(nid)
+        if not archived and self.active is not None:
+            del self.active[bisect_left(self.active, pos)]
+        for tag in tags:
+            if self._unsorted is None:
+                self.tags[tag].remove(nid)
+            else:
+                self._unsorted.add(tag)  # left in place until apply_all() ends
+            count = self.counts[tag]
+            count[0] -= 1
+            count[1] -= archived
+            if not count[0]:
+                del self.tags[tag], self.counts[tag]
+
+    def tag_counts(self):
+        """Return ``(tag, notes, archived notes)`` sorted by tag."""
+        return [(tag, n, archived) for tag, (n, archived) in sorted(self.counts.items())]
+
+    def having(self, all_of):
+        """Ids of the notes, archived or not, carrying every tag in ``all_of``."""
+        lists = sorted((self.tags.get(t, []) for t in all_of), key=len)
+        found = set(lists[0])
+        for ids in lists[1:]:
+            found.intersection_update(ids)
+        return found
+
+    def query(self, all_of=(), any_of=()):
+        """Return ``(line_number, nid)`` for active notes matching the filters."""
+        found = self.having(all_of) if all_of else None
+        if any_of:
+            either = set()
+            for tag in any_of:
+                either.update(self.tags.get(tag, ()))
+            found = either if found is None else found & either
+        rows = []
+        for nid in found or ():
+            pos, archived, _ = self.notes[nid]
+            if not archived:
+                rows.append((bisect_left(self.active, pos) + 1, nid))
+        return sorted(rows)
+
+journal.snapshot_hooks.append(TagIndex.carry_over)
@@ -0,0 +1,173 @@
+"""Timestamp index for the JSON store.
+
+Every note's timestamp is kept as epoch seconds in a sorted array per view
+(active and archived), with the note ids alongside, so date ranges --
+``note list --since/--until``, ``note --archive <days>`` and
+``note stats --by-day`` -- are a bisect and a slice instead of a parse of
+every timestamp in the store.
+
+An edit or archive move blanks the note's old entry rather than shifting the
+arrays; blanks are swept out once they make up a quarter of a view, or when
+the index is rewritten for a compacted snapshot.  A long run of ops (an
+archive run, an import) is applied in one pass.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+from heapq import merge
+from operator import itemgetter
+from note import journal, sidecar
+
+INDEX_SUFFIX = ".times"
+VIEWS = ("active", "archived")
+SWEEP_RATIO = 0.25  # blanked share of a view that triggers a sweep
+
+def epoch(timestamp):
+    """Epoch seconds for an ISO timestamp (naive ones are local time), or None."""
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+def _view(note):
+    return "archived" if note.get('archived', False) else "active"
+
+class TimeIndex(sidecar.Sidecar):
+    suffix = INDEX_SUFFIX
+    binary = True
+
+    def build(self, db):
+        entries = {view: [] for view in VIEWS}
+        for nid, note in db.items():
+            seconds = epoch(note['timestamp'])
+            if seconds is not None:  # malformed timestamps can't be placed
+                entries[_view(note)].append((seconds, nid))
+        self.epochs, self.ids, self.blank = {}, {}, {}
+        for view in VIEWS:
+            self._set(view, sorted(entries[view], key=itemgetter(0)))  # ties stay in insertion order
+
+    def restore(self, data):
+        self.epochs = {view: array('d', data['epochs'][view]) for view in VIEWS}
+        self.ids = data['ids']
+        self.blank = data['blank']
+
+    def dump(self):
+        return {"epochs": {view: self.epochs[view].tobytes() for view in VIEWS},
+                "ids": self.ids, "blank": self.blank}
+
+    def _entries(self, view):
+        return [(e, nid) for e, nid in zip(self.epochs[view], self.ids[view]) if nid is not None]
+
+    def _find(self, nid, seconds, scan=True):
+        if seconds is not None:
+            for view in VIEWS:
+                epochs, ids = self.epochs[view], self.ids[view]
+                i = bisect_left(epochs, seconds)
+                while i < len(epochs) and epochs[i] == seconds:
+                    if ids[i] == nid:
+                        return view, i
+                    i += 1
+        if scan:  # deleted, or its timestamp changed
+            for view in VIEWS:
+                try:
+                    return view, self.ids[view].index(nid)
+                except ValueError:
+                    pass
+        return None
+
+    def _blank(self, view, i):
+        self.ids[view][i] = None
+        self.blank[view] += 1
+        if self.blank[view] > len(self.ids[view]) * SWEEP_RATIO:
+            self._sweep(view)
+
+    def _sweep(self, view):
+        if self.blank[view]:
+            self._set(view, self._entries(view))
+
+    def _set(self, view, entries):
+        self.epochs[view] = array('d', (e for e, _ in entries))
+        self.ids[view] = [nid for _, nid in entries]
+        self.blank[view] = 0
+
+    def apply(self, op):
+        nid, note = op['id'], op.get('note')
+        seconds = epoch(note['timestamp']) if note else None
+        # an add is a new id unless it replaces a note with the same timestamp
+        found = self._find(nid, seconds, scan=op['op'] != 'add')
+        if found:
+            self._blank(*found)
+        if op['op'] == 'delete' or (op['op'] != 'add' and found is None) or seconds is None:
+            return
+        view = _view(note)
+        i = bisect_right(self.epochs[view], seconds)
+        self.epochs[view].insert(i, seconds)
+        self.ids[view].insert(i, nid)
+
+    def apply_all(self, ops):
+        if len(ops) < sidecar.BATCH_OPS:
+            super().apply_all(ops)
+            return
+        # One pass over the ids instead of a lookup per op, then each view
+        # takes its new entries in a single merge.
+        touched = {op['id'] for op in ops}
+        notes = {}
+        for view in VIEWS:
+            ids = self.ids[view]
+            for i, nid in enumerate(ids):
+                if nid in touched:
+                    ids[i] = None
+                    self.blank[view] += 1
+                    notes[nid] = True
+        for op in ops:
+            nid = op['id']
+            if op['op'] == 'delete':
+                notes.pop(nid, None)
+            elif op['op'] == 'add' or nid in notes:
+                notes[nid] = op['note']
+        added = {view: [] for view in VIEWS}
+        for nid, note in notes.items():
+            seconds = epoch(note['timestamp'])
+            if seconds is not None:
+                added[_view(note)].append((seconds, nid))
+        for view in VIEWS:
+            new = sorted(added[view], key=itemgetter(0))
+            if not new:
+                if self.blank[view] > len(self.ids[view]) * SWEEP_RATIO:
+                    self._sweep(view)
+                continue
+            epochs = self.epochs[view]
+            if not self.blank[view] and (not epochs or new[0][0] >= epochs[-1]):
+                epochs.extend(e for e, _ in new)  # the usual case: newer than everything
+                self.ids[view].extend(nid for _, nid in new)
+            else:
+                self._set(view, list(merge(self._entries(view), new, key=itemgetter(0))))
+
+    def rebase(self):
+        for view in VIEWS:
+            self._sweep(view)
+        super().rebase()
+
+    def between(self, view, since=None, until=None):
+        """Ids of the view's notes with ``since <= epoch < until``, oldest first."""
+        epochs = self.epochs[view]
+        lo = 0 if since is None else bisect_left(epochs, since)
+        hi = len(epochs) if until is None else bisect_left(epochs, until)
+        return [nid for nid in self.ids[view][lo:hi] if nid is not None]
+
+    def per_day(self, view, since=None, until=None):
+        """Return ``{date: notes}`` for the local days holding notes in the view."""
+        self._sweep(view)  # so counts are differences of bisects
+        epochs = self.epochs[view]
+        i = 0 if since is None else bisect_left(epochs, since)
+        end = len(epochs) if until is None else bisect_left(epochs, until)
+        days = {}
+        while i < end:
+            day = datetime.fromtimestamp(epochs[i]).date()
+            midnight = datetime.combine(day + timedelta(days=1), time()).timestamp()
+            j = min(bisect_left(epochs, midnight, i), end)
+            days[day] = j - i
+            i = j
+        return days
+
+journal.snapshot_hooks.append(TimeIndex.carry_over)
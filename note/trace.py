@@ -0,0 +1,150 @@
+"""Per-phase timing for ``note --profile`` and ``NOTE_TRACE``.
+
+Code marks the phases worth knowing about -- importing the CLI, loading the
+store, bringing an index up to date, producing rows, running fzf, appending
+to the journal -- with ``phase()`` or ``iterate()``.  Tracing is off unless
+configure() turns it on, and then every phase records its wall time, the
+bytes the process read and wrote meanwhile and, where the code says, how
+many notes it went through.  Phases nest; the same phase entered again
+under the same parent adds to one record.
+
+``--profile`` prints a table to stderr when the command ends, ``NOTE_TRACE``
+appends the same as one JSON line per command to the file it names, and
+``--profile=<file>`` also dumps a cProfile of the whole run there (read it
+with ``python -m pstats <file>``).
+
+Only the standard library is used, so client.py can time its own work.
+"""
+import atexit, contextlib, os, sys, time
+
+_records = None  # phase path -> record, once tracing is on
+_stack = []      # records of the phases we are in
+_io_file = "/proc/self/io"
+
+def enabled():
+    return _records is not None
+
+def configure(args):
+    """Strip ``--profile[=<file>]`` from ``args`` and start tracing if asked to; return the rest."""
+    global _records
+    profile = [a for a in args if a == "--profile" or a.startswith("--profile=")]
+    args = [a for a in args if a not in profile]
+    path = os.environ.get("NOTE_TRACE")
+    if not profile and not path:
+        return args
+    _records = {}
+    dump = next((a.partition("=")[2] for a in profile if "=" in a), None)
+    profiler = None
+    if dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(_finish, args, time.perf_counter(), bool(profile), path, profiler, dump)
+    return args
+
+def _io():
+    # bytes read and written by the process so far (Linux only); mmap'd
+    # files aren't counted here, so their readers call add()
+    try:
+        with open(_io_file, 'rb') as f:
+            fields = dict(line.split(b":") for line in f.read().splitlines())
+        return int(fields[b"rchar"]), int(fields[b"wchar"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _record(name):
+    path = tuple(r["phase"] for r in _stack) + (name,)
+    record = _records.get(path)
+    if record is None:
+        record = _records[path] = {"phase": name, "depth": len(_stack), "calls": 0, "ms": 0.0,
+                                   "self_ms": 0.0, "read": 0, "written": 0, "notes": None}
+    record["calls"] += 1
+    return record
+
+@contextlib.contextmanager
+def _timing(record):
+    _stack.append(record)
+    before, start = _io(), time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        after = _io()
+        _stack.pop()
+        record["ms"] += elapsed
+        record["self_ms"] += elapsed
+        if _stack:
+            _stack[-1]["self_ms"] -= elapsed
+        if before and after:
+            record["read"] += after[0] - before[0]
+            record["written"] += after[1] - before[1]
+
+@contextlib.contextmanager
+def phase(name):
+    """Time the block as phase ``name``; it gets a dict to count() notes into."""
+    if _records is None:
+        yield {}
+        return
+    record = _record(name)
+    with _timing(record):
+        yield record
+
+def count(record, notes):
+    if "notes" in record:
+        record["notes"] = (record["notes"] or 0) + notes
+
+def add(read=0, written=0):
+    """Charge I/O the process counters don't see to the phases we are in."""
+    for record in _stack:
+        record["read"] += read
+        record["written"] += written
+
+def iterate(name, items):
+    """Yield from ``items``, charging the time spent producing each item to phase ``name``."""
+    if _records is None:
+        return items
+    return _iterate(_record(name), iter(items))
+
+def _iterate(record, it):
+    count(record, 0)
+    while True:
+        with _timing(record):
+            item = next(it, _iterate)
+        if item is _iterate:
+            return
+        record["notes"] += 1
+        yield item
+
+def _size(n):
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+def _finish(args, start, table, path, profiler, dump):
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(dump)
+    total = (time.perf_counter() - start) * 1000
+    records = list(_records.values())
+    if table:
+        print(f"{'phase':<24} {'calls':>5} {'ms':>10} {'self ms':>10} {'read':>9} {'written':>9} {'notes':>8}",
+              file=sys.stderr)
+        for r in records:
+            name = "  " * r["depth"] + r["phase"]
+            notes = "" if r["notes"] is None else r["notes"]
+            print(f"{name:<24} {r['calls']:>5} {r['ms']:>10.1f} {r['self_ms']:>10.1f} "
+                  f"{_size(r['read']):>9} {_size(r['written']):>9} {notes:>8}", file=sys.stderr)
+        print(f"{'total':<24} {'':>5} {total:>10.1f}", file=sys.stderr)
+        if dump:
+            print(f"cProfile written to {dump}", file=sys.stderr)
+    if path:
+        import json
+        from datetime import datetime
+        phases = [dict(r, ms=round(r["ms"], 3), self_ms=round(r["self_ms"], 3)) for r in records]
+        line = {"time": datetime.now().isoformat(), "argv": args, "pid": os.getpid(),
+                "ms": round(total, 3), "phases": phases}
+        with contextlib.suppress(OSError):
+            with open(path, 'a') as f:
+                f.write(json.dumps(line) + "\n")
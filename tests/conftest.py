@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "notes.json")
+
+@pytest.fixture
+def make_note():
+    def make(content, timestamp="2025-01-01T00:00:00", tags=(), archived=False):
+        return {"timestamp": timestamp, "content": content, "tags": list(tags),
+                "archived": archived, "archived_at": None}
+    return make
@@ -0,0 +1,64 @@
+import os
+import pytest
+from note import backups, blobs
+from note.model import with_defaults
+from note.storage import JsonStore
+
+BIG = "a large note\n" + "lorem ipsum " * (blobs.BLOB_MIN_BYTES // 12)
+
+def current(store):
+    return {nid: with_defaults(dict(note)) for nid, note in store.iter_notes(include_archived=True)}
+
+def packs(directory):
+    return sorted(os.listdir(os.path.join(directory, "packs")))
+
+@pytest.fixture(autouse=True)
+def small_pieces(monkeypatch):
+    # so a snapshot's list of notes spans several pieces
+    monkeypatch.setattr(backups, "PIECE_NOTES", 8)
+    monkeypatch.setattr(backups, "PIECE_MAX", 32)
+
+def test_backup_prune_restore_round_trip(tmp_path, db_path, make_note):
+    directory = str(tmp_path / "backups")
+    store = JsonStore(db_path)
+    store.add_many([(f"{i:08x}", make_note(f"note {i}", tags=[f"t{i % 3}"], archived=i % 10 == 0))
+                    for i in range(100)])
+    store.add("big", make_note(BIG))
+    snapshots = []
+    def snapshot():
+        saved = backups.backup(store.iter_notes(include_archived=True), directory)
+        snapshots.append((saved["id"], current(store)))
+
+    snapshot()
+    # most of the first pack's notes go out of date, so pruning rewrites it
+    store.update_many([(f"{i:08x}", make_note(f"note {i}, edited")) for i in range(0, 100, 2)])
+    for i in range(1, 30, 2):
+        store.delete(f"{i:08x}")
+    store.add("new", make_note("added later"))
+    snapshot()
+    store.delete("big")
+    store.update("new", make_note("added later, edited"))
+    snapshot()
+    assert [snapshot_id for snapshot_id, _ in snapshots] == backups.snapshot_ids(directory)
+
+    before = packs(directory)
+    assert backups.prune(directory, keep=2)[0] == 1
+    assert packs(directory) != before
+    assert backups.snapshot_ids(directory) == [snapshot_id for snapshot_id, _ in snapshots[1:]]
+    with pytest.raises(ValueError):
+        backups.restore(directory, snapshots[0][0])
+    for snapshot_id, expected in snapshots[1:]:
+        assert backups.restore(directory, snapshot_id) == expected
+    assert backups.find_note(directory, "big", snapshots[1][0])['content'] == BIG
+    assert backups.find_note(directory, "big") is None
+
+    # nothing changed since the last snapshot: no new chunks, even after a rewrite
+    after = packs(directory)
+    assert backups.backup(store.iter_notes(include_archived=True), directory)["chunks"] == 0
+    assert packs(directory) == after
+
+    snapshot_id, expected = snapshots[1]
+    store.replace(backups.restore(directory, snapshot_id))
+    store = JsonStore(db_path)
+    assert current(store) == expected
+    assert blobs.is_blob(store.get("big", inline=False))
@@ -0,0 +1,80 @@
+import gzip, os
+import pytest
+from note import blobs, cli
+from note.storage import JsonStore
+
+BIG = "needle in a haystack\n" + "hay " * (blobs.BLOB_MIN_BYTES // 4)
+
+@pytest.fixture
+def store(db_path, make_note, monkeypatch):
+    store = JsonStore(db_path)
+    store.add("a", make_note(BIG))
+    store.add("b", make_note("small note"))
+    monkeypatch.setattr(cli, "get_store", lambda: store)
+    return store
+
+def blob_file(store):
+    return blobs.blob_path(store.path, store.get("a", inline=False)['blob'])
+
+def missing(path):
+    os.remove(path)
+
+def truncated(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+def garbage(path):
+    with open(path, 'wb') as f:
+        f.write(b"not gzip at all")
+
+def flipped(path):
+    # a valid header and trailer around a damaged stream
+    data = bytearray(gzip.compress(BIG.encode()))
+    data[len(data) // 2] ^= 0xff
+    with open(path, 'wb') as f:
+        f.write(bytes(data))
+
+def test_large_note_round_trips_through_blob(store):
+    note = store.get("a", inline=False)
+    assert blobs.is_blob(note)
+    assert len(note['content']) == blobs.BLOB_PREVIEW
+    assert os.path.exists(blob_file(store))
+    assert store.get("a")['content'] == BIG
+    with store.open_content(note) as f:
+        assert f.read().decode() == BIG
+
+@pytest.mark.parametrize("damage", [missing, truncated, garbage, flipped])
+def test_unreadable_blob_is_never_read_as_the_preview(store, damage, capsys):
+    damage(blob_file(store))
+    with pytest.raises(blobs.BlobError):
+        store.get("a")
+    note = store.get("a", inline=False)
+    with pytest.raises(blobs.BlobError):
+        with store.open_content(note) as f:
+            f.read()
+    # the indexes settle for the preview
+    assert blobs.content(store.path, note, partial=True) == BIG[:blobs.BLOB_PREVIEW]
+    assert [nid for _, nid, _, _ in store.search("needle")] == ["a"]
+    assert store.get("b")['content'] == "small note"
+
+    cli.append_note(1, "more")
+    assert "can't be read" in capsys.readouterr().out
+    assert store.get("a", inline=False)['blob'] == note['blob']
+    assert store.get("a", inline=False)['content'] == note['content']
+
+    cli.print_content(note)
+    out = capsys.readouterr().out
+    assert "can't be read" in out
+    assert "Traceback" not in out
+
+@pytest.mark.parametrize("damage", [missing, garbage])
+def test_note_with_unreadable_blob_can_be_deleted(store, damage, monkeypatch, capsys):
+    damage(blob_file(store))
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    monkeypatch.setattr("sys.argv", ["note", "del", "1"])
+    cli.main()
+    assert "Deleted note 1" in capsys.readouterr().out
+    assert store.get("a", inline=False) is None
+    assert store.get("b")['content'] == "small note"
@@ -0,0 +1,106 @@
+import json, os, tarfile
+import pytest
+from note import blobs, cli
+from note.model import with_defaults
+from note.storage import JsonStore
+
+BIG = "a large note\n" + "lorem ipsum " * (blobs.BLOB_MIN_BYTES // 12)
+
+def corpus(make_note):
+    notes = []
+    for i in range(40):
+        note = make_note(f"note {i}: " + ("deploy failed" if i % 3 == 0 else "lunch order"),
+                         timestamp=f"2025-02-{1 + i % 28:02d}T09:{i:02d}:00",
+                         tags=[t for t, every in (("infra", 2), ("urgent", 5)) if i % every == 0],
+                         archived=i % 7 == 0)
+        if note['archived']:
+            note['archived_at'] = "2025-03-01T00:00:00"
+        notes.append((f"{i:08x}", note))
+    notes.append(("big", make_note(BIG, tags=["infra"])))
+    return notes
+
+def current(store):
+    return {nid: with_defaults(dict(note)) for nid, note in store.iter_notes(include_archived=True)}
+
+@pytest.fixture
+def stores(tmp_path, make_note, monkeypatch):
+    """A full store to export from, an empty one to import into, and ``note`` to run against either."""
+    source, target = JsonStore(str(tmp_path / "source.json")), JsonStore(str(tmp_path / "target.json"))
+    source.add_many(corpus(make_note))
+    def note(store, *args):
+        monkeypatch.setattr(cli, "get_store", lambda: store)
+        monkeypatch.setattr("sys.argv", ["note", *args])
+        cli.main()
+    return source, target, note
+
+def test_jsonl_round_trip(stores, tmp_path, capsys):
+    source, target, note = stores
+    dest = str(tmp_path / "all.jsonl")
+    note(source, "export", "--all", dest)
+    assert f"Exported 41 note(s) to {dest}" in capsys.readouterr().out
+    note(target, "import", dest)
+    assert "Imported 41 note(s)" in capsys.readouterr().out
+    # ids, times, tags, archived flags and blobs all come back as they were
+    assert current(target) == current(source)
+    assert 'blob' in target.get("big", inline=False)
+
+@pytest.mark.parametrize("dest", ["notes/", "notes.tar", "notes.tgz"])
+def test_file_round_trip(stores, tmp_path, capsys, dest):
+    source, target, note = stores
+    dest = os.path.join(str(tmp_path), dest)
+    note(source, "export", "--all", dest)
+    if dest.endswith(os.sep):
+        assert len(os.listdir(dest)) == 41
+    else:
+        with tarfile.open(dest) as archive:
+            assert len(archive.getnames()) == 41
+            archive.extractall(str(tmp_path / "extracted"))
+        dest = str(tmp_path / "extracted")
+    note(target, "import", dest, "--tags", "Imported")
+    assert "Imported 41 note(s)" in capsys.readouterr().out
+    # plain files keep only the content; ids and times are new
+    assert sorted(n['content'] for _, n in target.iter_notes()) == \
+           sorted(n['content'] for _, n in source.iter_notes(include_archived=True))
+    assert {tuple(n['tags']) for _, n in target.iter_notes()} == {("imported",)}
+
+def test_duplicates_are_skipped_by_content(stores, tmp_path, capsys):
+    source, target, note = stores
+    dest = str(tmp_path / "all.jsonl")
+    note(source, "export", "--all", dest)
+    capsys.readouterr()
+    with open(dest, 'a', encoding='utf-8') as f:
+        # the same contents under new ids, a repeat within this import, and one new note
+        f.write(json.dumps({"id": "other", "content": "note 3: deploy failed", "tags": ["x"]}) + "\n")
+        f.write(json.dumps({"content": BIG}) + "\n")
+        f.write(json.dumps("brand new") + "\n")
+        f.write(json.dumps("brand new") + "\n")
+    (tmp_path / "plain.txt").write_text("note 4: lunch order")
+
+    note(target, "import", dest, str(tmp_path / "plain.txt"))
+    out = capsys.readouterr().out
+    assert "Imported 42 note(s)" in out and "skipped 4 duplicate(s)" in out
+    before = current(target)
+    note(target, "import", dest, str(tmp_path / "plain.txt"))
+    out = capsys.readouterr().out
+    assert "Imported 0 note(s)" in out and "skipped 46 duplicate(s)" in out
+    assert current(target) == before
+    assert "other" not in before
+
+EXPORTS = [(["--tag", "urgent"], lambda nid, n: "urgent" in n['tags'] and not n['archived']),
+           (["--tag", "Infra", "--all"], lambda nid, n: "infra" in n['tags']),
+           (["--search", "deploy"], lambda nid, n: "deploy" in n['content'] and not n['archived']),
+           (["--search", "ploy", "--archive"], lambda nid, n: "ploy" in n['content'] and n['archived']),
+           (["--search", "deploy OR lunch", "--tag", "urgent"],
+            lambda nid, n: "urgent" in n['tags'] and not n['archived']),
+           (["--search", "lorem", "--tag", "infra", "--since", "2025-01-01"], lambda nid, n: nid == "big"),
+           (["--tag", "missing"], lambda nid, n: False)]
+
+@pytest.mark.parametrize("args, wanted", EXPORTS)
+def test_export_filters(stores, tmp_path, make_note, args, wanted):
+    source, _, note = stores
+    dest = str(tmp_path / "some.jsonl")
+    note(source, "export", *args, dest)
+    with open(dest, encoding='utf-8') as f:
+        exported = [json.loads(line) for line in f]
+    assert [r['id'] for r in exported] == [nid for nid, n in corpus(make_note) if wanted(nid, n)]
+    assert all(r['content'] == source.get(r['id'])['content'] for r in exported)
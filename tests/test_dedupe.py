@@ -0,0 +1,45 @@
+import random
+import pytest
+from note import compat, dedupe
+
+def texts():
+    rnd = random.Random(7)
+    words = ["deploy", "nginx", "timeout", "héllo", "日本", "error", "retry", "ok"]
+    out = [b"", b"a", b"abcd", b"abcde", b"abcdef", dedupe.normalize("Ünïcode  \n text")]
+    for _ in range(300):
+        out.append(dedupe.normalize(" ".join(rnd.choices(words, k=rnd.randint(1, 400)))))
+    # longer than a whole NumPy batch, on its own and straddling two
+    out.append(dedupe.normalize(" ".join(rnd.choices(words, k=dedupe.HASH_BATCH // 4))))
+    out += out[10:20]
+    return out
+
+@pytest.fixture
+def pure_python(monkeypatch):
+    monkeypatch.setattr(compat, "numpy", lambda: None)
+
+def test_signatures_same_with_and_without_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    data = texts()
+    with_numpy = dedupe.signatures(data)
+    monkeypatch.setattr(compat, "numpy", lambda: None)
+    assert dedupe.signatures(data) == with_numpy
+    assert [sig for sig, text in zip(with_numpy, data) if not text] == [b""]
+
+def test_clusters_same_with_and_without_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    rnd = random.Random(3)
+    vocabulary = ["".join(rnd.choices("abcdefghij", k=5)) for _ in range(500)]
+    base = [" ".join(rnd.choices(vocabulary, k=60)) for _ in range(40)]
+    notes = base + [text + " extra" for text in base[::2]] + base[:5] + [""]
+    sigs = dedupe.signatures([dedupe.normalize(text) for text in notes])
+    with_numpy = dedupe.clusters(sigs)
+    assert len(with_numpy) >= 20
+    monkeypatch.setattr(compat, "numpy", lambda: None)
+    assert dedupe.clusters(sigs) == with_numpy
+
+def test_near_duplicates_cluster(pure_python):
+    a = "the deploy failed with a timeout while nginx was reloading its config"
+    notes = [a, a + " again", "something else entirely, about lunch", a.upper(), ""]
+    sigs = dedupe.signatures([dedupe.normalize(text) for text in notes])
+    assert dedupe.clusters(sigs) == [[0, 1, 3]]
+    assert dedupe.similarity(sigs[0], sigs[3]) == 1
@@ -0,0 +1,64 @@
+import os
+from note import journal
+from note.storage import JsonStore
+
+def notes(db_path):
+    return {nid: note['content'] for nid, note in journal.load(db_path).items()}
+
+def test_replay_ignores_torn_last_line(db_path, make_note):
+    JsonStore(db_path).add("a", make_note("one"))
+    with open(journal.journal_path(db_path), 'ab') as f:
+        f.write(b'{"op": "add", "id": "b", "no')
+    assert notes(db_path) == {"a": "one"}
+
+def test_append_after_torn_line(db_path, make_note):
+    JsonStore(db_path).add("a", make_note("one"))
+    with open(journal.journal_path(db_path), 'ab') as f:
+        f.write(b'{"op": "add", "id": "b", "no')
+    JsonStore(db_path).add("c", make_note("three"))
+    assert notes(db_path) == {"a": "one", "c": "three"}
+    with open(journal.journal_path(db_path), 'rb') as f:
+        assert f.read().endswith(b"}\n")
+
+def test_journal_replayed_again_after_compaction_crash(db_path, make_note):
+    store = JsonStore(db_path)
+    store.add("a", make_note("one"))
+    store.add("b", make_note("two"))
+    store.update("a", make_note("one, edited"))
+    store.delete("b")
+    expected = notes(db_path)
+    # the new snapshot is in place, but the journal was never truncated
+    journal.write_snapshot(db_path, journal.load(db_path))
+    assert os.path.getsize(journal.journal_path(db_path)) > 0
+    assert notes(db_path) == expected
+    journal.compact(db_path)
+    assert os.path.getsize(journal.journal_path(db_path)) == 0
+    assert notes(db_path) == expected
+
+def test_leftover_temporary_snapshot_is_ignored(db_path, make_note):
+    JsonStore(db_path).add("a", make_note("one"))
+    journal.compact(db_path)
+    with open(db_path + ".tmp", 'w') as f:
+        f.write('{\n  "a": {"timestamp": "2025')
+    assert notes(db_path) == {"a": "one"}
+    JsonStore(db_path).add("b", make_note("two"))
+    journal.compact(db_path)
+    assert notes(db_path) == {"a": "one", "b": "two"}
+
+def test_compaction_on_size_keeps_every_note(db_path, make_note, monkeypatch):
+    monkeypatch.setattr(journal, "COMPACT_MIN_BYTES", 2000)
+    store = JsonStore(db_path)
+    expected = {}
+    for i in range(200):
+        nid = f"{i:08x}"
+        store.add(nid, make_note(f"note {i}"))
+        expected[nid] = f"note {i}"
+        if i % 3 == 0:
+            store.update(nid, make_note(f"note {i} edited"))
+            expected[nid] = f"note {i} edited"
+        if i % 7 == 0:
+            store.delete(nid)
+            del expected[nid]
+    assert os.path.getsize(journal.journal_path(db_path)) < 3000  # compacted along the way
+    assert notes(db_path) == expected
+    assert list(notes(db_path)) == list(expected)  # insertion order survives
@@ -0,0 +1,70 @@
+import os
+import pytest
+from note import cli, journal, quick
+from note.blobs import BLOB_MIN_BYTES
+from note.storage import JsonStore
+
+def seed(path, make_note):
+    store = JsonStore(path)
+    store.add_many([(f"{i:08x}", make_note(f"note {i} standup", timestamp=f"2025-01-{1 + i:02d}T12:00:00",
+                                           tags=["work"] if i % 2 else [], archived=i == 3))
+                    for i in range(8)])
+    views(path)  # the sidecars are on disk and have to catch up with the add
+    return path
+
+def views(path):
+    """What a later command sees, with ids and times left out."""
+    store = JsonStore(path)
+    def note(nid):
+        found = store.get(nid)
+        return found['content'], found['tags']
+    rows = store.rows()
+    return {
+        "rows": [(idx, tags, preview) for idx, _, _, tags, preview in rows],
+        "listing": [(idx, tags, preview) for idx, _, _, _, tags, preview in store.listing(reverse=True)],
+        "nth": [note(store.nth(idx)) for idx in range(1, len(rows) + 1)],
+        "search": [(idx, note(nid)) for idx, nid, *_ in store.search("stand")],
+        "ranked": [(idx, note(nid)) for idx, nid, *_ in store.ranked("standup")],
+        "tagged": [(idx, note(nid)) for idx, nid, *_ in store.tagged(all_of=["work"])],
+        "tags": store.tag_counts(),
+    }
+
+@pytest.fixture
+def quick_db(tmp_path, make_note, monkeypatch):
+    path = seed(str(tmp_path / "quick.json"), make_note)
+    monkeypatch.setattr(quick, "DB_PATH", path)
+    monkeypatch.setattr(quick, "BACKEND", "json")
+    return path
+
+def test_quick_add_matches_note_add(quick_db, tmp_path, make_note, monkeypatch, capsys):
+    cli_db = seed(str(tmp_path / "cli.json"), make_note)
+    monkeypatch.setattr(cli, "get_store", lambda: JsonStore(cli_db))
+    assert quick.add(["quick", "standup", "notes", "--tags", "Work", "Later"])
+    cli.add_note("quick standup notes", tags=["work", "later"])
+    assert capsys.readouterr().out.count("Note saved with ID") == 2
+
+    # both append the same op to the journal...
+    (quick_op,), (cli_op,) = (journal.read_ops(path)[-1:] for path in (quick_db, cli_db))
+    assert (quick_op['op'], quick_op['note']['content'], quick_op['note']['tags']) == \
+           (cli_op['op'], cli_op['note']['content'], cli_op['note']['tags'])
+    # ...so every index catches up with it the same way
+    assert views(quick_db) == views(cli_db)
+    assert views(quick_db)["tagged"][-1] == (8, ("quick standup notes", ["work", "later"]))
+
+def test_quick_add_leaves_the_rest_to_the_cli(quick_db, monkeypatch):
+    before = journal.read_ops(quick_db)
+    assert not quick.add(["x" * (BLOB_MIN_BYTES // 4)])  # may need a blob
+    monkeypatch.setattr(journal, "needs_compaction", lambda db_path, size: True)
+    assert not quick.add(["due", "for", "compaction"])
+    monkeypatch.setattr(quick, "BACKEND", "sqlite")
+    assert not quick.add(["not", "json"])
+    assert journal.read_ops(quick_db) == before
+
+def test_quick_add_skips_ids_in_use(quick_db, monkeypatch, capsys):
+    drawn = iter([bytes.fromhex("00000002"), bytes.fromhex("00000005"), bytes.fromhex("0000abcd")])
+    monkeypatch.setattr(os, "urandom", lambda n: next(drawn))
+    assert quick.add(["fresh"])
+    assert "Note saved with ID 0000abcd" in capsys.readouterr().out
+    notes = journal.load(quick_db)
+    assert notes["00000002"]['content'] == "note 2 standup"
+    assert notes["0000abcd"]['content'] == "fresh"
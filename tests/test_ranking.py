@@ -0,0 +1,66 @@
+import math
+from datetime import datetime, timedelta
+import pytest
+from note import compat, search_index
+from note.sqlite_store import SqliteStore
+from note.storage import JsonStore
+
+OLD = "2020-01-01T00:00:00"  # old enough that the recency boost is nothing
+
+NOTES = [
+    ("n1", "nginx nginx nginx config", OLD, []),
+    ("n2", "nginx restart", OLD, []),
+    ("n3", "nginx " + "filler " * 30, OLD, []),
+    ("n4", "apache config", OLD, []),
+    ("n5", "nginx reload", OLD, ["Nginx"]),
+    ("n6", "deploy script for nginx", OLD, []),
+    ("n7", "deployment checklist", OLD, []),
+    ("n8", "deployed apache", OLD, []),
+    ("n9", "nginx upgrade today", None, []),
+    ("n10", "lunch", OLD, ["ops"]),
+]
+
+@pytest.fixture(params=["json", "json-python", "sqlite"])
+def store(request, tmp_path, db_path, make_note, monkeypatch):
+    if request.param == "json-python":
+        monkeypatch.setattr(compat, "numpy", lambda: None)
+    store = JsonStore(db_path) if request.param.startswith("json") else SqliteStore(str(tmp_path / "notes.sqlite"))
+    recent = (datetime.now() - timedelta(days=1)).isoformat()
+    store.add_many([(nid, make_note(content, timestamp=ts or recent, tags=tags)) for nid, content, ts, tags in NOTES])
+    return store
+
+def ranked(store, query, top=10):
+    return [nid for _, nid, _, _, _ in store.ranked(query, top)]
+
+@pytest.mark.parametrize("query, order", [
+    # tagged nginx, then written yesterday, then three times nginx; the long note last
+    ("nginx", ["n5", "n9", "n1", "n2", "n6", "n3"]),
+    ("NGINX config", ["n1"]),
+    ("deploy", ["n6"]),
+    # every word a prefix stands for is as rare; shorter notes first, ties in insertion order
+    ("deploy*", ["n7", "n8", "n6"]),
+    # restart is rarer than apache
+    ("apache OR restart", ["n2", "n4", "n8"]),
+    ("ops", []),  # a tag alone doesn't match
+    ("ngin", []),  # nor does part of a word
+])
+def test_ranking_order(store, query, order):
+    assert ranked(store, query) == order
+
+def test_top_k(store):
+    assert ranked(store, "nginx", top=3) == ["n5", "n9", "n1"]
+    assert ranked(store, "nginx", top=0) == []
+
+def test_scores(store):
+    scores = {nid: score for _, nid, _, _, score in store.ranked("nginx")}
+    live, df = len(NOTES), 6
+    lengths = [len(search_index.tokenize(content)) for _, content, _, _ in NOTES]
+    avgdl = sum(lengths) / live
+    idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+    def bm25(tf, length):
+        return idf * tf * (search_index.K1 + 1) / (tf + search_index.K1 * (1 - search_index.B + search_index.B * length / avgdl))
+    assert scores["n1"] == pytest.approx(bm25(3, 4))
+    assert scores["n2"] == pytest.approx(bm25(1, 2))
+    assert scores["n5"] == pytest.approx(bm25(1, 2) * (1 + search_index.TAG_BOOST))
+    recency = 1 + search_index.RECENCY_BOOST * 0.5 ** (1 / search_index.HALF_LIFE_DAYS)
+    assert scores["n9"] == pytest.approx(bm25(1, 3) * recency, rel=1e-4)
@@ -0,0 +1,70 @@
+import os, random
+import pytest
+from note import cli, scan
+from note.storage import JsonStore
+
+WORDS = ["nginx", "error", "deploy", "timeout", "GET", "/api/v1", "200", "500", "warn", "xyz"]
+QUERIES = [(r"error \d+", False), ("nginx.*timeout", False), ("x*", False), ("^", False), ("^$|warn", False),
+           ("ngxtmo", True), ("dply 500", True)]
+
+@pytest.fixture
+def store(db_path, make_note, monkeypatch):
+    rnd = random.Random(7)
+    store = JsonStore(db_path)
+    store.add_many([(f"{i:08x}", make_note(
+        "\n".join(" ".join(rnd.choices(WORDS, k=rnd.randint(0, 20))) for _ in range(rnd.randint(1, 60))),
+        timestamp=f"2025-01-01T{i // 60:02d}:{i % 60:02d}:00", archived=i % 5 == 0))
+        for i in range(300)])
+    monkeypatch.setattr(cli, "get_store", lambda: store)
+    return store
+
+def chunked(monkeypatch, parallel):
+    """Scan in chunks of a few notes, on a pool of four workers or in this process."""
+    monkeypatch.setattr(scan, "CHUNK_BYTES", 4000)
+    monkeypatch.setattr(scan, "PARALLEL_MIN_BYTES", 10000 if parallel else 1 << 40)
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    pools = []
+    real = scan._parallel
+    def counted(*args):
+        pools.append(args)
+        return real(*args)
+    monkeypatch.setattr(scan, "_parallel", counted)
+    return pools
+
+def hits(store, query, fuzzy, only_archived=False):
+    notes = ((idx, nid, note['timestamp'], note['content'])
+             for idx, (nid, note) in enumerate(store.iter_notes(only_archived=only_archived), start=1))
+    return list(scan.search(notes, query, fuzzy=fuzzy, context=1))
+
+@pytest.mark.parametrize("query, fuzzy", QUERIES)
+def test_parallel_scan_matches_one_process(store, monkeypatch, query, fuzzy):
+    whole = hits(store, query, fuzzy)  # one chunk, in this process
+    chunked(monkeypatch, parallel=False)
+    serial = hits(store, query, fuzzy)
+    pools = chunked(monkeypatch, parallel=True)
+    assert hits(store, query, fuzzy) == serial
+    assert len(pools) == 1
+    # chunks only change the order: hits are ranked within each chunk
+    assert sorted(serial, key=lambda hit: hit[1]) == sorted(whole, key=lambda hit: hit[1])
+    if query == "^":
+        assert not whole  # only empty matches, which don't count
+    elif query == "x*":
+        # only the non-empty matches, one per x
+        assert whole and all(hit[4] == store.get(hit[2])['content'].count("x") for hit in whole)
+
+@pytest.mark.parametrize("query, fuzzy", QUERIES)
+def test_parallel_scan_with_archive(store, monkeypatch, capsys, query, fuzzy):
+    chunked(monkeypatch, parallel=False)
+    cli.scan_notes(query, fuzzy=fuzzy, include_archive=True)
+    serial = capsys.readouterr().out
+    pools = chunked(monkeypatch, parallel=True)
+    cli.scan_notes(query, fuzzy=fuzzy, include_archive=True)
+    assert capsys.readouterr().out == serial
+    assert len(pools) == 2  # the active view, then the archived one
+    if query == "^":
+        assert serial == "No notes found matching '^'.\n"
+    else:
+        assert "Archived:" in serial
+        archived = serial[serial.index("Archived:"):]
+        assert {nid for *_, nid, _, _, _ in hits(store, query, fuzzy, only_archived=True)} == \
+               {nid for nid in (f"{i:08x}" for i in range(0, 300, 5)) if nid in archived}
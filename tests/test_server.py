@@ -0,0 +1,60 @@
+import os, signal, subprocess, sys, threading, time
+import pytest
+from note import client, journal
+
+WRITERS, ADDS = 20, 30
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    env = dict(os.environ, HOME=str(tmp_path), PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env.pop("NOTE_BACKEND", None)
+    proc = subprocess.Popen([sys.executable, "-m", "note.client", "--serve"], env=env, cwd=str(tmp_path),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    socket_path = str(tmp_path / ".notes_db.sock")
+    monkeypatch.setattr(client, "SOCKET_PATH", socket_path)
+    deadline = time.time() + 30
+    while not os.path.exists(socket_path):
+        assert proc.poll() is None, proc.stderr.read().decode()
+        assert time.time() < deadline, "the server didn't start"
+        time.sleep(0.05)
+    yield str(tmp_path / ".notes_db.json")
+    proc.send_signal(signal.SIGTERM)
+    proc.wait(timeout=30)
+
+def run(*args):
+    reply = client.request("run", os.getcwd(), *args)
+    assert reply is not None
+    return reply.decode()
+
+def test_concurrent_writers(server):
+    assert "Note saved" in run("shared")
+    # a reply only comes once its write is in the journal
+    assert [note['content'] for note in journal.load(server).values()] == ["shared"]
+    failures = []
+    def writer(w):
+        try:
+            for i in range(ADDS):
+                assert "Note saved" in run(f"writer {w} note {i}", "--tags", f"w{w}")
+                if i % 3 == 0:
+                    assert "Appended" in run("append", "1", f"w{w}-{i}")
+        except AssertionError as e:
+            failures.append(e)
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not failures, failures[0]
+
+    notes = list(journal.load(server).values())
+    assert len(notes) == 1 + WRITERS * ADDS
+    shared, *added = notes
+    appended = shared['content'].split("\n")[1:]
+    assert len(appended) == WRITERS * len(range(0, ADDS, 3))
+    for w in range(WRITERS):
+        # each writer's notes and appends land in the order it sent them
+        assert [n['content'] for n in added if n['tags'] == [f"w{w}"]] == [f"writer {w} note {i}" for i in range(ADDS)]
+        assert [line for line in appended if line.startswith(f"w{w}-")] == [f"w{w}-{i}" for i in range(0, ADDS, 3)]
+    # and the server's own answers agree with the files
+    assert run("list").count("\n") >= 1 + WRITERS * ADDS
+    assert f"writer {WRITERS - 1} note {ADDS - 1}" in run("search", "writer", str(WRITERS - 1))
@@ -0,0 +1,74 @@
+import os, shutil
+import pytest
+from note import journal, sidecar
+from note.dedupe import MinHashIndex
+from note.meta_index import MetaIndex
+from note.ordinal_index import OrdinalIndex
+from note.search_index import SearchIndex
+from note.storage import JsonStore
+from note.tag_index import TagIndex
+from note.time_index import TimeIndex
+
+INDEXES = [MetaIndex, OrdinalIndex, SearchIndex, TagIndex, TimeIndex, MinHashIndex]
+WORDS = "alpha beta gamma delta nginx deploy".split()
+
+def answers(store):
+    return {
+        "rows": store.rows(include_archived=True),
+        "archived": store.rows(only_archived=True),
+        "nth": [store.nth(i) for i in range(1, store.count() + 2)],
+        "tags": store.tags(),
+        "tag_counts": store.tag_counts(),
+        "tagged": store.tagged(any_of=["red", "blue"]),
+        "range": list(store.listing(since="2025-02-01T00:00:00", until="2025-06-01T00:00:00")),
+        "days": store.day_counts(),
+        "search": store.search("alpha"),
+        "ranked": [hit[:4] + (round(hit[4], 6),) for hit in store.ranked("alpha OR nginx", 5)],
+        "minhashes": store.minhashes(),
+    }
+
+def change(store, make_note, start, count):
+    for i in range(start, start + count):
+        nid = f"{i:08x}"
+        text = " ".join(WORDS[(i * k) % len(WORDS)] for k in range(1, 2 + i % 5))
+        store.add(nid, make_note(text, f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00",
+                                 tags=[("red", "blue", "green")[i % 3]]))
+        if i % 4 == 0:
+            store.update(nid, make_note(text + " edited", f"2025-{1 + i % 12:02d}-01T00:00:00", tags=["blue"]))
+        if i % 5 == 0:
+            note = store.get(nid)
+            note["archived"] = True
+            store.update(nid, note)
+        if i % 9 == 0:
+            store.delete(f"{i - 3:08x}")
+
+def test_sidecars_catch_up_after_carry_over(db_path, make_note, monkeypatch, tmp_path):
+    store = JsonStore(db_path)
+    change(store, make_note, 10, 40)
+    answers(store)  # builds every index
+    change(store, make_note, 50, 20)
+    answers(JsonStore(db_path))  # each catches up on the journal tail
+
+    journal.compact(db_path)
+    for cls in INDEXES:
+        data = sidecar.read(db_path + cls.suffix, db_path, cls.binary)
+        assert data is not None, cls.__name__  # carried over to the new snapshot
+        assert data["journal"] == 0
+
+    change(store, make_note, 70, 20)
+    def no_rebuild(self):
+        pytest.fail(f"{type(self).__name__} was rebuilt instead of catching up")
+    with monkeypatch.context() as m:
+        m.setattr(sidecar.Sidecar, "rebuild", no_rebuild)
+        m.setattr(OrdinalIndex, "rebuild", no_rebuild)
+        caught_up = answers(JsonStore(db_path))
+
+    # the same store without any index files builds each from scratch
+    fresh = str(tmp_path / "fresh")
+    os.mkdir(fresh)
+    base = os.path.basename(db_path)
+    for name in os.listdir(os.path.dirname(db_path)):
+        if name.startswith(base) and not name.startswith(tuple(base + cls.suffix for cls in INDEXES)):
+            shutil.copy(os.path.join(os.path.dirname(db_path), name), fresh)
+    assert all(caught_up.values())
+    assert caught_up == answers(JsonStore(os.path.join(fresh, base)))
@@ -0,0 +1,113 @@
+import pytest
+from note import cli, journal
+from note.sqlite_store import SqliteStore
+from note.storage import JsonStore
+
+WORDS = ["nginx", "deploy", "rollback", "timeout", "ssl", "cert", "backup", "lunch"]
+
+def corpus(make_note):
+    notes = []
+    for i in range(40):
+        words = [WORDS[(i * k) % len(WORDS)] for k in range(1, 2 + i % 5)]
+        notes.append((f"{i:08x}", make_note(f"note {i}: " + " ".join(words),
+                                            timestamp=f"2025-01-{1 + i % 20:02d}T{i % 24:02d}:00:00",
+                                            tags=[WORDS[i % 3], "Ops"] if i % 4 else [])))
+    return notes
+
+def change(store, make_note):
+    notes = dict(corpus(make_note))
+    for i in range(0, 40, 6):
+        nid = f"{i:08x}"
+        store.update(nid, dict(notes[nid], archived=True, archived_at="2025-02-01T00:00:00"))
+    for i in (3, 17, 29):
+        store.delete(f"{i:08x}")
+    store.update(f"{5:08x}", dict(notes[f"{5:08x}"], content="rewritten about nginx ssl certs"))
+    store.update(f"{6:08x}", dict(notes[f"{6:08x}"], archived=False, archived_at=None))
+    store.add("late", make_note("added last: deploy nginx", timestamp="2025-01-05T12:00:00", tags=["ssl"]))
+
+@pytest.fixture
+def stores(tmp_path, db_path, make_note):
+    both = JsonStore(db_path), SqliteStore(str(tmp_path / "notes.sqlite"))
+    for store in both:
+        store.add_many(corpus(make_note))
+        change(store, make_note)
+    return both
+
+VIEWS = [{}, {"only_archived": True}, {"include_archived": True}]
+
+@pytest.mark.parametrize("view", VIEWS)
+def test_line_numbers_match(stores, view):
+    json_store, sqlite_store = stores
+    total = json_store.count()
+    assert sqlite_store.count() == total
+    lines = [[store.nth(n, **view) for n in range(0, total + 2)] for store in stores]
+    assert lines[0] == lines[1]
+    assert [row[:4] for row in json_store.rows(**view)] == [row[:4] for row in sqlite_store.rows(**view)]
+
+@pytest.mark.parametrize("view", VIEWS)
+@pytest.mark.parametrize("since, until", [(None, None), ("2025-01-05", None), (None, "2025-01-10"),
+                                          ("2025-01-03T05:00:00", "2025-01-15"), ("2026-01-01", None)])
+def test_listing_matches(stores, view, since, until):
+    for reverse, offset, limit in [(False, 0, None), (True, 2, 5)]:
+        found = [list(store.listing(since=since, until=until, reverse=reverse, offset=offset, limit=limit, **view))
+                 for store in stores]
+        assert found[0] == found[1]
+
+def test_tags_match(stores):
+    json_store, sqlite_store = stores
+    assert json_store.tags() == sqlite_store.tags()
+    assert json_store.tag_counts() == [tuple(row) for row in sqlite_store.tag_counts()]
+    for all_of, any_of in [(["ops"], []), (["Ops"], []), (["nginx", "Ops"], []), ([], ["deploy", "ssl"])]:
+        assert json_store.tagged(all_of, any_of) == sqlite_store.tagged(all_of, any_of)
+    assert json_store.day_counts() == [tuple(row) for row in sqlite_store.day_counts()]
+
+@pytest.mark.parametrize("query", ["nginx", "nginx ssl", "roll*", "timeout OR cert", "deploy", "ops", "zzz"])
+@pytest.mark.parametrize("only_archived", [False, True])
+def test_ranked_matches(stores, query, only_archived):
+    found = [[(line, nid, round(score, 9)) for line, nid, _, _, score in
+              store.ranked(query, top=50, only_archived=only_archived)] for store in stores]
+    assert found[0] == found[1]
+
+SEARCHES = ["nginx", "ngin", "NGINX ssl", "ce", "roll*", "timeout OR cert", "ote 1", "zzz"]
+
+@pytest.mark.parametrize("query", SEARCHES)
+@pytest.mark.parametrize("only_archived", [False, True])
+def test_search_matches(stores, query, only_archived):
+    for options in [{}, {"words": True}, {"substring": True}]:
+        found = [store.search(query, only_archived=only_archived, **options) for store in stores]
+        assert found[0] == found[1]
+
+def test_search_matches_inside_words_unless_asked_for_words(stores):
+    json_store, _ = stores
+    inside = {nid for _, nid, _, _ in json_store.search("ngin")}
+    assert inside == {nid for _, nid, _, _ in json_store.search("nginx")} and inside
+    assert json_store.search("ngin", words=True) == []
+    assert json_store.search("ngin*", words=True) == json_store.search("nginx")
+    assert {nid for _, nid, _, _ in json_store.search("cert", words=True)} < \
+           {nid for _, nid, _, _ in json_store.search("cert")}
+
+@pytest.mark.parametrize("query", SEARCHES)
+def test_where_matches(stores, query):
+    for filters in [{"text": query}, {"text": query, "tags": ["Ops"]},
+                    {"since": "2025-01-04", "until": "2025-01-12", "include_archived": True}]:
+        assert stores[0].where(**filters) == stores[1].where(**filters)
+
+def test_migrate_to_sqlite(tmp_path, db_path, make_note, monkeypatch, capsys):
+    json_store = JsonStore(db_path)
+    json_store.add_many(corpus(make_note))
+    change(json_store, make_note)
+    journal.compact(db_path)  # the archived notes go to the cold segment
+    json_store.add("after", make_note("written after the compaction"))
+    sqlite_path = str(tmp_path / "migrated.sqlite")
+    monkeypatch.setattr(cli, "DB_PATH", db_path)
+    monkeypatch.setattr(cli, "SQLITE_PATH", sqlite_path)
+    cli.migrate_to_sqlite()
+    assert "Migrated 39 note(s)" in capsys.readouterr().out
+    migrated = SqliteStore(sqlite_path)
+    assert migrated.load() == JsonStore(db_path).load(thaw=True)
+    assert [migrated.nth(n, include_archived=True) for n in range(1, 41)] == \
+           [json_store.nth(n, include_archived=True) for n in range(1, 41)]
+    # running it again adds nothing
+    cli.migrate_to_sqlite()
+    assert "Migrated 0 note(s)" in capsys.readouterr().out
+    assert migrated.count() == 39
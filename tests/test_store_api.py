@@ -0,0 +1,133 @@
+import copy, os
+import pytest
+from note import cli, journal
+from note.sqlite_store import SqliteStore
+from note.storage import JsonStore
+
+def corpus(make_note):
+    notes = []
+    for i in range(30):
+        notes.append((f"{i:08x}", make_note(
+            f"note {i} " + ("deploy failed" if i % 3 == 0 else "lunch order"),
+            timestamp=f"2025-01-{1 + i:02d}T12:00:00",
+            tags=[t for t, every in (("infra", 2), ("urgent", 5)) if i % every == 0],
+            archived=i % 7 == 0)))
+    return notes
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path, db_path, make_note, monkeypatch):
+    store = JsonStore(db_path) if request.param == "json" else SqliteStore(str(tmp_path / "notes.sqlite"))
+    store.add_many(corpus(make_note))
+    monkeypatch.setattr(cli, "get_store", lambda: store)
+    return store
+
+def expected(make_note, tags=(), since=None, until=None, text=None, include_archived=False, only_archived=False):
+    return [nid for nid, note in corpus(make_note)
+            if (note['archived'] if only_archived else include_archived or not note['archived'])
+            and set(tags) <= set(note['tags'])
+            and (since is None or note['timestamp'] >= since)
+            and (until is None or note['timestamp'] < until)
+            and (text is None or text in note['content'])]
+
+QUERIES = [{"tags": ["infra"]}, {"tags": ["infra", "urgent"]}, {"tags": ["infra"], "include_archived": True},
+           {"since": "2025-01-10", "until": "2025-01-20"}, {"until": "2025-01-05", "only_archived": True},
+           {"text": "deploy"}, {"text": "deploy", "tags": ["urgent"], "since": "2025-01-02"},
+           {"tags": ["missing"]}]
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_where(store, make_note, query):
+    assert store.where(**query) == expected(make_note, **query)
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_delete_where_hits_exactly_the_matches(store, make_note, query):
+    gone = set(expected(make_note, **query))
+    assert store.delete_where(**query) == len(gone)
+    assert set(store.load()) == {nid for nid, _ in corpus(make_note)} - gone
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_archive_where_hits_exactly_the_active_matches(store, make_note, query):
+    before = copy.deepcopy(store.load())  # the JSON store updates what load() returned
+    hit = {nid for nid in expected(make_note, **query) if not before[nid]['archived']}
+    assert store.archive_where(**query) == len(hit)
+    after = store.load()
+    for nid, note in after.items():
+        if nid in hit:
+            assert note['archived'] and note['archived_at']
+            assert dict(note, archived=False, archived_at=None) == before[nid]
+        else:
+            assert note == before[nid]
+
+def test_tag_many(store):
+    nids = store.where(tags=["urgent"], include_archived=True)
+    assert store.tag_many(nids, add=["infra"]) == 3  # those not tagged infra already
+    assert store.where(tags=["urgent", "infra"], include_archived=True) == nids
+    assert store.tag_many(nids, remove=["urgent", "nowhere"]) == len(nids)
+    assert store.where(tags=["urgent"], include_archived=True) == []
+    assert store.tag_many(["no-such-note"], add=["x"]) == 0
+
+def files(db_path):
+    directory = os.path.dirname(db_path)
+    out = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and not name.endswith(".lock"):
+            with open(path, 'rb') as f:
+                out[name] = f.read()
+    return out
+
+def test_transaction_that_raises_writes_nothing(store, make_note, db_path):
+    store.where(text="deploy")  # every index built and saved
+    store.tags()
+    store.get(store.nth(1))
+    # read through another store, so this one answers from its indexes
+    before, notes = files(db_path), copy.deepcopy(type(store)(store.path).load())
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            # reads come first: one through an index would append the writes held before it
+            store.tag_many(store.where(tags=["urgent"]), add=["late"])
+            store.add("new", make_note("added in the block"))
+            store.delete("00000001")
+            store.update("00000004", make_note("edited in the block"))
+            raise RuntimeError
+    assert store.load() == notes
+    assert store.where(text="block") == []
+    if isinstance(store, JsonStore):
+        assert files(db_path) == before
+        assert JsonStore(db_path).load() == notes
+
+def test_transaction_appends_once(store, make_note, monkeypatch):
+    if not isinstance(store, JsonStore):
+        pytest.skip("the SQLite store commits one transaction instead")
+    appends = []
+    append = journal.append
+    monkeypatch.setattr(journal, "append", lambda *a, **k: appends.append(a[1]) or append(*a, **k))
+    with store.transaction():
+        store.tag_many(["00000002"], add=["late"])
+        store.add("new", make_note("added in the block"))
+        store.delete("00000001")
+    assert [len(ops) for ops in appends] == [3]
+    assert store.delete_where(tags=["urgent"]) == 5
+    assert store.archive_where(text="deploy") == 7
+    assert [len(ops) for ops in appends] == [3, 5, 7]
+
+def test_cli_delete_matching(store, make_note, monkeypatch, capsys):
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    cli.delete_matching(["--where", "tag=INFRA", "--search", "deploy"])
+    assert capsys.readouterr().out.strip() == "Deleted 4 note(s)"
+    assert store.where(tags=["infra"], text="deploy") == []
+    cli.delete_matching(["--where", "tag=infra", "--archive"])
+    assert capsys.readouterr().out.strip() == "Deleted 3 note(s)"
+    assert store.where(tags=["infra"], include_archived=True) == expected(make_note, tags=["infra"], text="lunch")
+    for bad in (["--where", "tag"], ["--where", "colour=red"], ["--archive"], ["--search"], ["--where", "tag=x", "extra"]):
+        cli.delete_matching(bad)
+        assert capsys.readouterr().out.startswith("Usage: note del")
+
+def test_cli_tag_matching(store, make_note, capsys):
+    cli.tag_matching(["--where", "since=2025-01-25", "Late", "late"])
+    assert capsys.readouterr().out.strip() == "Added tags on 5 of 5 matching note(s): late"
+    assert store.where(tags=["late"]) == expected(make_note, since="2025-01-25")
+    cli.tag_matching(["--search", "lunch", "late"], remove=True)
+    assert capsys.readouterr().out.strip().startswith("Removed tags on 3 of ")
+    assert store.where(tags=["late"]) == expected(make_note, since="2025-01-25", text="deploy")
+    cli.tag_matching(["--where", "tag=late"])
+    assert capsys.readouterr().out.startswith("Usage: note tagadd")
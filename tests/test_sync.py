@@ -0,0 +1,66 @@
+from note import journal, sync
+from note.storage import JsonStore
+
+def notes(path):
+    return {nid: (note['content'], sorted(note.get('tags', []))) for nid, note in journal.load(path).items()}
+
+def pair(tmp_path, make_note):
+    local, remote = str(tmp_path / "local.json"), str(tmp_path / "remote.json")
+    JsonStore(local).add_many([("a", make_note("first")), ("b", make_note("second")),
+                               ("c", make_note("third", tags=["work"]))])
+    sync.sync(local, remote)
+    return local, remote
+
+def test_one_sided_changes_are_copied(tmp_path, make_note):
+    local, remote = pair(tmp_path, make_note)
+    assert notes(remote) == notes(local)
+    JsonStore(local).update("a", make_note("first, edited"))
+    JsonStore(remote).delete("b")
+    JsonStore(remote).add("d", make_note("fourth"))
+    assert sync.sync(local, remote) == (1, 2, 0)
+    assert notes(local) == notes(remote) == {
+        "a": ("first, edited", []), "c": ("third", ["work"]), "d": ("fourth", [])}
+    assert sync.sync(remote, local) == (0, 0, 0)
+
+def test_edit_on_both_sides_keeps_a_conflict_copy(tmp_path, make_note):
+    local, remote = pair(tmp_path, make_note)
+    JsonStore(local).update("c", make_note("third, edited here", tags=["work"]))
+    JsonStore(remote).update("c", make_note("third, edited there", tags=["work"]))
+    assert sync.sync(local, remote)[2] == 1
+    merged = notes(local)
+    assert merged == notes(remote)
+    copies = {nid: note for nid, note in merged.items() if sync.CONFLICT_TAG in note[1]}
+    assert len(copies) == 1
+    (copy_id, (copy, tags)), = copies.items()
+    assert tags == ["conflict", "work"]
+    assert {merged["c"][0], copy} == {"third, edited here", "third, edited there"}
+    # nothing left to do; the copy isn't a conflict of its own
+    assert sync.sync(local, remote) == (0, 0, 0)
+
+def test_conflict_ends_the_same_either_way_round(tmp_path, make_note):
+    results = []
+    for flip in (False, True):
+        (tmp_path / str(flip)).mkdir()
+        local, remote = pair(tmp_path / str(flip), make_note)
+        JsonStore(local).update("a", make_note("first, edited here"))
+        JsonStore(remote).update("a", make_note("first, edited there"))
+        sync.sync(*((remote, local) if flip else (local, remote)))
+        results.append(notes(local))
+    assert results[0] == results[1]
+    assert len(results[0]) == 4
+
+def test_same_edit_on_both_sides_is_not_a_conflict(tmp_path, make_note):
+    local, remote = pair(tmp_path, make_note)
+    JsonStore(local).update("b", make_note("second, edited"))
+    JsonStore(remote).update("b", make_note("second, edited"))
+    assert sync.sync(local, remote) == (0, 0, 0)
+    assert notes(local) == notes(remote)
+    assert len(notes(local)) == 3
+
+def test_edit_beats_delete(tmp_path, make_note):
+    local, remote = pair(tmp_path, make_note)
+    JsonStore(local).delete("a")
+    JsonStore(remote).update("a", make_note("first, kept"))
+    assert sync.sync(local, remote) == (0, 1, 0)
+    assert notes(local)["a"] == notes(remote)["a"] == ("first, kept", [])
+    assert not any(sync.CONFLICT_TAG in tags for _, tags in notes(local).values())